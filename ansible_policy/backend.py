@@ -0,0 +1,699 @@
+import os
+import json
+import asyncio
+import time
+import queue
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+import weakref
+import http.client
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List
+
+from ansible_policy.utils import (
+    init_logger,
+    eval_opa_policy,
+    get_rego_main_package_name,
+)
+from ansible_policy.catalog import PolicyCatalog
+from ansible_policy.external_data import get_opa_data_path, read_data_file
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+util_rego_path = os.path.join(os.path.dirname(__file__), "rego/utils.rego")
+
+BackendTypeSubprocess = "subprocess"
+BackendTypeServer = "server"
+supported_backends = [BackendTypeSubprocess, BackendTypeServer]
+
+item_marker = "__ansible_policy_item__"
+
+
+def make_project_data(key: str, context_json: str):
+    # a data document which is loaded as `data.agk.projects[key]`
+    return '{"agk":{"projects":{' + json.dumps(key) + ":" + context_json + "}}}"
+
+
+def load_project_context(key: str, path: str):
+    # returns the context JSON in a file written with `make_project_data()` without decoding it
+    with open(path, "r") as file:
+        data = file.read()
+    prefix = make_project_data(key, "")[:-3]
+    if not data.startswith(prefix) or not data.endswith("}}}"):
+        raise ValueError(f"`{path}` is not a project data file for the key `{key}`")
+    return data[len(prefix) : -3]
+
+
+def make_batch_query(rego_pkg_name: str):
+    # a marker is printed before each item so that `print()` outputs can be split per item later
+    return f'batch := [d | x := input.items[i]; print("{item_marker}", i); d := data.{rego_pkg_name} with input as x]'
+
+
+def make_batch_input(input_data_list: List[str]):
+    return '{"items":[' + ",".join(input_data_list) + "]}"
+
+
+def make_multi_policy_query(rego_pkg_names: List[str]):
+    # each policy is bound to `d<index>` in a single query, with a marker printed before its evaluation
+    steps = []
+    for i, rego_pkg_name in enumerate(rego_pkg_names):
+        steps.append(f'print("{item_marker}", {i})')
+        steps.append(f"d{i} := data.{rego_pkg_name}")
+    return "; ".join(steps)
+
+
+def split_messages(message: str, size: int):
+    messages = ["" for _ in range(size)]
+    current = None
+    prefix = f"{item_marker} "
+    for line in message.splitlines(keepends=True):
+        if line.startswith(prefix):
+            try:
+                current = int(line[len(prefix) :].strip())
+            except ValueError:
+                current = None
+            continue
+        if current is not None and 0 <= current < size:
+            messages[current] += line
+    return messages
+
+
+def make_eval_results(values: list, message: str, size: int):
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"the number of results does not match the number of queried items; expected {size}, but got {values}")
+    messages = split_messages(message=message, size=size)
+    eval_results = []
+    for value, _message in zip(values, messages):
+        eval_results.append({"value": value, "message": _message})
+    return eval_results
+
+
+def make_multi_policy_results(rego_paths: List[str], bindings: dict, message: str):
+    values = [bindings.get(f"d{i}") for i in range(len(rego_paths))]
+    eval_results = make_eval_results(values=values, message=message, size=len(rego_paths))
+    return dict(zip(rego_paths, eval_results))
+
+
+def eval_items_alone(backend: any, rego_path: str, input_data_list: List[str], external_data_path: str, exc: Exception):
+    # an error of a batch query is attributed to the item which causes it by evaluating the items one by one
+    if len(input_data_list) <= 1:
+        raise exc
+    logger.debug(f"the batch query of `{rego_path}` failed, so evaluating each item alone; error: {exc}")
+    eval_results = []
+    for i, input_data in enumerate(input_data_list):
+        try:
+            eval_results.append(backend.eval_policy(rego_path=rego_path, input_data=input_data, external_data_path=external_data_path))
+        except Exception as item_exc:
+            raise ValueError(f"failed to evaluate the policy `{rego_path}` for the item {i} of the batch; error: {item_exc}") from item_exc
+    return eval_results
+
+
+def eval_policies_alone(backend: any, rego_paths: List[str], input_data: str, external_data_path: str, exc: Exception):
+    # an error of a multi-policy query is attributed to the policy which causes it by evaluating the policies one by one
+    if len(rego_paths) <= 1:
+        raise exc
+    logger.debug(f"the multi-policy query failed, so evaluating each policy alone; error: {exc}")
+    eval_results = {}
+    for rego_path in rego_paths:
+        try:
+            eval_results[rego_path] = backend.eval_policy(rego_path=rego_path, input_data=input_data, external_data_path=external_data_path)
+        except Exception as policy_exc:
+            raise ValueError(f"failed to evaluate the policy `{rego_path}`; error: {policy_exc}") from policy_exc
+    return eval_results
+
+
+async def aeval_items_alone(backend: any, rego_path: str, input_data_list: List[str], external_data_path: str, exc: Exception):
+    if len(input_data_list) <= 1:
+        raise exc
+    logger.debug(f"the batch query of `{rego_path}` failed, so evaluating each item alone; error: {exc}")
+    eval_results = []
+    for i, input_data in enumerate(input_data_list):
+        try:
+            eval_results.append(await backend.aeval_policy(rego_path=rego_path, input_data=input_data, external_data_path=external_data_path))
+        except Exception as item_exc:
+            raise ValueError(f"failed to evaluate the policy `{rego_path}` for the item {i} of the batch; error: {item_exc}") from item_exc
+    return eval_results
+
+
+async def aeval_policies_alone(backend: any, rego_paths: List[str], input_data: str, external_data_path: str, exc: Exception):
+    if len(rego_paths) <= 1:
+        raise exc
+    logger.debug(f"the multi-policy query failed, so evaluating each policy alone; error: {exc}")
+    eval_results = {}
+    for rego_path in rego_paths:
+        try:
+            eval_results[rego_path] = await backend.aeval_policy(rego_path=rego_path, input_data=input_data, external_data_path=external_data_path)
+        except Exception as policy_exc:
+            raise ValueError(f"failed to evaluate the policy `{rego_path}`; error: {policy_exc}") from policy_exc
+    return eval_results
+
+
+def get_rego_package_names(rego_paths: List[str], catalog: PolicyCatalog = None):
+    rego_pkg_names = []
+    for rego_path in rego_paths:
+        if catalog:
+            rego_pkg_name = catalog.get_package_name(rego_path)
+        else:
+            rego_pkg_name = get_rego_main_package_name(rego_path=rego_path)
+        if not rego_pkg_name:
+            raise ValueError(f"`package` must be defined in the rego policy file `{rego_path}`")
+        rego_pkg_names.append(rego_pkg_name)
+    return rego_pkg_names
+
+
+@dataclass
+class SubprocessBackend(object):
+    """
+    SubprocessBackend runs one `opa eval` process for every single evaluation.
+    It is slow for large inputs but it does not keep any state, so it is used as a fallback.
+    """
+
+    executable_name: str = "opa"
+    # package names are looked up from this catalog if set, instead of reading the policy files
+    catalog: PolicyCatalog = None
+    # key: project key, value: path of a data file made by `make_project_data()`
+    project_data: dict = field(default_factory=dict)
+
+    def load(self, policy_paths: List[str], external_data_path: str = ""):
+        return
+
+    def set_project_data(self, project_data: dict):
+        self.project_data = dict(project_data)
+        return
+
+    def eval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        if self.project_data:
+            # `eval_opa_policy()` does not take the project data files
+            eval_results = self.eval_policies(rego_paths=[rego_path], input_data=input_data, external_data_path=external_data_path)
+            return eval_results[rego_path]
+        return eval_opa_policy(
+            rego_path=rego_path,
+            input_data=input_data,
+            external_data_path=get_opa_data_path(external_data_path),
+            executable_name=self.executable_name,
+            rego_pkg_name=get_rego_package_names([rego_path], self.catalog)[0],
+        )
+
+    def eval_policy_batch(self, rego_path: str, input_data_list: List[str], external_data_path: str = ""):
+        query, input_data, data_paths = self.make_batch_args(rego_path, input_data_list, external_data_path)
+        try:
+            bindings, message = self.eval_query(query=query, input_data=input_data, data_paths=data_paths)
+            return make_eval_results(values=bindings.get("batch"), message=message, size=len(input_data_list))
+        except ValueError as exc:
+            return eval_items_alone(self, rego_path, input_data_list, external_data_path, exc)
+
+    def eval_policies(self, rego_paths: List[str], input_data: str, external_data_path: str = ""):
+        query, data_paths = self.make_multi_policy_args(rego_paths, external_data_path)
+        try:
+            bindings, message = self.eval_query(query=query, input_data=input_data, data_paths=data_paths)
+            return make_multi_policy_results(rego_paths=rego_paths, bindings=bindings, message=message)
+        except ValueError as exc:
+            return eval_policies_alone(self, rego_paths, input_data, external_data_path, exc)
+
+    def eval_query(self, query: str, input_data: str, data_paths: List[str]):
+        cmd = self.make_eval_command(query=query, data_paths=data_paths)
+        proc = subprocess.run(
+            cmd,
+            input=input_data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        return self.parse_eval_output(cmd=cmd, returncode=proc.returncode, stdout=proc.stdout, stderr=proc.stderr)
+
+    async def aeval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        # a single policy is evaluated as a multi-policy query so that the same output parsing can be used
+        eval_results = await self.aeval_policies(rego_paths=[rego_path], input_data=input_data, external_data_path=external_data_path)
+        return eval_results[rego_path]
+
+    async def aeval_policy_batch(self, rego_path: str, input_data_list: List[str], external_data_path: str = ""):
+        query, input_data, data_paths = self.make_batch_args(rego_path, input_data_list, external_data_path)
+        try:
+            bindings, message = await self.aeval_query(query=query, input_data=input_data, data_paths=data_paths)
+            return make_eval_results(values=bindings.get("batch"), message=message, size=len(input_data_list))
+        except ValueError as exc:
+            return await aeval_items_alone(self, rego_path, input_data_list, external_data_path, exc)
+
+    async def aeval_policies(self, rego_paths: List[str], input_data: str, external_data_path: str = ""):
+        query, data_paths = self.make_multi_policy_args(rego_paths, external_data_path)
+        try:
+            bindings, message = await self.aeval_query(query=query, input_data=input_data, data_paths=data_paths)
+            return make_multi_policy_results(rego_paths=rego_paths, bindings=bindings, message=message)
+        except ValueError as exc:
+            return await aeval_policies_alone(self, rego_paths, input_data, external_data_path, exc)
+
+    async def aeval_query(self, query: str, input_data: str, data_paths: List[str]):
+        cmd = self.make_eval_command(query=query, data_paths=data_paths)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate(input=input_data.encode("utf-8"))
+        return self.parse_eval_output(cmd=cmd, returncode=proc.returncode, stdout=stdout.decode("utf-8"), stderr=stderr.decode("utf-8"))
+
+    def make_batch_args(self, rego_path: str, input_data_list: List[str], external_data_path: str = ""):
+        rego_pkg_name = get_rego_package_names([rego_path], self.catalog)[0]
+        data_paths = [util_rego_path, rego_path]
+        if external_data_path:
+            data_paths.append(get_opa_data_path(external_data_path))
+        data_paths.extend(self.project_data.values())
+        return make_batch_query(rego_pkg_name), make_batch_input(input_data_list), data_paths
+
+    def make_multi_policy_args(self, rego_paths: List[str], external_data_path: str = ""):
+        rego_pkg_names = get_rego_package_names(rego_paths, self.catalog)
+        data_paths = [util_rego_path] + rego_paths
+        if external_data_path:
+            data_paths.append(get_opa_data_path(external_data_path))
+        data_paths.extend(self.project_data.values())
+        return make_multi_policy_query(rego_pkg_names), data_paths
+
+    def make_eval_command(self, query: str, data_paths: List[str]):
+        cmd = [self.executable_name, "eval"]
+        for data_path in data_paths:
+            cmd.extend(["--data", data_path])
+        cmd.extend(["--stdin-input", query])
+        return cmd
+
+    @staticmethod
+    def parse_eval_output(cmd: List[str], returncode: int, stdout: str, stderr: str):
+        logger.debug(f"command: {cmd}")
+        logger.debug(f"proc.stdout: {stdout}")
+        logger.debug(f"proc.stderr: {stderr}")
+
+        if returncode != 0:
+            error = f"failed to run `opa eval` command; error details:\nSTDOUT: {stdout}\nSTDERR: {stderr}"
+            raise ValueError(error)
+
+        result = json.loads(stdout)
+        result_arr = result.get("result")
+        if not result_arr or "bindings" not in result_arr[0]:
+            raise ValueError(f"`bindings` field does not exist in the output from `opa eval` command; raw output: {stdout}")
+        return result_arr[0]["bindings"], stderr
+
+    def close(self):
+        return
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ConnectionPool(object):
+    """
+    ConnectionPool keeps keep-alive HTTP connections to a local OPA server.
+    `addr` is either `unix:///path/to/socket` or `host:port`.
+    """
+
+    def __init__(self, addr: str, size: int = 4, timeout: float = 60.0):
+        self.addr = addr
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def new_connection(self):
+        if self.addr.startswith("unix://"):
+            return UnixHTTPConnection(self.addr[len("unix://") :], timeout=self.timeout)
+        host, port = self.addr.rsplit(":", 1)
+        return http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: str = None):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self.new_connection()
+
+        headers = {"Content-Type": "application/json"}
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            # the server may close an idle keep-alive connection, so retry once with a new one
+            conn.close()
+            conn = self.new_connection()
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        return resp.status, data
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+def _stop_server_process(proc: subprocess.Popen, pool: ConnectionPool, tmp_dir: str):
+    if pool:
+        pool.close()
+    if proc and proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    if tmp_dir and os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@dataclass
+class ServerBackend(object):
+    """
+    ServerBackend starts a single `opa run --server` process which loads `rego/utils.rego`
+    and the policies once, and then queries decisions over HTTP. The external data and the
+    project contexts are pushed through the data API, so switching them does not restart the server.
+
+    `print()` outputs of policies are not returned by the OPA REST API, so they are collected
+    from the server log instead. A query and its log records are paired by serializing queries.
+    """
+
+    executable_name: str = "opa"
+    # `unix:///path/to/socket` or `host:port`; a unix socket in a temporary directory is used by default
+    addr: str = ""
+    startup_timeout: float = 10.0
+    message_timeout: float = 2.0
+    pool_size: int = 4
+    # package names are looked up from this catalog if set, instead of reading the policy files
+    catalog: PolicyCatalog = None
+
+    policy_paths: List[str] = field(default_factory=list)
+    # path of the external data in the server; it is what `load()` or a query is called with last
+    external_data_path: str = ""
+    # key: project key, value: path of a data file made by `make_project_data()`
+    project_data: dict = field(default_factory=dict)
+
+    _proc: subprocess.Popen = None
+    _pool: ConnectionPool = None
+    _tmp_dir: str = ""
+    _finalizer: any = None
+    _lock: any = None
+    _responses: any = None
+    _raw_logs: any = None
+    # key: request path, value: the number of responses whose log records did not arrive in time
+    _late_responses: dict = field(default_factory=dict)
+    # (path, mtime, size) of the external data file pushed to the server, and its top-level keys
+    _external_data_stat: tuple = None
+    _external_data_keys: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def load(self, policy_paths: List[str], external_data_path: str = ""):
+        # the lock makes a restart wait for in-flight queries and keeps concurrent callers from restarting twice
+        with self._lock:
+            missing = [p for p in policy_paths if p not in self.policy_paths]
+            if not self._proc or self._proc.poll() is not None or missing:
+                # keep policies that are already loaded so that a partial reload does not drop them
+                new_policy_paths = self.policy_paths + missing
+                self.close()
+                self.policy_paths = new_policy_paths
+                self.start()
+            self._set_external_data(external_data_path)
+        return
+
+    def start(self):
+        addr = self.addr
+        if not addr:
+            self._tmp_dir = tempfile.mkdtemp(prefix="ansible-policy-opa-")
+            addr = "unix://" + os.path.join(self._tmp_dir, "opa.sock")
+
+        cmd = [
+            self.executable_name,
+            "run",
+            "--server",
+            "--addr",
+            addr,
+            "--log-format",
+            "json",
+            "--log-level",
+            "info",
+            "--disable-telemetry",
+            util_rego_path,
+        ]
+        cmd.extend(self.policy_paths)
+        logger.debug(f"command: {cmd}")
+
+        self._responses = queue.Queue()
+        self._raw_logs = deque(maxlen=50)
+        self._late_responses = {}
+        self._external_data_stat = None
+        self._external_data_keys = []
+        self._proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        reader = threading.Thread(target=self._read_logs, args=(self._proc.stderr, self._responses, self._raw_logs), daemon=True)
+        reader.start()
+
+        self._pool = ConnectionPool(addr=addr, size=self.pool_size)
+        self._finalizer = weakref.finalize(self, _stop_server_process, self._proc, self._pool, self._tmp_dir)
+        self._wait_until_ready()
+        for key, path in self.project_data.items():
+            self._put_project_data(key=key, path=path)
+        # the external data is pushed by `load()`, since the file of the previous one may be removed
+        return
+
+    def _set_external_data(self, external_data_path: str):
+        """
+        Make the server have the contents of the external data file in its data, replacing
+        the previous one. The caller must hold `self._lock`.
+        """
+        data_path = get_opa_data_path(external_data_path) if external_data_path else ""
+        data_stat = None
+        if data_path:
+            stat = os.stat(data_path)
+            data_stat = (data_path, stat.st_mtime_ns, stat.st_size)
+        self.external_data_path = external_data_path
+        if data_stat == self._external_data_stat:
+            return
+
+        data = {}
+        if data_path:
+            data = read_data_file(data_path)
+            if not isinstance(data, dict):
+                raise ValueError(f"external data `{data_path}` must be a JSON object")
+        for key in self._external_data_keys:
+            if key not in data:
+                self._request_data(method="DELETE", path=f"/v1/data/{key}")
+        for key, value in data.items():
+            self._request_data(method="PUT", path=f"/v1/data/{key}", body=json.dumps(value))
+        self._external_data_stat = data_stat
+        self._external_data_keys = list(data)
+        return
+
+    def set_project_data(self, project_data: dict):
+        """
+        Make the server have exactly the given project contexts in `data.agk.projects`.
+        The contexts are pushed through the data API, so the server is not restarted.
+        """
+        with self._lock:
+            if self._proc and self._proc.poll() is None:
+                for key in self.project_data:
+                    if key not in project_data:
+                        self._request_project_data(method="DELETE", key=key)
+                for key, path in project_data.items():
+                    if key not in self.project_data:
+                        self._put_project_data(key=key, path=path)
+            # contexts set before the server starts are pushed by `start()`
+            self.project_data = dict(project_data)
+        return
+
+    def _put_project_data(self, key: str, path: str):
+        self._request_project_data(method="PUT", key=key, body=load_project_context(key=key, path=path))
+        return
+
+    def _request_project_data(self, method: str, key: str, body: str = None):
+        self._request_data(method=method, path=f"/v1/data/agk/projects/{key}", body=body)
+        return
+
+    def _request_data(self, method: str, path: str, body: str = None):
+        status, data = self._pool.request(method, path, body=body)
+        if status not in [200, 204] and not (method == "DELETE" and status == 404):
+            raise ValueError(f"failed to {method} `{path}` to OPA server; status: {status}, body: {data}")
+        return
+
+    def _wait_until_ready(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                break
+            try:
+                status, _ = self._pool.request("GET", "/health")
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.05)
+
+        details = "".join(self._raw_logs)
+        self.close()
+        raise ValueError(f"failed to start `opa run --server`; error details:\n{details}")
+
+    @staticmethod
+    def _read_logs(stream, responses: queue.Queue, raw_logs: deque):
+        messages = []
+        for line in stream:
+            try:
+                record = json.loads(line)
+            except Exception:
+                raw_logs.append(line)
+                continue
+            if not isinstance(record, dict):
+                continue
+            msg = record.get("msg", "")
+            if msg == "Received request.":
+                messages = []
+            elif msg == "Sent response.":
+                responses.put((record.get("req_path", ""), messages))
+                messages = []
+            elif "line" in record:
+                # outputs of `print()` in policies have their location in `line`
+                messages.append(msg)
+            else:
+                raw_logs.append(line)
+        return
+
+    def _drain_responses(self):
+        while True:
+            try:
+                path, _ = self._responses.get_nowait()
+            except queue.Empty:
+                break
+            self._skip_late_response(path)
+
+    def _skip_late_response(self, path: str):
+        # a record of a request which already timed out is not the record of the current request
+        if self._late_responses.get(path, 0) > 0:
+            self._late_responses[path] -= 1
+            return True
+        return False
+
+    def _wait_messages(self, req_path: str):
+        deadline = time.monotonic() + self.message_timeout
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                path, messages = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if self._skip_late_response(path) or path != req_path:
+                continue
+            return "".join([f"{m}\n" for m in messages])
+        # only this request fails; the record may still arrive, so it is skipped by later requests
+        self._late_responses[req_path] = self._late_responses.get(req_path, 0) + 1
+        raise ValueError(f"could not find `print()` outputs of the query `{req_path}` in the OPA server log in {self.message_timeout} seconds")
+
+    def query(self, path: str, body: str, external_data_path: str = None):
+        if not self._proc or self._proc.poll() is not None:
+            raise ValueError("OPA server is not running")
+        with self._lock:
+            # set the data in the same critical section, so a query with other external data cannot switch it in between
+            if external_data_path is not None:
+                self._set_external_data(external_data_path)
+            self._drain_responses()
+            status, data = self._pool.request("POST", path, body=body)
+            if status != 200:
+                raise ValueError(f"failed to query `{path}` to OPA server; status: {status}, body: {data}")
+            message = self._wait_messages(path)
+        logger.debug(f"query path: {path}")
+        logger.debug(f"query response: {data}")
+        logger.debug(f"query message: {message}")
+        return json.loads(data), message
+
+    def eval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        self.load(policy_paths=[rego_path], external_data_path=external_data_path)
+
+        rego_pkg_name = get_rego_package_names([rego_path], self.catalog)[0]
+        path = "/v1/data/" + rego_pkg_name.replace(".", "/")
+        body = '{"input":' + input_data + "}"
+        result, message = self.query(path=path, body=body, external_data_path=external_data_path)
+        if "result" not in result:
+            raise ValueError(f"`result` field does not exist in the response from OPA server; raw output: {result}")
+
+        eval_result = {
+            "value": result["result"],
+            "message": message,
+        }
+        return eval_result
+
+    def eval_policy_batch(self, rego_path: str, input_data_list: List[str], external_data_path: str = ""):
+        self.load(policy_paths=[rego_path], external_data_path=external_data_path)
+
+        rego_pkg_name = get_rego_package_names([rego_path], self.catalog)[0]
+        try:
+            bindings, message = self.eval_query(
+                query=make_batch_query(rego_pkg_name),
+                input_data=make_batch_input(input_data_list),
+                external_data_path=external_data_path,
+            )
+            return make_eval_results(values=bindings.get("batch"), message=message, size=len(input_data_list))
+        except ValueError as exc:
+            return eval_items_alone(self, rego_path, input_data_list, external_data_path, exc)
+
+    def eval_policies(self, rego_paths: List[str], input_data: str, external_data_path: str = ""):
+        self.load(policy_paths=rego_paths, external_data_path=external_data_path)
+
+        rego_pkg_names = get_rego_package_names(rego_paths, self.catalog)
+        try:
+            bindings, message = self.eval_query(
+                query=make_multi_policy_query(rego_pkg_names),
+                input_data=input_data,
+                external_data_path=external_data_path,
+            )
+            return make_multi_policy_results(rego_paths=rego_paths, bindings=bindings, message=message)
+        except ValueError as exc:
+            return eval_policies_alone(self, rego_paths, input_data, external_data_path, exc)
+
+    def eval_query(self, query: str, input_data: str, external_data_path: str = None):
+        body = '{"query":' + json.dumps(query) + ',"input":' + input_data + "}"
+        result, message = self.query(path="/v1/query", body=body, external_data_path=external_data_path)
+        result_arr = result.get("result")
+        if not result_arr:
+            raise ValueError(f"`result` field in the response from OPA server has no contents; raw output: {result}")
+        return result_arr[0], message
+
+    def close(self):
+        if self._finalizer:
+            self._finalizer()
+        self._finalizer = None
+        self._proc = None
+        self._pool = None
+        self._tmp_dir = ""
+        return
+
+
+def new_backend(backend_type: str, **kwargs):
+    if backend_type == BackendTypeSubprocess:
+        return SubprocessBackend(**kwargs)
+    elif backend_type == BackendTypeServer:
+        return ServerBackend(**kwargs)
+    raise ValueError(f"`{backend_type}` is not a supported backend type; it must be one of {supported_backends}")
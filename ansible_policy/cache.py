@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from ansible_policy.utils import init_logger
+from ansible_policy.backend import util_rego_path
+from ansible_policy.__version__ import __version__
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+disk_cache_filename = "decisions.sqlite3"
+
+# key: (abs path, mtime, size) of an external data file, value: sha256 of the file content
+_external_data_hashes = {}
+_external_data_lock = threading.Lock()
+
+_engine_hash = None
+
+
+def make_input_hash(input_data: str):
+    # `PolicyInput.to_json()` always serializes the same input to the same string, so the string itself is hashed
+    return hashlib.sha256(input_data.encode("utf-8")).hexdigest()
+
+
+def get_external_data_hash(external_data_path: str):
+    """
+    Returns sha256 of the external data file content. The hash is computed only once while the file is not modified.
+    """
+    if not external_data_path:
+        return ""
+    abs_path = os.path.abspath(external_data_path)
+    try:
+        stat = os.stat(abs_path)
+    except OSError:
+        return abs_path
+    stat_key = (abs_path, stat.st_mtime_ns, stat.st_size)
+    data_hash = _external_data_hashes.get(stat_key)
+    if data_hash is None:
+        sha256 = hashlib.sha256()
+        with open(abs_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        data_hash = sha256.hexdigest()
+        with _external_data_lock:
+            _external_data_hashes[stat_key] = data_hash
+    return data_hash
+
+
+def get_engine_hash():
+    """
+    Returns sha256 of the ansible-policy version and `rego/utils.rego`.
+    Every decision depends on them besides the policy, the external data and the input, so they are a part of persisted keys.
+    """
+    global _engine_hash
+    if _engine_hash is None:
+        sha256 = hashlib.sha256(__version__.encode("utf-8"))
+        with open(util_rego_path, "rb") as file:
+            sha256.update(file.read())
+        _engine_hash = sha256.hexdigest()
+    return _engine_hash
+
+
+@dataclass
+class DiskDecisionCache(object):
+    """
+    DiskDecisionCache persists evaluation results in a sqlite database under `cache_dir`.
+    The database can be shared by parallel processes; sqlite serializes the writes.
+    New results and access times are written in a single transaction by `flush()`,
+    and the least recently used results are deleted when the database is larger than `max_bytes`.
+    Any database error disables the cache instead of failing the evaluation.
+    Keys are prefixed with `namespace`, so results of another ansible-policy version are not used.
+    """
+
+    cache_dir: str = ""
+    max_bytes: int = 512 * 1024 * 1024
+    # `get_engine_hash()` by default
+    namespace: str = None
+
+    _conn: sqlite3.Connection = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _pending: dict = field(default_factory=dict, repr=False)
+    _accessed: set = field(default_factory=set, repr=False)
+
+    def __post_init__(self):
+        if self.namespace is None:
+            self.namespace = get_engine_hash()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        db_path = os.path.join(self.cache_dir, disk_cache_filename)
+        try:
+            self._conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS decisions (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS decisions_accessed ON decisions (accessed)")
+        except sqlite3.Error as exc:
+            logger.warning(f"The decision cache `{db_path}` is disabled because it cannot be opened: {exc}")
+            self._conn = None
+        return
+
+    def get(self, key: str):
+        key = self.namespace + ":" + key
+        with self._lock:
+            if not self._conn:
+                return None
+            try:
+                row = self._conn.execute("SELECT value FROM decisions WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as exc:
+                self._disable(exc)
+                return None
+            if row is None:
+                return None
+            self._accessed.add(key)
+        return json.loads(row[0])
+
+    def put(self, key: str, value: dict):
+        key = self.namespace + ":" + key
+        with self._lock:
+            if self._conn:
+                self._pending[key] = json.dumps(value, separators=(",", ":"))
+        return
+
+    def flush(self):
+        with self._lock:
+            if not self._conn or (not self._pending and not self._accessed):
+                return
+            now = time.time()
+            rows = [(key, value, len(key) + len(value), now) for key, value in self._pending.items()]
+            accessed = [(now, key) for key in self._accessed if key not in self._pending]
+            self._pending = {}
+            self._accessed = set()
+            try:
+                with self._conn:
+                    self._conn.executemany("INSERT OR REPLACE INTO decisions (key, value, size, accessed) VALUES (?, ?, ?, ?)", rows)
+                    self._conn.executemany("UPDATE decisions SET accessed = ? WHERE key = ?", accessed)
+                    if rows:
+                        self._evict()
+            except sqlite3.Error as exc:
+                self._disable(exc)
+        return
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM decisions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # delete old results until the database is shrunk to 90% of the limit, so that eviction does not run on every flush
+        excess = total - int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, size FROM decisions ORDER BY accessed")
+        keys = []
+        for key, size in cursor:
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM decisions WHERE key = ?", keys)
+        logger.debug(f"{len(keys)} results are evicted from the decision cache")
+        return
+
+    def _disable(self, exc: Exception):
+        logger.warning(f"The decision cache in `{self.cache_dir}` is disabled because of an error: {exc}")
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+        self._conn = None
+        return
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+        return
+
+
+@dataclass
+class DecisionCache(object):
+    """
+    DecisionCache keeps evaluation results keyed by (policy hash, external data hash, input hash).
+    The keys are content-addressed, so a cached result stays valid as long as the key matches.
+    The least recently used result is dropped when the cache has `max_size` results.
+    If `disk` is set, results missing in memory are looked up there, and new results are persisted to it.
+    """
+
+    # the maximum number of results in memory; 0 disables the memory cache
+    max_size: int = 4096
+    disk: DiskDecisionCache = None
+    hits: int = 0
+    # the number of hits found in `disk` (included in `hits`)
+    disk_hits: int = 0
+    misses: int = 0
+
+    _entries: OrderedDict = field(default_factory=OrderedDict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 or self.disk is not None
+
+    def get(self, key: tuple):
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.disk:
+            value = self.disk.get(":".join(key))
+            if value is not None:
+                self._put_memory(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: tuple, value: dict):
+        self._put_memory(key, value)
+        if self.disk:
+            self.disk.put(":".join(key), value)
+        return
+
+    def _put_memory(self, key: tuple, value: dict):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return
+
+    def flush(self):
+        if self.disk:
+            self.disk.flush()
+        return
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return
+
+    def close(self):
+        if self.disk:
+            self.disk.close()
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@dataclass
+class FileCache(object):
+    """
+    FileCache keeps the bodies of the files read during an evaluation run and their lines split once.
+    The least recently used files are dropped when the files have more than `max_bytes` bytes in total.
+    """
+
+    max_bytes: int = 64 * 1024 * 1024
+    # the number of files read from the disk / served from the cache
+    reads: int = 0
+    hits: int = 0
+    # the number of bytes read from the disk / served from the cache
+    bytes_read: int = 0
+    bytes_served: int = 0
+
+    # key: abs path, value: [body, lines, size]
+    _entries: OrderedDict = field(default_factory=OrderedDict, repr=False)
+    _size: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def read(self, path: str) -> str:
+        return self._get_entry(path)[0]
+
+    def read_lines(self, path: str) -> list:
+        return self.read_with_lines(path)[1]
+
+    def read_with_lines(self, path: str):
+        # returns a tuple of (body, lines) with a single lookup
+        entry = self._get_entry(path)
+        if entry[1] is None:
+            entry[1] = entry[0].splitlines()
+        return entry[0], entry[1]
+
+    def _get_entry(self, path: str):
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(abs_path)
+            if entry is not None:
+                self._entries.move_to_end(abs_path)
+                self.hits += 1
+                self.bytes_served += entry[2]
+                return entry
+        with open(abs_path, "r") as file:
+            size = os.fstat(file.fileno()).st_size
+            body = file.read()
+        entry = [body, None, size]
+        with self._lock:
+            self.reads += 1
+            self.bytes_read += size
+            if size <= self.max_bytes:
+                if abs_path in self._entries:
+                    self._size -= self._entries[abs_path][2]
+                self._entries[abs_path] = entry
+                self._size += size
+                while self._size > self.max_bytes:
+                    _, dropped = self._entries.popitem(last=False)
+                    self._size -= dropped[2]
+        return entry
+
+    def stats(self):
+        return {"reads": self.reads, "hits": self.hits, "bytes_read": self.bytes_read, "bytes_served": self.bytes_served}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        return
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,215 @@
+import os
+import re
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple
+
+from ansible_policy.policybook.native_evaluator import NativePolicy, load_native_policy
+from ansible_policy.utils import (
+    init_logger,
+    detect_agk_reference,
+    detect_agk_context_reference,
+    detect_galaxy_reference,
+    match_str_expression,
+    parse_rego_policy_metadata,
+)
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+
+@dataclass
+class PolicyMetadata(object):
+    path: str = ""
+    package: str = ""
+    # `__target__` in the policy; `task` if not defined
+    target: str = ""
+    # `__target_module__` in the policy; None if not defined
+    target_module: str = None
+    # `__tags__` in the policy; None if not defined
+    tags: list = None
+    # sha256 of the policy file content
+    hash: str = ""
+    # False if the policy never reads `input._agk`, so that its decision depends only on the target itself
+    reads_agk: bool = True
+    # False if the policy never reads the project context in `input._agk` directly (e.g. only through `agk_project()`),
+    # so that its input embeds only the target and the key of the context published as data
+    reads_agk_context: bool = True
+    # False if the policy never reads `data.galaxy` by itself, so that the external data can be pruned for a project
+    reads_galaxy: bool = True
+    # `__input_paths__` in the policy; the paths of the input which the policy reads, or None if not declared
+    input_paths: list = None
+    # the policy compiled for in-process evaluation; None if it has no AST file or it cannot be compiled
+    native: NativePolicy = field(default=None, repr=False)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, "rb") as file:
+            raw = file.read()
+        body = raw.decode("utf-8")
+        metadata = parse_rego_policy_metadata(body=body)
+        rego_hash = hashlib.sha256(raw).hexdigest()
+        return PolicyMetadata(
+            path=path,
+            package=metadata["package"],
+            target=metadata["target"],
+            target_module=metadata["target_module"],
+            tags=metadata["tags"],
+            hash=rego_hash,
+            reads_agk=detect_agk_reference(body=body),
+            reads_agk_context=detect_agk_context_reference(body=body),
+            reads_galaxy=detect_galaxy_reference(body=body),
+            input_paths=metadata["input_paths"],
+            native=PolicyMetadata.load_native(path=path, package=metadata["package"], rego_hash=rego_hash),
+        )
+
+    @staticmethod
+    def load_native(path: str, package: str, rego_hash: str):
+        ast_path = os.path.splitext(path)[0] + ".ast.json"
+        if not os.path.exists(ast_path):
+            return None
+        try:
+            native = load_native_policy(fpath=ast_path, rego_hash=rego_hash)
+        except Exception as exc:
+            logger.debug(f"the policy `{path}` is not supported by the native evaluator: {exc}")
+            return None
+        if native.package != package:
+            return None
+        return native
+
+    def match_target_type(self, target_type: str):
+        return match_str_expression(self.target, target_type)
+
+    def match_target_module(self, module_fqcn: str):
+        return match_str_expression(self.target_module, module_fqcn)
+
+
+@dataclass
+class PolicyCatalog(object):
+    """
+    PolicyCatalog keeps the metadata of rego policies in memory so that each policy file is read only once.
+    A policy which is not in the catalog yet is loaded on its first lookup.
+    """
+
+    policies: Dict[str, PolicyMetadata] = field(default_factory=dict)
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _indices: Dict[tuple, "PolicyDispatchIndex"] = field(default_factory=dict, repr=False)
+
+    @staticmethod
+    def load(policy_paths: List[str]):
+        catalog = PolicyCatalog()
+        for policy_path in policy_paths:
+            catalog.add(policy_path)
+        return catalog
+
+    def add(self, policy_path: str):
+        metadata = PolicyMetadata.load(path=policy_path)
+        with self._lock:
+            self.policies[policy_path] = metadata
+            self._indices = {}
+        logger.debug(f"policy metadata loaded: {metadata}")
+        return metadata
+
+    def get(self, policy_path: str) -> PolicyMetadata:
+        metadata = self.policies.get(policy_path)
+        if metadata is None:
+            metadata = self.add(policy_path)
+        return metadata
+
+    def remove(self, policy_path: str):
+        with self._lock:
+            self.policies.pop(policy_path, None)
+            self._indices = {}
+        return
+
+    def list(self) -> List[PolicyMetadata]:
+        return list(self.policies.values())
+
+    def get_package_name(self, policy_path: str):
+        return self.get(policy_path).package
+
+    def dispatch_index(self, policy_paths: List[str]) -> "PolicyDispatchIndex":
+        key = tuple(policy_paths)
+        index = self._indices.get(key)
+        if index is None:
+            index = PolicyDispatchIndex.build(policies=[self.get(policy_path) for policy_path in policy_paths])
+            with self._lock:
+                self._indices[key] = index
+        return index
+
+
+@dataclass
+class PatternIndex(object):
+    """
+    PatternIndex finds which patterns match a string, with the same semantics as `match_str_expression()`.
+    Exact patterns are looked up in a dict and wildcard patterns are compiled only once.
+    """
+
+    exact: Dict[str, List[int]] = field(default_factory=dict)
+    wildcards: List[Tuple[re.Pattern, int]] = field(default_factory=list)
+    any: List[int] = field(default_factory=list)
+
+    def add(self, pattern: str, pos: int):
+        if not pattern or pattern == "*":
+            self.any.append(pos)
+        elif "*" in pattern:
+            self.wildcards.append((re.compile(pattern.replace("*", ".*")), pos))
+        else:
+            if pattern not in self.exact:
+                self.exact[pattern] = []
+            self.exact[pattern].append(pos)
+        return
+
+    def lookup(self, text: str):
+        matched = set(self.any)
+        matched.update(self.exact.get(text, []))
+        for compiled, pos in self.wildcards:
+            if compiled.match(text or ""):
+                matched.add(pos)
+        return matched
+
+
+@dataclass
+class PolicyDispatchIndex(object):
+    """
+    PolicyDispatchIndex returns the policies for a target type (`__target__`) and a module FQCN (`__target_module__`).
+    Lookup results are cached, so a repeated (type, module) pair costs a single dict access.
+    """
+
+    policy_paths: List[str] = field(default_factory=list)
+    target_index: PatternIndex = field(default_factory=PatternIndex)
+    module_index: PatternIndex = field(default_factory=PatternIndex)
+
+    _cache: Dict[tuple, tuple] = field(default_factory=dict, repr=False)
+
+    @staticmethod
+    def build(policies: List[PolicyMetadata]):
+        index = PolicyDispatchIndex()
+        for pos, policy in enumerate(policies):
+            index.policy_paths.append(policy.path)
+            index.target_index.add(policy.target, pos)
+            index.module_index.add(policy.target_module, pos)
+        return index
+
+    def lookup(self, target_type: str, module_fqcn: str = None) -> Tuple[List[str], List[str]]:
+        """
+        Returns a tuple of (policies whose target type matches, policies which need to be evaluated) in the original order.
+        `module_fqcn` is checked only when it is not None.
+        """
+        key = (target_type, module_fqcn)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        type_matched = self.target_index.lookup(target_type)
+        need_eval = type_matched
+        if module_fqcn is not None:
+            need_eval = type_matched.intersection(self.module_index.lookup(module_fqcn))
+        result = (
+            [self.policy_paths[pos] for pos in sorted(type_matched)],
+            [self.policy_paths[pos] for pos in sorted(need_eval)],
+        )
+        self._cache[key] = result
+        return result
@@ -1,11 +1,17 @@
 import os
 import json
 import argparse
+from typing import Callable
 from ansible_policy.models import (
     PolicyEvaluator,
     ResultFormatter,
+    EvalModeAuto,
+    EvalTypeProject,
     supported_formats,
+    supported_eval_modes,
 )
+from ansible_policy.backend import BackendTypeServer, supported_backends
+from ansible_policy.watch import PolicyWatcher
 
 
 def eval_policy(
@@ -16,21 +22,64 @@ def eval_policy(
     config_path: str = None,
     policy_dir: str = None,
     external_data_path: str = None,
+    backend_type: str = BackendTypeServer,
+    eval_mode: str = EvalModeAuto,
+    jobs: int = 0,
+    native_eval: bool = False,
+    cache_dir: str = "",
+    cache_max_mb: int = 512,
+    incremental_dir: str = "",
+    watch: bool = False,
+    callback: Callable = None,
 ):
 
     if not external_data_path:
-        _external_data_path = os.path.join(os.path.dirname(__file__), "galaxy_data.json")
-        if os.path.exists(_external_data_path):
-            external_data_path = _external_data_path
-
-    evaluator = PolicyEvaluator(config_path=config_path, policy_dir=policy_dir)
-    result = evaluator.run(
-        eval_type=eval_type,
-        project_dir=project_dir,
-        target_data=target_data,
-        external_data_path=external_data_path,
-        variables_path=variables_path,
+        # a database made by `ansible-policy-external-data convert` is preferred because it is loaded lazily
+        for filename in ["galaxy_data.sqlite3", "galaxy_data.json"]:
+            _external_data_path = os.path.join(os.path.dirname(__file__), filename)
+            if os.path.exists(_external_data_path):
+                external_data_path = _external_data_path
+                break
+
+    evaluator = PolicyEvaluator(
+        config_path=config_path,
+        policy_dir=policy_dir,
+        backend_type=backend_type,
+        eval_mode=eval_mode,
+        jobs=jobs,
+        native_eval=native_eval,
+        cache_dir=cache_dir,
+        cache_max_mb=cache_max_mb,
+        incremental_dir=incremental_dir,
     )
+    if watch:
+        # evaluate the project again on every change until interrupted; each result is passed to `callback`
+        try:
+            watcher = PolicyWatcher(
+                evaluator=evaluator,
+                project_dir=project_dir,
+                external_data_path=external_data_path,
+                variables_path=variables_path,
+                callback=callback,
+            )
+            watcher.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            evaluator.close()
+        return None
+
+    try:
+        result = evaluator.run(
+            eval_type=eval_type,
+            project_dir=project_dir,
+            target_data=target_data,
+            external_data_path=external_data_path,
+            variables_path=variables_path,
+        )
+    finally:
+        # stop the OPA servers and the workers even if the evaluation fails
+        evaluator.close()
     return result
 
 
@@ -46,11 +95,52 @@ def main():
     parser.add_argument("--policy-dir", help="path to a directory containing policies to be evaluated")
     parser.add_argument("--external-data", default="", help="filepath to external data like knowledge base data")
     parser.add_argument("-f", "--format", default="plain", help="output format (`plain` or `json`, default to `plain`)")
+    parser.add_argument("--backend", default=BackendTypeServer, help="OPA evaluation backend (`server` or `subprocess`, default to `server`)")
+    parser.add_argument(
+        "--eval-mode",
+        default=EvalModeAuto,
+        help=(
+            "`batch` evaluates each policy over all targets with a single query, `multi` evaluates all policies for each target "
+            "with a single query, `single` evaluates them one by one, `auto` chooses `multi` or `batch` (default to `auto`)"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="the number of parallel evaluation workers (default to the number of available CPUs)",
+    )
+    parser.add_argument(
+        "--native-eval",
+        action="store_true",
+        help="evaluate policies transpiled from policybooks in-process without OPA when possible",
+    )
+    parser.add_argument("--cache-dir", default="", help="directory to persist evaluation results across runs (no persistent cache by default)")
+    parser.add_argument("--cache-max-size", type=int, default=512, help="maximum size of the persistent cache in MB (default to 512)")
+    parser.add_argument("--incremental", default="", help="directory to keep the previous project evaluation for incremental evaluation")
+    parser.add_argument("--watch", action="store_true", help="keep running and evaluate the project again whenever project or policy files change")
     args = parser.parse_args()
 
     if args.format not in supported_formats:
         raise ValueError(f"The format type `{args.format}` is not supported; it must be one of {supported_formats}")
 
+    if args.backend not in supported_backends:
+        raise ValueError(f"The backend type `{args.backend}` is not supported; it must be one of {supported_backends}")
+
+    if args.eval_mode not in supported_eval_modes:
+        raise ValueError(f"The eval mode `{args.eval_mode}` is not supported; it must be one of {supported_eval_modes}")
+
+    if args.jobs < 0:
+        raise ValueError(f"`--jobs` must be 0 or a positive number, but got `{args.jobs}`")
+
+    if args.cache_max_size < 1:
+        raise ValueError(f"`--cache-max-size` must be a positive number, but got `{args.cache_max_size}`")
+
+    if args.watch and (args.type != EvalTypeProject or not args.project_dir):
+        raise ValueError("`--watch` is supported only for the `project` type with `--project-dir`")
+
+    formatter = ResultFormatter(format_type=args.format, base_dir=os.getcwd())
+
     target_data = None
     if args.json_file:
         with open(args.json_file, "r") as f:
@@ -64,8 +154,18 @@ def main():
         config_path=args.config,
         policy_dir=args.policy_dir,
         external_data_path=args.external_data,
+        backend_type=args.backend,
+        eval_mode=args.eval_mode,
+        jobs=args.jobs,
+        native_eval=args.native_eval,
+        cache_dir=args.cache_dir,
+        cache_max_mb=args.cache_max_size,
+        incremental_dir=args.incremental,
+        watch=args.watch,
+        callback=lambda result: formatter.print(result=result),
     )
-    ResultFormatter(format_type=args.format, base_dir=os.getcwd()).print(result=result)
+    if result is not None:
+        formatter.print(result=result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,407 @@
+import os
+import json
+import shutil
+import sqlite3
+import tarfile
+import argparse
+import tempfile
+import threading
+import weakref
+from dataclasses import dataclass, field
+
+from ansible_policy.utils import (
+    init_logger,
+    ExternalDataTypeGalaxy,
+    supported_external_data_types,
+)
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+# a file with these suffixes is a database made by `convert_galaxy_data()`
+galaxy_db_suffixes = (".sqlite3", ".db")
+# increment this when the tables of the database are changed
+galaxy_db_version = 1
+
+
+@dataclass
+class GalaxyData(object):
+    """
+    GalaxyData is the `galaxy` part of an external data file with indexes for module lookups.
+    `module_name_mappings` maps a module short name to the list of FQCNs, and `modules` maps a FQCN to the module info.
+    """
+
+    path: str = ""
+    module_name_mappings: dict = field(default_factory=dict)
+    modules: dict = field(default_factory=dict)
+    # `list` if `modules` in the original data is a list; data given to OPA keeps the original shape
+    modules_format: str = "dict"
+    # the original `galaxy` dict
+    data: dict = field(default_factory=dict, repr=False)
+
+    @staticmethod
+    def from_dict(data: dict, path: str = ""):
+        data = data or {}
+        mappings = data.get("module_name_mappings") or {}
+        if not isinstance(mappings, dict):
+            raise ValueError(f"`module_name_mappings` in `{path}` must be a dict, but got {type(mappings).__name__}")
+
+        modules = data.get("modules") or {}
+        modules_format = "dict"
+        if isinstance(modules, list):
+            # a list of module info is indexed by FQCN
+            modules = {m["fqcn"]: m for m in modules if isinstance(m, dict) and m.get("fqcn")}
+            modules_format = "list"
+        if not isinstance(modules, dict):
+            raise ValueError(f"`modules` in `{path}` must be a dict or a list, but got {type(modules).__name__}")
+
+        return GalaxyData(path=path, module_name_mappings=mappings, modules=modules, modules_format=modules_format, data=data)
+
+    def find_module_fqcn(self, module_name: str):
+        if not module_name:
+            return ""
+        if module_name in self.modules:
+            return self.modules[module_name].get("fqcn", module_name)
+        found = self.module_name_mappings.get(module_name, [])
+        if found and found[0]:
+            return found[0]
+        return ""
+
+    def to_dict(self):
+        return self.data
+
+
+@dataclass
+class GalaxyDBTable(object):
+    """
+    GalaxyDBTable is a read-only dict-like view of a table in a galaxy database.
+    A value is decoded when it is looked up for the first time.
+    """
+
+    db: "GalaxyDataDB" = None
+    table: str = ""
+
+    _memo: dict = field(default_factory=dict, repr=False)
+
+    def get(self, key: str, default=None):
+        if key in self._memo:
+            value = self._memo[key]
+        else:
+            row = self.db.fetchone(f"SELECT value FROM {self.table} WHERE key = ?", (key,))
+            value = json.loads(row[0]) if row else None
+            self._memo[key] = value
+        return default if value is None else value
+
+    def __contains__(self, key: str):
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def items(self):
+        for key, value in self.db.fetchall(f"SELECT key, value FROM {self.table} ORDER BY key"):
+            yield key, json.loads(value)
+
+
+@dataclass
+class GalaxyDataDB(object):
+    """
+    GalaxyDataDB is a galaxy database made by `convert_galaxy_data()`. It has the same interface as `GalaxyData`,
+    but a module is read from the database only when it is looked up, so opening it does not depend on the size of the data.
+    """
+
+    path: str = ""
+    module_name_mappings: GalaxyDBTable = field(default=None, repr=False, compare=False)
+    modules: GalaxyDBTable = field(default=None, repr=False, compare=False)
+    modules_format: str = "dict"
+
+    _conn: sqlite3.Connection = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        weakref.finalize(self, self._conn.close)
+        row = self.fetchone("SELECT value FROM meta WHERE key = 'version'")
+        version = json.loads(row[0]) if row else None
+        if version != galaxy_db_version:
+            raise ValueError(f"`{self.path}` is a galaxy database of version `{version}`, but `{galaxy_db_version}` is expected")
+        self.module_name_mappings = GalaxyDBTable(db=self, table="module_name_mappings")
+        self.modules = GalaxyDBTable(db=self, table="modules")
+        row = self.fetchone("SELECT value FROM meta WHERE key = 'modules_format'")
+        if row:
+            self.modules_format = json.loads(row[0])
+
+    def fetchone(self, query: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()
+
+    def fetchall(self, query: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    find_module_fqcn = GalaxyData.find_module_fqcn
+
+    def to_dict(self):
+        # this reads the whole database; the lookup methods should be used instead where possible
+        data = self.get_extra()
+        data["module_name_mappings"] = dict(self.module_name_mappings.items())
+        data["modules"] = format_modules(dict(self.modules.items()), modules_format=self.modules_format)
+        return data
+
+    def get_extra(self):
+        row = self.fetchone("SELECT value FROM meta WHERE key = 'extra'")
+        return json.loads(row[0]) if row else {}
+
+    def write_json(self, file):
+        """
+        Write `{"galaxy": <the whole data>}` to the file, the same JSON as `to_dict()` gives, reading the rows
+        one by one so that the whole database is never held in memory.
+        """
+        extra = self.get_extra()
+        file.write('{"galaxy":{')
+        for key, value in extra.items():
+            file.write(json.dumps(key) + ":" + json.dumps(value, separators=(",", ":")) + ",")
+        for i, table in enumerate(["module_name_mappings", "modules"]):
+            as_list = table == "modules" and self.modules_format == "list"
+            file.write(("," if i else "") + json.dumps(table) + ":" + ("[" if as_list else "{"))
+            # a separate connection iterates the rows without holding the lock of the lookups
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                for j, (key, value) in enumerate(conn.execute(f"SELECT key, value FROM {table} ORDER BY key")):
+                    prefix = "," if j else ""
+                    file.write(prefix + value if as_list else prefix + json.dumps(key) + ":" + value)
+            finally:
+                conn.close()
+            file.write("]" if as_list else "}")
+        file.write("}}")
+        return
+
+
+def is_galaxy_db(fpath: str):
+    return fpath.endswith(galaxy_db_suffixes)
+
+
+def convert_galaxy_data(src: str, dst: str):
+    """
+    Convert an external data file (or its `.tar.gz` archive) into a galaxy database which is indexed by module names.
+    """
+    galaxy = GalaxyData.from_dict(data=read_galaxy_data(src), path=src)
+    extra = {k: v for k, v in galaxy.data.items() if k not in ["module_name_mappings", "modules"]}
+    dst_dir = os.path.dirname(os.path.abspath(dst))
+    # write to a temporary file and replace the destination with it, so that a reader never opens a partial database
+    fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix=".galaxy-", suffix=".sqlite3")
+    os.close(fd)
+    os.chmod(tmp_path, 0o644)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            with conn:
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                conn.execute("CREATE TABLE module_name_mappings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                conn.execute("CREATE TABLE modules (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    [
+                        ("version", json.dumps(galaxy_db_version)),
+                        ("extra", json.dumps(extra)),
+                        ("modules_format", json.dumps(galaxy.modules_format)),
+                    ],
+                )
+                conn.executemany(
+                    "INSERT INTO module_name_mappings (key, value) VALUES (?, ?)",
+                    [(k, json.dumps(v, separators=(",", ":"))) for k, v in galaxy.module_name_mappings.items()],
+                )
+                conn.executemany(
+                    "INSERT INTO modules (key, value) VALUES (?, ?)",
+                    [(k, json.dumps(v, separators=(",", ":"))) for k, v in galaxy.modules.items()],
+                )
+        finally:
+            conn.close()
+        os.replace(tmp_path, dst)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return
+
+
+def prune_galaxy_data(galaxy, module_names: set):
+    """
+    Returns the external data which has only the entries for `module_names` in `galaxy` (a `GalaxyData` or a `GalaxyDataDB`).
+    `get_module_fqcn()` in `data.ansible_policy` looks up only the `module` of a task, so a policy gets the same decision
+    from this data as from the whole data when `module_names` has all modules in the input.
+    `modules` has the same shape as in the original data, so that `data.galaxy.modules[name]` is resolved in the same way.
+    """
+    modules = {}
+    mappings = {}
+    for name in sorted(module_names):
+        module = galaxy.modules.get(name)
+        if module is not None:
+            modules[name] = module
+        fqcns = galaxy.module_name_mappings.get(name)
+        if fqcns is not None:
+            mappings[name] = fqcns
+    return {"galaxy": {"module_name_mappings": mappings, "modules": format_modules(modules, modules_format=galaxy.modules_format)}}
+
+
+def format_modules(modules: dict, modules_format: str):
+    # the modules indexed by FQCN are given to OPA as a list if the original data has a list
+    if modules_format == "list":
+        return list(modules.values())
+    return modules
+
+
+def read_data_file(fpath: str):
+    """
+    Returns the contents of a JSON file, or of the JSON file in a `.tar.gz` archive.
+    An archive is read in memory and is never extracted.
+    """
+    if fpath.endswith(".tar.gz"):
+        with tarfile.open(fpath, "r:gz") as tar:
+            member = find_data_member(tar=tar, fpath=fpath)
+            with tar.extractfile(member) as file:
+                return json.load(file)
+    with open(fpath, "r") as file:
+        return json.load(file)
+
+
+def read_galaxy_data(fpath: str):
+    """
+    Returns the `galaxy` dict in a JSON file, or in the JSON file in a `.tar.gz` archive.
+    """
+    data = read_data_file(fpath)
+    if not data:
+        raise ValueError("loaded galaxy data is empty")
+
+    return data.get("galaxy", {})
+
+
+def find_data_member(tar: tarfile.TarFile, fpath: str):
+    # `galaxy_data.json.tar.gz` is expected to contain `galaxy_data.json`; otherwise the first JSON file is used
+    expected_name = os.path.basename(fpath[: -len(".tar.gz")])
+    json_members = [m for m in tar.getmembers() if m.isfile() and m.name.endswith(".json")]
+    for member in json_members:
+        if os.path.basename(member.name) == expected_name:
+            return member
+    if json_members:
+        return json_members[0]
+    raise ValueError(f"`{fpath}` does not contain any JSON file")
+
+
+@dataclass
+class ExternalDataStore(object):
+    """
+    ExternalDataStore keeps loaded external data files keyed by (abs path, mtime, size),
+    so each file is parsed only once per process while it is not modified.
+    """
+
+    loads: int = 0
+
+    _entries: dict = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # key: (abs path, mtime, size) of a galaxy database, value: path of the JSON file exported for OPA
+    _exported: dict = field(default_factory=dict, repr=False)
+    _export_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _tmp_dir: str = ""
+
+    def get(self, ftype: str = "", fpath: str = ""):
+        if ftype not in supported_external_data_types:
+            raise ValueError(f"`{ftype}` is not supported as external data")
+        if ftype != ExternalDataTypeGalaxy:
+            raise NotImplementedError
+        if not fpath:
+            return None
+
+        # an uncompressed file next to the archive is used if exists
+        if fpath.endswith(".tar.gz") and os.path.exists(fpath[: -len(".tar.gz")]):
+            fpath = fpath[: -len(".tar.gz")]
+
+        abs_path = os.path.abspath(fpath)
+        stat = os.stat(abs_path)
+        stat_key = (ftype, abs_path, stat.st_mtime_ns, stat.st_size)
+        ext_data = self._entries.get(stat_key)
+        if ext_data is not None:
+            return ext_data
+
+        with self._lock:
+            # another thread may have loaded it while waiting for the lock
+            ext_data = self._entries.get(stat_key)
+            if ext_data is not None:
+                return ext_data
+            if is_galaxy_db(abs_path):
+                ext_data = GalaxyDataDB(path=abs_path)
+            else:
+                ext_data = GalaxyData.from_dict(data=read_galaxy_data(abs_path), path=abs_path)
+            # drop old versions of the same file
+            for key in [k for k in self._entries if k[:2] == stat_key[:2]]:
+                self._entries.pop(key)
+            self._entries[stat_key] = ext_data
+            self.loads += 1
+        logger.debug(f"external data `{abs_path}` is loaded")
+        return ext_data
+
+    def get_opa_data_path(self, fpath: str = ""):
+        """
+        Returns a path which OPA can load as `--data`. OPA cannot read a galaxy database,
+        so it is exported to a JSON file in a temporary directory once while it is not modified.
+        The evaluator gives OPA the whole data only for a policy which reads `data.galaxy` by itself;
+        otherwise it gives the data pruned to the modules of the targets, which never calls this for a database.
+        """
+        if not fpath or not is_galaxy_db(fpath):
+            return fpath
+        abs_path = os.path.abspath(fpath)
+        stat = os.stat(abs_path)
+        stat_key = (abs_path, stat.st_mtime_ns, stat.st_size)
+        with self._export_lock:
+            json_path = self._exported.get(stat_key)
+            if json_path:
+                return json_path
+            if not self._tmp_dir:
+                self._tmp_dir = tempfile.mkdtemp(prefix="ansible-policy-data-")
+                weakref.finalize(self, shutil.rmtree, self._tmp_dir, True)
+            json_path = os.path.join(self._tmp_dir, f"galaxy_data_{len(self._exported)}.json")
+            galaxy = self.get(ftype=ExternalDataTypeGalaxy, fpath=abs_path)
+            with open(json_path, "w") as file:
+                galaxy.write_json(file)
+            self._exported[stat_key] = json_path
+        logger.debug(f"galaxy database `{abs_path}` is exported to `{json_path}` for OPA")
+        return json_path
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return
+
+
+external_data_store = ExternalDataStore()
+
+
+def get_external_data(ftype: str = "", fpath: str = ""):
+    return external_data_store.get(ftype=ftype, fpath=fpath)
+
+
+def get_opa_data_path(fpath: str = ""):
+    return external_data_store.get_opa_data_path(fpath=fpath)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="manage external data for ansible-policy")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="convert a galaxy data JSON file (or `.tar.gz`) into an indexed database")
+    convert_parser.add_argument("-i", "--input", required=True, help="path to the galaxy data file")
+    convert_parser.add_argument(
+        "-o", "--output", required=True, help=f"path to the database to be written (must end with one of {list(galaxy_db_suffixes)})"
+    )
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        if not is_galaxy_db(args.output):
+            raise ValueError(f"`--output` must end with one of {list(galaxy_db_suffixes)}, but got `{args.output}`")
+        convert_galaxy_data(src=args.input, dst=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import jsonpickle
+from dataclasses import dataclass, field
+from typing import List
+
+from ansible_policy.utils import init_logger
+from ansible_policy.cache import get_engine_hash
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+state_filename = "state.json"
+# increment this when the format of the state or the evaluation result is changed
+state_version = 2
+
+# directories which never affect the evaluation
+ignored_dir_names = [".git"]
+
+
+def get_file_hash(path: str):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def walk_project_files(project_dir: str, exclude_dirs: List[str] = None):
+    """
+    Yields a tuple of (relative path, path) for all files in the project, in sorted order.
+    """
+    _exclude_dirs = [os.path.abspath(d) for d in (exclude_dirs or [])]
+    root_dir = os.path.abspath(project_dir)
+    if os.path.isfile(root_dir):
+        # a single playbook file
+        root_dir, filename = os.path.split(root_dir)
+        walked = [(root_dir, [], [filename])]
+    else:
+        walked = os.walk(root_dir)
+    for dirpath, dirnames, filenames in walked:
+        dirnames[:] = sorted(
+            [d for d in dirnames if d not in ignored_dir_names and os.path.join(dirpath, d) not in _exclude_dirs],
+        )
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            yield os.path.relpath(path, root_dir), path
+
+
+def make_file_manifest(project_dir: str, previous: dict = None, exclude_dirs: List[str] = None):
+    """
+    Returns a dict of {relative path: [size, mtime, sha256]} for all files in the project.
+    The hash in `previous` is reused for a file whose size and mtime are not changed, so that unchanged files are not read.
+    """
+    previous = previous or {}
+    manifest = {}
+    for relpath, path in walk_project_files(project_dir=project_dir, exclude_dirs=exclude_dirs):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        old_entry = previous.get(relpath)
+        if old_entry and old_entry[0] == stat.st_size and old_entry[1] == stat.st_mtime_ns:
+            manifest[relpath] = old_entry
+            continue
+        try:
+            file_hash = get_file_hash(path)
+        except OSError:
+            continue
+        manifest[relpath] = [stat.st_size, stat.st_mtime_ns, file_hash]
+    return manifest
+
+
+def diff_manifests(old: dict, new: dict):
+    """
+    Returns a sorted list of files which are added, removed or modified.
+    """
+    changed = []
+    for relpath, entry in new.items():
+        old_entry = old.get(relpath)
+        if not old_entry or old_entry[2] != entry[2]:
+            changed.append(relpath)
+    for relpath in old:
+        if relpath not in new:
+            changed.append(relpath)
+    return sorted(changed)
+
+
+def unit_depends_on(unit: dict, relpath: str):
+    # `unit` is a playbook, a taskfile or a role made by `make_incremental_units()`
+    if relpath in unit["files"] or relpath in unit["dirs"]:
+        return True
+    return any([relpath.startswith(d.rstrip("/") + "/") for d in unit["dirs"]])
+
+
+def find_affected_units(units: dict, changed_files: List[str]):
+    """
+    Returns a set of the keys of the units which depend on the changed files, or None if a changed file is not a part
+    of any unit (e.g. a vars file or a new file), because such a file can change targets anywhere in the project.
+    A unit which has results in the same file as an affected unit is affected too, since the results are replaced by file.
+    """
+    affected = set()
+    for relpath in changed_files:
+        keys = [key for key, unit in units.items() if unit_depends_on(unit, relpath)]
+        if not keys:
+            return None
+        affected.update(keys)
+    while True:
+        result_paths = set()
+        for key in affected:
+            result_paths.update(units[key]["results"])
+        added = [key for key, unit in units.items() if key not in affected and result_paths.intersection(unit["results"])]
+        if not added:
+            break
+        affected.update(added)
+    return affected
+
+
+def find_unneeded_files(units: dict, affected: set, files: List[str], changed_bodies: List[str]):
+    """
+    Returns the project files which a scan of the affected units does not need; the files of the other playbooks, taskfiles
+    and roles, unless an affected unit depends on them or a changed file mentions their names (e.g. a new `include_role`).
+    """
+    needed_units = [units[key] for key in affected]
+    unneeded_paths = []
+    for key, unit in units.items():
+        if key in affected:
+            continue
+        path = unit["path"]
+        if any([unit_depends_on(needed, path) for needed in needed_units]):
+            continue
+        name = os.path.basename(path.rstrip("/"))
+        if any([name in body for body in changed_bodies]):
+            continue
+        unneeded_paths.append(path)
+    unneeded = []
+    for relpath in files:
+        if not any([relpath == p or relpath.startswith(p.rstrip("/") + "/") for p in unneeded_paths]):
+            continue
+        if any([unit_depends_on(needed, relpath) for needed in needed_units]):
+            continue
+        unneeded.append(relpath)
+    return unneeded
+
+
+def make_scan_view(project_dir: str, relpaths: List[str], view_dir: str):
+    """
+    Make a copy of the project which has only the given files in `view_dir`. The files are hard links if possible,
+    so making the copy does not read the files.
+    """
+    for relpath in relpaths:
+        src = os.path.join(project_dir, relpath)
+        dst = os.path.join(view_dir, relpath)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    return
+
+
+def get_variables_hash(variables: dict):
+    if variables is None:
+        return ""
+    return hashlib.sha256(json.dumps(variables, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def encode_variables(variables: dict):
+    # variables can have values which JSON does not have (e.g. dates in YAML), so they are restored by jsonpickle
+    return json.loads(jsonpickle.encode(variables, keys=True))
+
+
+def decode_variables(data: any):
+    return jsonpickle.decode(json.dumps(data), keys=True)
+
+
+def make_fingerprint(**kwargs):
+    # everything other than the project files which can change the evaluation result
+    kwargs["version"] = state_version
+    kwargs["engine"] = get_engine_hash()
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class IncrementalState(object):
+    """
+    IncrementalState is the state of a previous project evaluation; a manifest of the project files,
+    a fingerprint of the policies and the other inputs, and the evaluation result as a dict.
+    It also has the units of the project (playbooks, taskfiles and roles) with the files they depend on
+    and the files of their results, and the variables of the project, so that a run can scan and evaluate
+    only the units which depend on the changed files.
+    """
+
+    fingerprint: str = ""
+    manifest: dict = field(default_factory=dict)
+    result: dict = None
+    # key: `<type> <filepath>` of a unit, value: a dict made by `make_incremental_units()`
+    units: dict = field(default_factory=dict)
+    # the variables of the whole project encoded by `encode_variables()`
+    variables: any = None
+
+    # the state of the previous run and the files changed since then; not saved
+    previous: "IncrementalState" = field(default=None, repr=False, compare=False)
+    changed_files: List[str] = field(default_factory=list, repr=False, compare=False)
+    # the keys of the units scanned again in this run, or None if the whole project is scanned; not saved
+    affected_units: set = field(default=None, repr=False, compare=False)
+
+    @staticmethod
+    def load(state_dir: str):
+        path = os.path.join(state_dir, state_filename)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as file:
+                data = json.load(file)
+        except Exception as exc:
+            logger.warning(f"The previous evaluation state `{path}` is ignored because it cannot be loaded: {exc}")
+            return None
+        if not isinstance(data, dict) or data.get("version") != state_version:
+            return None
+        return IncrementalState(
+            fingerprint=data.get("fingerprint", ""),
+            manifest=data.get("manifest", {}),
+            result=data.get("result"),
+            units=data.get("units", {}),
+            variables=data.get("variables"),
+        )
+
+    def save(self, state_dir: str):
+        os.makedirs(state_dir, exist_ok=True)
+        data = {
+            "version": state_version,
+            "fingerprint": self.fingerprint,
+            "manifest": self.manifest,
+            "result": self.result,
+            "units": self.units,
+            "variables": self.variables,
+        }
+        # write to a temporary file and replace the state with it, so that a parallel run never reads a partial state
+        fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix=".state-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(data, file, separators=(",", ":"))
+            os.replace(tmp_path, os.path.join(state_dir, state_filename))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return
@@ -0,0 +1,79 @@
+import json
+import math
+import jsonpickle
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# objects which orjson would encode differently from jsonpickle (dataclasses, subclasses of builtin types
+# and datetime objects) are passed to `default()`
+orjson_options = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+
+def encode_json(value: any, plain_types: tuple = ()):
+    """
+    Returns the same JSON as `jsonpickle.encode(value, unpicklable=False, make_refs=False, separators=(",", ":"))`
+    without its reflective walk. Objects of `plain_types` are encoded by their attributes; they must be plain classes
+    such as dataclasses without `__getstate__()` or `__slots__`. Any other object is encoded by jsonpickle as before.
+
+    NaN and Infinity, which are not valid JSON, are written as null like orjson does, so the JSON does not depend on
+    whether orjson is installed. If it is, the JSON is the same value but not the same string; non-ASCII characters
+    are not escaped.
+    """
+    if orjson is not None:
+
+        def _default(obj):
+            if type(obj) in plain_types:
+                return obj.__dict__
+            return jsonpickle_plain(obj)
+
+        try:
+            return orjson.dumps(value, default=_default, option=orjson_options).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # e.g. a non-string key, an integer larger than 64 bits or a reference cycle
+            pass
+    try:
+        data = to_plain(value, plain_types=plain_types)
+    except RecursionError:
+        # jsonpickle writes a reference cycle as a repr string
+        data = jsonpickle_plain(value)
+    return json.dumps(data, separators=(",", ":"))
+
+
+def to_plain(obj: any, plain_types: tuple):
+    # returns the value made of dicts, lists and primitives which is encoded into the same JSON as `obj`
+    obj_type = type(obj)
+    if obj_type is str or obj_type is int or obj_type is bool or obj is None:
+        return obj
+    if obj_type is float:
+        return obj if math.isfinite(obj) else None
+    if obj_type is dict or obj_type in plain_types:
+        plain = {}
+        for key, val in (obj if obj_type is dict else obj.__dict__).items():
+            if type(key) is not str:
+                # jsonpickle converts a non-string key with its own rules
+                return jsonpickle_plain(obj)
+            plain[key] = to_plain(val, plain_types)
+        return plain
+    if obj_type is list or obj_type is tuple or obj_type is set:
+        return [to_plain(val, plain_types) for val in obj]
+    return jsonpickle_plain(obj)
+
+
+def jsonpickle_plain(obj: any):
+    return finite_plain(json.loads(jsonpickle.encode(obj, unpicklable=False, make_refs=False)))
+
+
+def finite_plain(data: any):
+    # replaces NaN and Infinity in the decoded JSON with None
+    data_type = type(data)
+    if data_type is float:
+        return data if math.isfinite(data) else None
+    if data_type is dict:
+        return {key: finite_plain(val) for key, val in data.items()}
+    if data_type is list:
+        return [finite_plain(val) for val in data]
+    return data
@@ -1,11 +1,18 @@
 import os
 import sys
 import re
+import hashlib
 import glob
 import tempfile
-import jsonpickle
+import json
 import shutil
-from dataclasses import dataclass, field
+import queue
+import asyncio
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
 from typing import List, Union
 from ansible.executor.task_result import TaskResult
 
@@ -22,22 +29,48 @@ from ansible_policy.rego_data import (
     load_input_from_event,
     load_input_from_rest_data,
     process_input_data_with_external_data,
+    input_plain_types,
 )
+from ansible_policy.json_encoder import encode_json
 from ansible_policy.policybook.transpiler import PolicyTranspiler
+from ansible_policy.policybook.native_evaluator import NativePolicy
+from ansible_policy.backend import (
+    BackendTypeServer,
+    BackendTypeSubprocess,
+    SubprocessBackend,
+    new_backend,
+    make_project_data,
+)
+from ansible_policy.catalog import PolicyCatalog, PolicyDispatchIndex, PolicyMetadata
+from ansible_policy.external_data import get_external_data, prune_galaxy_data
+from ansible_policy.cache import DecisionCache, DiskDecisionCache, FileCache, make_input_hash, get_external_data_hash
+from ansible_policy.yaml_index import YamlPositionIndex
+from ansible_policy.incremental import (
+    IncrementalState,
+    make_file_manifest,
+    diff_manifests,
+    make_fingerprint,
+    get_file_hash,
+    walk_project_files,
+    find_affected_units,
+    find_unneeded_files,
+    make_scan_view,
+    get_variables_hash,
+    encode_variables,
+    decode_variables,
+)
 from ansible_policy.utils import (
     init_logger,
     transpile_yml_policy,
     match_str_expression,
     get_tags_from_rego_policy_file,
-    detect_target_module_pattern,
-    detect_target_type_pattern,
-    get_rego_main_package_name,
     validate_opa_installation,
-    eval_opa_policy,
-    match_target_module,
-    match_target_type,
+    get_available_cpu_count,
     find_task_line_number,
     find_play_line_number,
+    get_input_paths_key,
+    merge_input_paths,
+    find_module_names,
 )
 
 
@@ -49,12 +82,21 @@ source_pattern_re = r"[ ]*([^ #]*)[ ]*=[ ]*([^ ]+)([ ]+type[ ]?=[ ]?[^ ]+)?.*"
 
 default_policy_install_dir = "/tmp/ansible-policy/installed_policies"
 
+# the default number of `opa eval` processes in flight in `arun()` with the subprocess backend
+default_subprocess_concurrency = 64
+
 EvalTypeJobdata = "jobdata"
 EvalTypeProject = "project"
 EvalTypeTaskResult = "task_result"
 EvalTypeRest = "rest"
 EvalTypeEvent = "event"
 
+EvalModeSingle = "single"
+EvalModeBatch = "batch"
+EvalModeMulti = "multi"
+EvalModeAuto = "auto"
+supported_eval_modes = [EvalModeAuto, EvalModeSingle, EvalModeBatch, EvalModeMulti]
+
 FORMAT_PLAIN = "plain"
 FORMAT_EVENT_STREAM = "event_stream"
 FORMAT_REST = "rest"
@@ -89,7 +131,7 @@ class PolicyPattern(object):
         pp.enabled = enabled
         return pp
 
-    def check_enabled(self, filepath: str, policy_root_dir: str):
+    def check_enabled(self, filepath: str, policy_root_dir: str, catalog: PolicyCatalog = None):
         relative = os.path.relpath(filepath, policy_root_dir)
         parts = relative.split("/")
         policy_source_name = parts[0]
@@ -105,7 +147,10 @@ class PolicyPattern(object):
             elif isinstance(self.tags, list):
                 pattern_tags = set(self.tags)
 
-            tags = get_tags_from_rego_policy_file(policy_path=filepath)
+            if catalog:
+                tags = catalog.get(filepath).tags
+            else:
+                tags = get_tags_from_rego_policy_file(policy_path=filepath)
             # it tag is specified for this pattern but the policy file does not have any tag,
             # this pattern is not related to the policy
             if not tags:
@@ -168,7 +213,7 @@ class Source(object):
 
         if policybook_dir:
             tmp_dir = tempfile.TemporaryDirectory()
-            p_transpiler = PolicyTranspiler(tmp_dir=tmp_dir)
+            p_transpiler = PolicyTranspiler(tmp_dir=tmp_dir, emit_ast=True)
             p_transpiler.run(policybook_dir, target_dir)
 
         return policybook_dir
@@ -299,31 +344,126 @@ class CodeBlock(object):
 
 @dataclass
 class LineIdentifier(object):
-    def find_block(self, body: str, obj: Union[Task, Play]) -> CodeBlock:
+    """
+    LineIdentifier finds the code block of a task or a play in its file body. The line range given by the scanner
+    is used if it matches the file. Otherwise, a position index is built once for each body, and the line search
+    with the edit distance is used only when the index does not find the block.
+    """
+
+    # the files of the run; task and play files are read once for all of their blocks
+    file_cache: FileCache = None
+    # the maximum number of position indexes kept
+    max_indexes: int = 64
+    # the maximum edit distance computed exactly to rank ambiguous blocks; no limit if None
+    score_cutoff: int = None
+    # the number of blocks whose line ranges given by the scanner are used
+    scanned: int = 0
+    # the number of blocks searched in the files because the scanner gives no valid line range
+    searches: int = 0
+    # the number of blocks found by the line search
+    fallbacks: int = 0
+
+    # position indexes keyed by file body
+    _indexes: OrderedDict = field(default_factory=OrderedDict, repr=False)
+
+    def get_index(self, body: str, lines: List[str] = None) -> YamlPositionIndex:
+        index = self._indexes.get(body)
+        if index is None:
+            index = YamlPositionIndex.build(body, lines=lines)
+            self._indexes[body] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        else:
+            self._indexes.move_to_end(body)
+        return index
+
+    def find_block_in_file(self, filepath: str, obj: Union[Task, Play]) -> CodeBlock:
+        if self.file_cache is None:
+            self.file_cache = FileCache()
+        body, lines = self.file_cache.read_with_lines(filepath)
+        block = self.get_scanned_block(obj=obj, lines=lines)
+        if block:
+            self.scanned += 1
+            return block
+
+        self.searches += 1
+        return self.find_block(body=body, obj=obj, lines=lines)
+
+    def get_scanned_block(self, obj: Union[Task, Play], lines: List[str]) -> CodeBlock:
+        """
+        Return the code block given by the scanner if it is found at the same lines of the file.
+        The first line of the scanned YAML must be the first line of the range, or the range must begin
+        with a list item which has the task name when the YAML is not given.
+        """
+        line_num_in_file = getattr(obj, "line_num_in_file", None)
+        if not isinstance(line_num_in_file, list) or len(line_num_in_file) != 2:
+            return None
+        begin, end = line_num_in_file
+        if not isinstance(begin, int) or not isinstance(end, int) or not 1 <= begin <= end <= len(lines):
+            return None
+
+        first_line = lines[begin - 1].strip()
+        yaml_lines = getattr(obj, "yaml_lines", "")
+        if yaml_lines:
+            scanned_first_line = next((line.strip() for line in yaml_lines.splitlines() if line.strip()), "")
+            if scanned_first_line != first_line:
+                return None
+        else:
+            if not first_line.startswith("-"):
+                return None
+            if obj.name and not any(str(obj.name) in line for line in lines[begin - 1 : end]):
+                return None
+        return CodeBlock(begin=begin, end=end)
+
+    def find_block(self, body: str, obj: Union[Task, Play], lines: List[str] = None) -> CodeBlock:
         if not body:
             return None
 
         if not isinstance(obj, (Task, Play)):
             raise TypeError(f"find a code block for {type(obj)} object is not supported")
 
+        index = self.get_index(body, lines=lines)
         if isinstance(obj, Task):
             task = obj
+            block = index.find_task(
+                task_name=task.name,
+                module_name=task.module,
+                module_options=task.module_options,
+                task_options=task.options,
+                score_cutoff=self.score_cutoff,
+            )
+            if block:
+                return CodeBlock(begin=block.begin, end=block.end)
+
+            self.fallbacks += 1
             _, lines = find_task_line_number(
                 yaml_body=body,
                 task_name=task.name,
                 module_name=task.module,
                 module_options=task.module_options,
                 task_options=task.options,
+                score_cutoff=self.score_cutoff,
             )
             if lines and len(lines) == 2:
                 return CodeBlock(begin=lines[0], end=lines[1])
 
         elif isinstance(obj, Play):
             play = obj
+            block = index.find_play(
+                play_name=play.name,
+                play_options=play.options,
+                play_index=play.index,
+                score_cutoff=self.score_cutoff,
+            )
+            if block:
+                return CodeBlock(begin=block.begin, end=block.end)
+
+            self.fallbacks += 1
             _, lines = find_play_line_number(
                 yaml_body=body,
                 play_name=play.name,
                 play_options=play.options,
+                score_cutoff=self.score_cutoff,
             )
             if lines and len(lines) == 2:
                 return CodeBlock(begin=lines[0], end=lines[1])
@@ -420,6 +560,10 @@ class TargetResult(object):
     action_type: str = ""
     message: str = None
 
+    @staticmethod
+    def from_dict(data: dict):
+        return TargetResult(**data)
+
 
 @dataclass
 class PolicyResult(object):
@@ -428,6 +572,12 @@ class PolicyResult(object):
     violation: bool = False
     targets: List[TargetResult] = field(default_factory=list)
 
+    @staticmethod
+    def from_dict(data: dict):
+        policy_result = PolicyResult(**data)
+        policy_result.targets = [TargetResult.from_dict(t) for t in data.get("targets", [])]
+        return policy_result
+
     def add_target_result(self, obj: any, lines: dict, validated: bool, message: str, action_type: str):
         target_name = getattr(obj, "name", None)
         target = TargetResult(name=target_name, lines=lines, validated=validated, message=message, action_type=action_type)
@@ -444,6 +594,12 @@ class FileResult(object):
     policies: List[PolicyResult] = field(default_factory=list)
     metadata: dict = field(default_factory=dict)
 
+    @staticmethod
+    def from_dict(data: dict):
+        file_result = FileResult(**data)
+        file_result.policies = [PolicyResult.from_dict(p) for p in data.get("policies", [])]
+        return file_result
+
     def add_policy_result(
         self,
         eval_result: dict,
@@ -452,8 +608,14 @@ class FileResult(object):
         target_type: str,
         obj: any,
         lines: dict,
+        policy_result: PolicyResult = None,
     ):
-        policy_result = self.get_policy_result(policy_name=policy_name)
+        """
+        Add a target result to the result of the policy, which is created if not found, and return the policy result.
+        `policy_result` can be given if the caller already knows the result of the policy in this file.
+        """
+        if policy_result is None:
+            policy_result = self.get_policy_result(policy_name=policy_name)
         need_append = False
         validated = ValidationType.from_eval_result(eval_result=eval_result, is_target_type=is_target_type)
         action_type = ActionType.from_eval_result(eval_result=eval_result, is_target_type=is_target_type)
@@ -469,9 +631,10 @@ class FileResult(object):
         if need_append:
             self.policies.append(policy_result)
 
-        if any([p.violation for p in self.policies]):
+        # `violation` of a policy is never reset, so only the updated policy needs to be checked
+        if policy_result.violation:
             self.violation = True
-        return
+        return policy_result
 
     def get_policy_result(self, policy_name: str):
         for p in self.policies:
@@ -488,32 +651,31 @@ class EvaluationSummary(object):
     @staticmethod
     def from_files(files: List[FileResult]):
         total_files = len(files)
-        file_names = []
+        # dicts are used as ordered sets
+        file_names = {}
         violation_files = 0
-        policy_names = []
-        violation_policy_names = []
+        policy_names = {}
+        violation_policy_names = {}
         for f in files:
             for p in f.policies:
-                if p.policy_name not in policy_names:
-                    policy_names.append(p.policy_name)
-                if p.violation and p.policy_name not in violation_policy_names:
-                    violation_policy_names.append(p.policy_name)
+                policy_names[p.policy_name] = True
+                if p.violation:
+                    violation_policy_names[p.policy_name] = True
             if f.violation:
                 violation_files += 1
-            if f.path not in file_names:
-                file_names.append(f.path)
+            file_names[f.path] = True
         total_policies = len(policy_names)
         violation_policies = len(violation_policy_names)
         policies_data = {
             "total": total_policies,
             "violation_detected": violation_policies,
-            "list": policy_names,
+            "list": list(policy_names),
         }
         files_data = {
             "total": total_files,
             "validated": total_files - violation_files,
             "not_validated": violation_files,
-            "list": file_names,
+            "list": list(file_names),
         }
         return EvaluationSummary(
             policies=policies_data,
@@ -523,9 +685,46 @@ class EvaluationSummary(object):
 
 @dataclass
 class EvaluationResult(object):
+    """
+    EvaluationResult is the result of an evaluation run. Results are added in constant time by indexes of
+    the file and policy results, and `summary` is kept current as they are added; `finalize()` rebuilds it
+    in the order of the files. The indexes are plain attributes, not a part of the result.
+    """
+
     summary: EvaluationSummary = None
     files: List[FileResult] = field(default_factory=list)
 
+    def __post_init__(self):
+        # key: filepath, value: FileResult
+        self._file_index = {}
+        # key: (filepath, policy name), value: PolicyResult
+        self._policy_index = {}
+        # key: policy name, value: True if the policy is violated in any file
+        self._policy_violations = {}
+        # the list of the files and its length when the indexes are built or last updated
+        self._indexed_files = None
+        self._indexed_count = 0
+
+    def __getstate__(self):
+        # the indexes are rebuilt from the files when they are needed
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.__post_init__()
+
+    @staticmethod
+    def from_dict(data: dict):
+        result = EvaluationResult()
+        if data.get("summary") is not None:
+            result.summary = EvaluationSummary(**data["summary"])
+        result.files = [FileResult.from_dict(f) for f in data.get("files", [])]
+        return result
+
+    def to_dict(self):
+        # the same structure as the JSON output
+        return json.loads(encode_result(self))
+
     def add_single_result(
         self,
         eval_result: dict,
@@ -537,34 +736,238 @@ class EvaluationResult(object):
         lines: dict,
         metadata: dict = {},
     ):
-        file_result = self.get_file_result(filepath=filepath)
-        need_append = False
-        if not file_result:
+        self.ensure_index()
+
+        file_result = self._file_index.get(filepath)
+        is_new_file = not file_result
+        if is_new_file:
             file_result = FileResult(
                 path=filepath,
                 metadata=metadata,
             )
-            need_append = True
+            self.files.append(file_result)
+            self._file_index[filepath] = file_result
+            self._indexed_count += 1
+        file_violation = file_result.violation
 
-        file_result.add_policy_result(
+        policy_key = (filepath, policy_name)
+        policy_result = file_result.add_policy_result(
             eval_result=eval_result,
             is_target_type=is_target_type,
             policy_name=policy_name,
             target_type=target_type,
             obj=obj,
             lines=lines,
+            policy_result=self._policy_index.get(policy_key),
         )
-        if need_append:
-            self.files.append(file_result)
+        self._policy_index[policy_key] = policy_result
+        self.update_summary(file_result=file_result, policy_result=policy_result, is_new_file=is_new_file, file_violation=file_violation)
+        return
 
+    def update_summary(self, file_result: FileResult, policy_result: PolicyResult, is_new_file: bool, file_violation: bool):
+        # update the counts in the same way as `EvaluationSummary.from_files()` for a single added result
+        files = self.summary.files
+        if is_new_file:
+            files["total"] += 1
+            files["validated"] += 1
+            files["list"].append(file_result.path)
+        if file_result.violation and not file_violation:
+            files["validated"] -= 1
+            files["not_validated"] += 1
+
+        policies = self.summary.policies
+        policy_name = policy_result.policy_name
+        if policy_name not in self._policy_violations:
+            self._policy_violations[policy_name] = False
+            policies["total"] += 1
+            policies["list"].append(policy_name)
+        if policy_result.violation and not self._policy_violations[policy_name]:
+            self._policy_violations[policy_name] = True
+            policies["violation_detected"] += 1
+        return
+
+    def finalize(self):
+        # rebuild the summary after all results are added, so its lists are in the order of the files
+        self.summary = EvaluationSummary.from_files(self.files)
+        return self
+
+    def build_index(self):
+        self._file_index = {}
+        self._policy_index = {}
+        self._policy_violations = {}
+        for f in self.files:
+            self._file_index.setdefault(f.path, f)
+            for p in f.policies:
+                self._policy_index.setdefault((f.path, p.policy_name), p)
+                self._policy_violations[p.policy_name] = self._policy_violations.get(p.policy_name, False) or p.violation
         self.summary = EvaluationSummary.from_files(self.files)
+        self._indexed_files = self.files
+        self._indexed_count = len(self.files)
+        return
+
+    def ensure_index(self):
+        # the files are given or modified without `add_single_result()`, e.g. by `from_dict()`; a path can
+        # appear more than once in such files, so the number of the indexed files is compared instead of the index size
+        if self.summary is None or self._indexed_files is not self.files or self._indexed_count != len(self.files):
+            self.build_index()
         return
 
     def get_file_result(self, filepath: str):
+        self.ensure_index()
+        return self._file_index.get(filepath)
+
+    def replace_files(self, files: List[FileResult], paths: set):
+        """
+        Returns a new result whose file results at `paths` are replaced with `files`. A replaced file keeps its position,
+        and a file which is not in this result is added at the end.
+        """
+        new_files = {f.path: f for f in files}
+        merged = []
         for f in self.files:
-            if f.path == filepath:
-                return f
-        return None
+            if f.path in paths or f.path in new_files:
+                new_file = new_files.pop(f.path, None)
+                if new_file is not None:
+                    merged.append(new_file)
+                continue
+            merged.append(f)
+        merged.extend(new_files.values())
+        return EvaluationResult(files=merged).finalize()
+
+
+# classes which jsonpickle encodes by their attributes; `encode_result()` encodes them without jsonpickle
+result_plain_types = (TargetResult, PolicyResult, FileResult, EvaluationSummary)
+
+
+def encode_result(result: EvaluationResult):
+    # the same JSON as `jsonpickle.encode(result, unpicklable=False, make_refs=False, separators=(",", ":"))`
+    return encode_json(result.__getstate__(), plain_types=result_plain_types + input_plain_types)
+
+
+@dataclass
+class EvaluationStats(object):
+    # the number of (target, policy) pairs decided by a cached result
+    cache_hits: int = 0
+    # the number of cache hits found in the on-disk cache
+    disk_cache_hits: int = 0
+    # the number of (target, policy) pairs looked up in the cache but evaluated
+    cache_misses: int = 0
+    # the number of results in the cache
+    cache_size: int = 0
+    # the number of `{{ var }}` templates whose resolved values are reused / resolved in the finished runs
+    variable_cache_hits: int = 0
+    variable_cache_misses: int = 0
+    # the number of self-referencing variables which are left unresolved
+    variable_cycles: int = 0
+    # the number of source files read from the disk / served from the file cache of the runs, and their bytes
+    file_reads: int = 0
+    file_cache_hits: int = 0
+    file_bytes_read: int = 0
+    file_bytes_served: int = 0
+    # the number of targets whose line ranges given by the scanner are used
+    scanned_lines_used: int = 0
+    # the number of targets searched in their files because the scanner gives no valid line range,
+    # and the number of them not found in the position index but by the line search
+    line_searches: int = 0
+    line_search_fallbacks: int = 0
+
+
+@dataclass
+class EvaluationTarget(object):
+    input_type: str = ""
+    input_data: PolicyInput = None
+    filepath: str = ""
+    lines: dict = None
+    metadata: dict = field(default_factory=dict)
+
+    @property
+    def object(self):
+        return self.input_data.object
+
+
+@dataclass
+class EvaluationUnit(object):
+    """
+    EvaluationUnit is a single backend call which decides one or more (target index, policy path) pairs.
+    """
+
+    # one of `eval_policy`, `eval_policy_batch` and `eval_policies`
+    method: str = ""
+    kwargs: dict = field(default_factory=dict)
+    keys: List[tuple] = field(default_factory=list)
+    # decision cache keys for `keys`; empty if the results are not cached
+    cache_keys: List[tuple] = field(default_factory=list)
+
+    def run(self, backend: any):
+        return getattr(backend, self.method)(**self.kwargs)
+
+    async def arun(self, backend: any):
+        # use the native async method of the backend if any; otherwise run the blocking one in a worker thread
+        async_method = getattr(backend, f"a{self.method}", None)
+        if async_method:
+            return await async_method(**self.kwargs)
+        return await asyncio.to_thread(self.run, backend)
+
+    def set_decisions(self, decisions: dict, result: any, cache: DecisionCache = None):
+        if self.method == "eval_policy_batch":
+            eval_results = result
+        elif self.method == "eval_policies":
+            eval_results = [result[policy_path] for _, policy_path in self.keys]
+        else:
+            eval_results = [result]
+        for key, eval_result in zip(self.keys, eval_results):
+            decisions[key] = (True, eval_result)
+        if cache is not None:
+            for cache_key, eval_result in zip(self.cache_keys, eval_results):
+                cache.put(cache_key, eval_result)
+        return
+
+
+def make_incremental_units(targets: List[EvaluationTarget]):
+    """
+    Returns a tuple of (units, a dict of {id of a target object: unit key}) for the targets of a project scan.
+    A unit is a playbook, a taskfile or a role, whose targets are scanned and evaluated together in an incremental run.
+    It has the files which its targets come from (e.g. included taskfiles), the role directories which they use,
+    the files of its results, and the hash of the variables set in its tree.
+    """
+    if not targets:
+        return {}, {}
+    base_input = targets[0].input_data
+    tree_variables = base_input.tree_variables or {}
+    role_dirs = [role.filepath for role in base_input.roles.values() if role.filepath]
+    units = {}
+    target_units = {}
+
+    def add_unit(unit_type: str, obj: any, members: list):
+        key = f"{unit_type} {obj.filepath}"
+        files = {obj.filepath}
+        files.update([m.filepath for m in members if getattr(m, "filepath", "")])
+        dirs = {d for d in role_dirs if any([f.startswith(d.rstrip("/") + "/") for f in files])}
+        if unit_type == "role":
+            dirs.add(obj.filepath)
+        units[key] = {
+            "type": unit_type,
+            "path": obj.filepath,
+            "files": sorted(files),
+            "dirs": sorted(dirs),
+            "results": [],
+            "variables": get_variables_hash(tree_variables.get(obj.key)),
+        }
+        for member in members:
+            target_units[id(member)] = key
+        return
+
+    for playbook in base_input.playbooks.values():
+        add_unit("playbook", playbook, playbook.tasks + playbook.plays)
+    for taskfile in base_input.taskfiles.values():
+        add_unit("taskfile", taskfile, taskfile.tasks)
+    for role in base_input.roles.values():
+        add_unit("role", role, [role] + [task for taskfile in role.taskfiles.values() for task in taskfile.tasks])
+
+    for target in targets:
+        key = target_units.get(id(target.object))
+        if key and target.filepath not in units[key]["results"]:
+            units[key]["results"].append(target.filepath)
+    return units, target_units
 
 
 @dataclass
@@ -573,13 +976,74 @@ class PolicyEvaluator(object):
     policy_dir: str = ""
     root_dir: str = ""
     need_cleanup: bool = False
+    # `server` keeps a single OPA server process per evaluator; `subprocess` runs `opa eval` for each evaluation
+    backend_type: str = BackendTypeServer
+    # `batch` evaluates a policy over all targets of the same type with a single query;
+    # `multi` evaluates all policies for a target with a single query; `single` queries each pair one by one;
+    # `auto` uses `multi` for a single input such as an event and `batch` otherwise
+    eval_mode: str = EvalModeAuto
 
     patterns: List[PolicyPattern] = field(default_factory=list)
     sources: List[Source] = field(default_factory=list)
+    # the number of worker threads for evaluation; 0 means the number of available CPUs
+    jobs: int = 0
+    # the maximum number of evaluations in flight in `arun()`; 0 means the number the backend can actually run at a time,
+    # which is `jobs` for the server backend and `default_subprocess_concurrency` for the subprocess backend
+    concurrency: int = 0
+    # if True, policies transpiled from policybooks are evaluated in-process instead of OPA when possible
+    native_eval: bool = False
+    # the maximum number of decisions cached in memory; 0 disables the cache
+    cache_size: int = 4096
+    # a directory to persist decisions across runs; no on-disk cache if empty
+    cache_dir: str = ""
+    # the maximum size of the on-disk cache in MB
+    cache_max_mb: int = 512
+    # a directory to keep the state of the previous project evaluation; project evaluations are incremental if set
+    incremental_dir: str = ""
+    # the maximum edit distance computed exactly when a task or a play matches several blocks in its file; no limit if None
+    line_score_cutoff: int = None
+
+    # metadata of all installed policies; built once when the evaluator is created
+    catalog: PolicyCatalog = None
+    backend: any = None
+    decision_cache: DecisionCache = None
+    # additional backends for worker threads; created only when `jobs` is larger than 1
+    worker_backends: list = field(default_factory=list)
+
+    _worker_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # key: project key, value: path of the project data file; the contexts of the projects being evaluated
+    _project_data: dict = field(default_factory=dict, repr=False)
+    # key: project key, value: the number of evaluations using the context
+    _project_data_refs: dict = field(default_factory=dict, repr=False)
+    _project_data_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # key: path of a pruned external data file, value: the number of evaluations using the file
+    _opa_data_refs: dict = field(default_factory=dict, repr=False)
+    _opa_data_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _semaphore: tuple = field(default=None, repr=False)
+    # the statistics of the variable resolvers of the finished runs
+    _variable_stats: dict = field(default_factory=dict, repr=False)
+    # the statistics of the file caches and the line identifiers of the finished runs
+    _file_stats: dict = field(default_factory=dict, repr=False)
 
     def __post_init__(self):
         validate_opa_installation()
 
+        if self.eval_mode not in supported_eval_modes:
+            raise ValueError(f"`{self.eval_mode}` is not a supported eval mode; it must be one of {supported_eval_modes}")
+
+        if self.jobs < 0:
+            raise ValueError(f"`jobs` must be 0 or a positive number, but got `{self.jobs}`")
+        if not self.jobs:
+            self.jobs = get_available_cpu_count()
+        if self.concurrency < 0:
+            raise ValueError(f"`concurrency` must be 0 or a positive number, but got `{self.concurrency}`")
+        if self.cache_size < 0:
+            raise ValueError(f"`cache_size` must be 0 or a positive number, but got `{self.cache_size}`")
+        if self.cache_max_mb < 1:
+            raise ValueError(f"`cache_max_mb` must be a positive number, but got `{self.cache_max_mb}`")
+        if self.line_score_cutoff is not None and self.line_score_cutoff < 0:
+            raise ValueError(f"`line_score_cutoff` must be 0 or a positive number, but got `{self.line_score_cutoff}`")
+
         if self.config_path:
             cfg = Config.load(filepath=self.config_path)
             self.patterns = cfg.policy.patterns
@@ -592,8 +1056,8 @@ class PolicyEvaluator(object):
             self.sources.append(source)
 
         if not self.root_dir:
-            tmp_dir = tempfile.TemporaryDirectory()
-            self.root_dir = tmp_dir.name
+            # not a `TemporaryDirectory` object, which would remove the directory whenever it is garbage-collected
+            self.root_dir = tempfile.mkdtemp(prefix="ansible-policy-")
             self.need_cleanup = True
 
         installed_path_list = []
@@ -605,16 +1069,96 @@ class PolicyEvaluator(object):
                 )
                 if installed_path:
                     installed_path_list.append(installed_path)
+
+        if not self.catalog:
+            self.catalog = PolicyCatalog.load(policy_paths=self.find_policy_files())
+
+        if self.decision_cache is None:
+            disk_cache = None
+            # the decisions of the previous run are kept in the incremental state directory unless `cache_dir` is given
+            disk_cache_dir = self.cache_dir or self.incremental_dir
+            if disk_cache_dir:
+                disk_cache = DiskDecisionCache(cache_dir=disk_cache_dir, max_bytes=self.cache_max_mb * 1024 * 1024)
+            self.decision_cache = DecisionCache(max_size=self.cache_size, disk=disk_cache)
+
+        if not self.backend:
+            self.backend = new_backend(backend_type=self.backend_type, catalog=self.catalog)
+        if not self.concurrency:
+            self.concurrency = self.get_max_in_flight()
+        return
+
+    def get_max_in_flight(self):
+        """
+        Returns the number of evaluations `arun()` can actually have in flight. An OPA server answers one query at a time,
+        because its `print()` outputs are paired with the query through the server log, so the server backend has at most
+        one evaluation in flight per worker server regardless of `concurrency`. `opa eval` processes run independently.
+        """
+        if isinstance(self.backend, SubprocessBackend):
+            return self.concurrency or default_subprocess_concurrency
+        return min(self.jobs, self.concurrency or self.jobs)
+
+    @property
+    def stats(self):
+        return EvaluationStats(
+            cache_hits=self.decision_cache.hits,
+            disk_cache_hits=self.decision_cache.disk_hits,
+            cache_misses=self.decision_cache.misses,
+            cache_size=len(self.decision_cache),
+            variable_cache_hits=self._variable_stats.get("resolve_hits", 0),
+            variable_cache_misses=self._variable_stats.get("resolve_misses", 0),
+            variable_cycles=self._variable_stats.get("cycles", 0),
+            file_reads=self._file_stats.get("reads", 0),
+            file_cache_hits=self._file_stats.get("hits", 0),
+            file_bytes_read=self._file_stats.get("bytes_read", 0),
+            file_bytes_served=self._file_stats.get("bytes_served", 0),
+            scanned_lines_used=self._file_stats.get("scanned", 0),
+            line_searches=self._file_stats.get("searches", 0),
+            line_search_fallbacks=self._file_stats.get("fallbacks", 0),
+        )
+
+    def close(self):
+        if self.decision_cache is not None:
+            self.decision_cache.close()
+        if self.backend:
+            self.backend.close()
+        for backend in self.worker_backends:
+            backend.close()
+        self.worker_backends = []
+        with self._opa_data_lock:
+            self._opa_data_refs = {}
+            if self.root_dir:
+                shutil.rmtree(os.path.join(self.root_dir, "external_data"), ignore_errors=True)
         return
 
     def __del__(self):
+        self.close()
         if self.need_cleanup and self.root_dir and os.path.exists(self.root_dir):
-            try:
-                os.remove(self.root_dir)
-            except Exception:
-                pass
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def reload_policies(self):
+        """
+        Install the policy sources again, then rebuild the catalog and restart the backends with the new policies.
+        Cached decisions of the old policies are never used because their keys have the old policy hashes.
+        """
+        for source in self.sources:
+            if source.type != "path":
+                continue
+            # remove the installed policies first so that a deleted policy does not remain
+            installed_dir = os.path.join(self.root_dir, source.name)
+            if os.path.exists(installed_dir):
+                shutil.rmtree(installed_dir)
+            source.install(install_root_dir=self.root_dir, force=True)
+
+        self.catalog = PolicyCatalog.load(policy_paths=self.find_policy_files())
+        if self.backend:
+            self.backend.close()
+        for backend in self.worker_backends:
+            backend.close()
+        self.worker_backends = []
+        self.backend = new_backend(backend_type=self.backend_type, catalog=self.catalog)
+        return
 
-    def list_enabled_policies(self):
+    def find_policy_files(self):
         policy_dir = self.root_dir
         rego_policy_pattern_1 = os.path.join(policy_dir, "**", "policies/*.rego")
         found_files_1 = glob.glob(pathname=rego_policy_pattern_1, recursive=True)
@@ -625,13 +1169,17 @@ class PolicyEvaluator(object):
             found_files.extend(found_files_1)
         if found_files_2:
             found_files.extend(found_files_2)
+        return found_files
+
+    def list_enabled_policies(self):
+        found_files = self.find_policy_files()
         # sort patterns by their name because a longer pattern is prioritized than a shorter one
         patterns = sorted(self.patterns, key=lambda x: len(x.name))
 
         policies_and_enabled = {}
         for policy_filepath in found_files:
             for pattern in patterns:
-                enabled = pattern.check_enabled(filepath=policy_filepath, policy_root_dir=self.root_dir)
+                enabled = pattern.check_enabled(filepath=policy_filepath, policy_root_dir=self.root_dir, catalog=self.catalog)
                 # if enabled is None, it means this pattern is not related to the policy
                 if enabled is None:
                     continue
@@ -653,6 +1201,292 @@ class PolicyEvaluator(object):
         external_data_path: str = "",
         variables_path: str = "",
     ):
+        if self.incremental_dir and eval_type == EvalTypeProject:
+            state, result = self.load_incremental_state(project_dir=project_dir, external_data_path=external_data_path, variables_path=variables_path)
+            if result:
+                return result
+            result = self.run_project(state=state, project_dir=project_dir, external_data_path=external_data_path, variables_path=variables_path)
+            state.save(state_dir=self.incremental_dir)
+            return result
+
+        policy_files, targets = self.load_targets(
+            eval_type=eval_type,
+            project_dir=project_dir,
+            target_data=target_data,
+            task_result=task_result,
+            event=event,
+            rest_request=rest_request,
+            external_data_path=external_data_path,
+            variables_path=variables_path,
+        )
+        decisions = self.eval_targets(targets=targets, policy_files=policy_files, external_data_path=external_data_path)
+        result = self.make_result(targets=targets, policy_files=policy_files, decisions=decisions)
+        self.release_variable_resolvers(targets=targets)
+        return result
+
+    async def arun(
+        self,
+        eval_type: str = "project",
+        project_dir: str = "",
+        target_data: dict = None,
+        task_result: TaskResult = None,
+        event: Event = None,
+        rest_request: APIRequest = None,
+        external_data_path: str = "",
+        variables_path: str = "",
+    ):
+        """
+        An asyncio version of `run()`. Loading inputs runs in a worker thread, and evaluations are awaited
+        with at most `get_max_in_flight()` of them in flight, so the event loop is not blocked.
+        With the server backend, that is at most `jobs` evaluations, each of which runs in a worker thread;
+        use the subprocess backend to keep more of them in flight with asyncio subprocesses.
+        """
+        if self.incremental_dir and eval_type == EvalTypeProject:
+            state, result = await asyncio.to_thread(
+                self.load_incremental_state,
+                project_dir=project_dir,
+                external_data_path=external_data_path,
+                variables_path=variables_path,
+            )
+            if result:
+                return result
+            result = await self.arun_project(
+                state=state, project_dir=project_dir, external_data_path=external_data_path, variables_path=variables_path
+            )
+            await asyncio.to_thread(state.save, state_dir=self.incremental_dir)
+            return result
+
+        policy_files, targets = await asyncio.to_thread(
+            self.load_targets,
+            eval_type=eval_type,
+            project_dir=project_dir,
+            target_data=target_data,
+            task_result=task_result,
+            event=event,
+            rest_request=rest_request,
+            external_data_path=external_data_path,
+            variables_path=variables_path,
+        )
+        decisions = await self.aeval_targets(targets=targets, policy_files=policy_files, external_data_path=external_data_path)
+        result = self.make_result(targets=targets, policy_files=policy_files, decisions=decisions)
+        self.release_variable_resolvers(targets=targets)
+        return result
+
+    def run_project(self, state: IncrementalState, project_dir: str, external_data_path: str = "", variables_path: str = ""):
+        """
+        Evaluate a project and record the result in `state`. If `state.previous` has the units of the previous run,
+        only the targets which depend on `state.changed_files` are scanned and evaluated, and their results replace
+        the previous results of their files; see `load_changed_targets()`.
+        """
+        loaded = self.load_changed_targets(state=state, project_dir=project_dir, external_data_path=external_data_path, variables_path=variables_path)
+        if loaded is None:
+            loaded = self.load_targets(
+                eval_type=EvalTypeProject,
+                project_dir=project_dir,
+                external_data_path=external_data_path,
+                variables_path=variables_path,
+            )
+        policy_files, targets = loaded
+        decisions = self.eval_targets(targets=targets, policy_files=policy_files, external_data_path=external_data_path)
+        result = self.make_result(targets=targets, policy_files=policy_files, decisions=decisions)
+        self.release_variable_resolvers(targets=targets)
+        return self.update_incremental_state(state=state, result=result, targets=targets)
+
+    async def arun_project(self, state: IncrementalState, project_dir: str, external_data_path: str = "", variables_path: str = ""):
+        # an asyncio version of `run_project()`
+        loaded = await asyncio.to_thread(
+            self.load_changed_targets,
+            state=state,
+            project_dir=project_dir,
+            external_data_path=external_data_path,
+            variables_path=variables_path,
+        )
+        if loaded is None:
+            loaded = await asyncio.to_thread(
+                self.load_targets,
+                eval_type=EvalTypeProject,
+                project_dir=project_dir,
+                external_data_path=external_data_path,
+                variables_path=variables_path,
+            )
+        policy_files, targets = loaded
+        decisions = await self.aeval_targets(targets=targets, policy_files=policy_files, external_data_path=external_data_path)
+        result = self.make_result(targets=targets, policy_files=policy_files, decisions=decisions)
+        self.release_variable_resolvers(targets=targets)
+        return await asyncio.to_thread(self.update_incremental_state, state=state, result=result, targets=targets)
+
+    def release_variable_resolvers(self, targets: List[EvaluationTarget]):
+        # the variable caches are kept only during a run; their statistics are accumulated in the evaluator
+        shared_contexts = {}
+        for target in targets:
+            shared_context = target.input_data.shared_context if target.input_data else None
+            if shared_context is not None:
+                shared_contexts[id(shared_context)] = shared_context
+        stats = {}
+        for shared_context in shared_contexts.values():
+            resolver = shared_context.release_resolver()
+            if resolver is None:
+                continue
+            for key, val in resolver.get_stats().items():
+                stats[key] = stats.get(key, 0) + val
+        with self._worker_lock:
+            for key, val in stats.items():
+                self._variable_stats[key] = self._variable_stats.get(key, 0) + val
+        return
+
+    def release_line_identifier(self, line_identifier: LineIdentifier):
+        # the file bodies are kept only during a run; their statistics are accumulated in the evaluator
+        stats = {
+            "scanned": line_identifier.scanned,
+            "searches": line_identifier.searches,
+            "fallbacks": line_identifier.fallbacks,
+        }
+        if line_identifier.file_cache is not None:
+            stats.update(line_identifier.file_cache.stats())
+            line_identifier.file_cache.clear()
+        with self._worker_lock:
+            for key, val in stats.items():
+                self._file_stats[key] = self._file_stats.get(key, 0) + val
+        return
+
+    def load_incremental_state(self, project_dir: str, external_data_path: str = "", variables_path: str = ""):
+        """
+        Returns a tuple of (the state for this run, the previous result if nothing is changed since the previous run).
+        When some files are changed, None is returned as the result, and the state has the previous state and the changed
+        files, so that `run_project()` scans and evaluates only the targets which depend on them if possible.
+        """
+        previous = IncrementalState.load(state_dir=self.incremental_dir)
+        policy_files = self.list_enabled_policies()
+        fingerprint = make_fingerprint(
+            project_dir=project_dir,
+            project_abs_dir=os.path.abspath(project_dir),
+            policies=[self.catalog.get(policy_path).hash for policy_path in policy_files],
+            external_data=get_external_data_hash(external_data_path),
+            variables=get_file_hash(variables_path) if variables_path else "",
+        )
+        manifest = make_file_manifest(
+            project_dir=project_dir,
+            previous=previous.manifest if previous else None,
+            exclude_dirs=self.get_state_dirs(),
+        )
+        state = IncrementalState(fingerprint=fingerprint, manifest=manifest)
+        if not previous or not previous.result:
+            return state, None
+        if previous.fingerprint != fingerprint:
+            logger.debug("The policies or the evaluation options are changed since the previous run")
+            return state, None
+        changed_files = diff_manifests(old=previous.manifest, new=manifest)
+        if changed_files:
+            logger.debug(f"{len(changed_files)} files are changed since the previous run: {changed_files}")
+            state.previous = previous
+            state.changed_files = changed_files
+            return state, None
+        logger.debug("No file is changed since the previous run; reusing the previous result")
+        return state, EvaluationResult.from_dict(previous.result)
+
+    def get_state_dirs(self):
+        # directories in the project which are written by the evaluator, and never affect the evaluation
+        return [d for d in [self.incremental_dir, self.cache_dir] if d]
+
+    def load_changed_targets(self, state: IncrementalState, project_dir: str, external_data_path: str = "", variables_path: str = ""):
+        """
+        Returns a tuple of (policy files, targets) of the units (playbooks, taskfiles and roles) which depend on the files
+        changed since `state.previous`, or None if the whole project must be scanned. The scanner reads a copy of the project
+        without the other playbooks, taskfiles and roles, and the targets of the other units are not evaluated.
+
+        This is possible only when no policy reads the project context and the variables set in the affected units are not
+        changed; otherwise a change in one file can change the inputs of targets in other files. The targets are given the
+        variables of the whole project from the previous run, since the copy does not have the variables of the other units.
+        """
+        previous = state.previous
+        if previous is None or not previous.result or not previous.units or not state.changed_files or not os.path.isdir(project_dir):
+            return None
+        policy_files = self.list_enabled_policies()
+        if any([self.catalog.get(policy_path).reads_agk for policy_path in policy_files]):
+            logger.debug("The whole project is scanned again because a policy reads the project context")
+            return None
+        affected = find_affected_units(units=previous.units, changed_files=state.changed_files)
+        if affected is None:
+            logger.debug("The whole project is scanned again because a changed file is not a part of any playbook, taskfile or role")
+            return None
+
+        changed_bodies = []
+        for relpath in state.changed_files:
+            try:
+                with open(os.path.join(project_dir, relpath), "r", errors="replace") as file:
+                    changed_bodies.append(file.read())
+            except OSError:
+                continue
+        files = [relpath for relpath, _ in walk_project_files(project_dir=project_dir, exclude_dirs=self.get_state_dirs())]
+        unneeded = set(find_unneeded_files(units=previous.units, affected=affected, files=files, changed_bodies=changed_bodies))
+        # the copy is made in the state directory if any, so that the files can be hard links in the same file system
+        view_dir = tempfile.mkdtemp(prefix=".scan-", dir=self.incremental_dir or self.root_dir)
+        try:
+            make_scan_view(project_dir=project_dir, relpaths=[f for f in files if f not in unneeded], view_dir=view_dir)
+            policy_files, targets = self.load_targets(
+                eval_type=EvalTypeProject,
+                project_dir=project_dir,
+                scan_dir=view_dir,
+                external_data_path=external_data_path,
+                variables_path=variables_path,
+            )
+        finally:
+            shutil.rmtree(view_dir, ignore_errors=True)
+
+        units, target_units = make_incremental_units(targets=targets)
+        for key in affected:
+            if key not in units or units[key]["variables"] != previous.units[key]["variables"]:
+                logger.debug(f"The whole project is scanned again because `{key}` is removed or its variables are changed")
+                return None
+        changed_targets = [target for target in targets if target_units.get(id(target.object)) in affected]
+        other_results = set()
+        for key, unit in previous.units.items():
+            if key not in affected:
+                other_results.update(unit["results"])
+        if any([target.filepath in other_results for target in changed_targets]):
+            logger.debug("The whole project is scanned again because a changed unit has targets in the files of other units")
+            return None
+
+        variables = decode_variables(previous.variables)
+        for target in changed_targets:
+            target.input_data.variables = variables
+        state.units = {key: unit for key, unit in previous.units.items() if key not in affected}
+        state.units.update({key: units[key] for key in affected})
+        state.variables = previous.variables
+        state.affected_units = affected
+        logger.debug(f"{len(changed_targets)} targets in {len(affected)} playbooks, taskfiles and roles are scanned again: {sorted(affected)}")
+        return policy_files, changed_targets
+
+    def update_incremental_state(self, state: IncrementalState, result: EvaluationResult, targets: List[EvaluationTarget]):
+        """
+        Record the result and the units of this run in `state`, and return the result of the whole project; the results of
+        the affected units replace the previous results of their files if only they are evaluated.
+        """
+        if state.affected_units is None:
+            state.units, _ = make_incremental_units(targets=targets)
+            state.variables = encode_variables(targets[0].input_data.variables if targets else {})
+        else:
+            replaced_paths = set()
+            for key in state.affected_units:
+                replaced_paths.update(state.previous.units[key]["results"])
+            result = EvaluationResult.from_dict(state.previous.result).replace_files(files=result.files, paths=replaced_paths)
+        state.result = result.to_dict()
+        state.previous = None
+        return result
+
+    def load_targets(
+        self,
+        eval_type: str = "project",
+        project_dir: str = "",
+        target_data: dict = None,
+        task_result: TaskResult = None,
+        event: Event = None,
+        rest_request: APIRequest = None,
+        external_data_path: str = "",
+        variables_path: str = "",
+        scan_dir: str = "",
+    ):
+        # `scan_dir` is a copy of `project_dir` to be scanned instead of it; the targets still refer to the files in `project_dir`
         policy_files = self.list_enabled_policies()
         logger.debug(f"policy_files: {policy_files}")
         if not policy_files:
@@ -665,7 +1499,7 @@ class PolicyEvaluator(object):
         if eval_type == EvalTypeJobdata:
             input_data_dict, _ = load_input_from_jobdata(jobdata=target_data)
         elif eval_type == EvalTypeProject:
-            input_data_dict = load_input_from_project_dir(project_dir=project_dir, variables=variables)
+            input_data_dict = load_input_from_project_dir(project_dir=scan_dir or project_dir, variables=variables)
         elif eval_type == EvalTypeTaskResult:
             input_data_dict = load_input_from_task_result(task_result=task_result)
         elif eval_type == EvalTypeEvent:
@@ -681,11 +1515,6 @@ class PolicyEvaluator(object):
         else:
             raise ValueError(f"eval_type `{eval_type}` is not supported")
 
-        target_modules = []
-        for policy_path in policy_files:
-            target_module = detect_target_module_pattern(policy_path=policy_path)
-            target_modules.append(target_module)
-
         if "task" in input_data_dict:
             # embed `task.module_fqcn` to input_data by using external_data
             input_data_all_tasks = []
@@ -695,7 +1524,32 @@ class PolicyEvaluator(object):
             if input_data_all_tasks:
                 input_data_dict["task"] = input_data_all_tasks
 
+        targets = self.list_targets(eval_type=eval_type, input_data_dict=input_data_dict, project_dir=project_dir)
+        return policy_files, targets
+
+    def make_result(self, targets: List[EvaluationTarget], policy_files: list, decisions: dict):
         result = EvaluationResult()
+        for i, target in enumerate(targets):
+            for policy_path in policy_files:
+                policy = self.catalog.get(policy_path)
+                is_target_type, eval_result = decisions.get((i, policy_path), (False, {}))
+                result.add_single_result(
+                    eval_result=eval_result,
+                    is_target_type=is_target_type,
+                    policy_name=policy.package,
+                    target_type=policy.target,
+                    obj=target.object,
+                    filepath=target.filepath,
+                    lines=target.lines,
+                    metadata=target.metadata,
+                )
+
+        return result.finalize()
+
+    def list_targets(self, eval_type: str, input_data_dict: dict, project_dir: str = ""):
+        targets = []
+        # files of a project are read and indexed once for all of their tasks and plays
+        line_identifier = LineIdentifier(file_cache=FileCache(), score_cutoff=self.line_score_cutoff)
         for input_type in input_data_dict:
             input_data_per_type = input_data_dict[input_type]
             data_num = len(input_data_per_type)
@@ -711,7 +1565,6 @@ class PolicyEvaluator(object):
                         filepath = os.path.join(project_dir, filepath)
 
                 lines = None
-                body = ""
                 metadata = {}
                 if eval_type == EvalTypeEvent:
                     lines = {
@@ -722,53 +1575,560 @@ class PolicyEvaluator(object):
                     metadata = obj.__dict__
                 elif eval_type == EvalTypeRest:
                     pass
-                else:
-                    with open(filepath, "r") as f:
-                        body = f.read()
-                    if input_type in ["task", "play"]:
-                        _identifier = LineIdentifier()
-                        block = _identifier.find_block(body=body, obj=obj)
-                        lines = block.to_dict()
-
-                for policy_path in policy_files:
-                    policy_name = get_rego_main_package_name(rego_path=policy_path)
-                    target_type = detect_target_type_pattern(policy_path=policy_path)
-                    is_target_type, eval_result = self.eval_single_policy(
-                        rego_path=policy_path,
-                        input_type=input_type,
-                        input_data=single_input_data,
-                        external_data_path=external_data_path,
-                    )
-                    result.add_single_result(
-                        eval_result=eval_result,
-                        is_target_type=is_target_type,
-                        policy_name=policy_name,
-                        target_type=target_type,
-                        obj=obj,
-                        filepath=filepath,
-                        lines=lines,
-                        metadata=metadata,
-                    )
+                elif input_type in ["task", "play"]:
+                    block = line_identifier.find_block_in_file(filepath=filepath, obj=obj)
+                    lines = block.to_dict()
+
+                target = EvaluationTarget(
+                    input_type=input_type,
+                    input_data=single_input_data,
+                    filepath=filepath,
+                    lines=lines,
+                    metadata=metadata,
+                )
+                targets.append(target)
+        if line_identifier.searches:
+            logger.debug(
+                f"{line_identifier.searches} code blocks are searched in the files because the scanner gives no valid line range, "
+                f"and {line_identifier.fallbacks} of them are not found in the position index"
+            )
+        self.release_line_identifier(line_identifier)
+        return targets
+
+    def eval_targets(self, targets: List[EvaluationTarget], policy_files: list, external_data_path: str = ""):
+        """
+        Evaluate all (target, policy) pairs and return a dict of their decisions keyed by (target index, policy path).
+        Pairs that are not in the dict are not evaluated because the policy does not target the input type.
+        In `batch` mode, all targets of one input type that need a policy are evaluated with a single query.
+        In `multi` mode, all policies that a target needs are evaluated with a single query.
+        """
+        project_keys = self.publish_project_data(targets=targets)
+        opa_data_path = ""
+        try:
+            opa_data_path = self.prepare_opa_data(targets=targets, policy_files=policy_files, external_data_path=external_data_path)
+            self.load_backend(policy_files=policy_files, external_data_path=opa_data_path)
+            decisions, units = self.plan_units(
+                targets=targets,
+                policy_files=policy_files,
+                external_data_path=external_data_path,
+                opa_data_path=opa_data_path,
+            )
+            unit_results = self.run_units(units=units, policy_files=policy_files, external_data_path=opa_data_path)
+        finally:
+            self.release_opa_data(path=opa_data_path)
+            self.unpublish_project_data(keys=project_keys)
+        for unit, result in zip(units, unit_results):
+            unit.set_decisions(decisions=decisions, result=result, cache=self.decision_cache)
+        self.decision_cache.flush()
+        return decisions
+
+    async def aeval_targets(self, targets: List[EvaluationTarget], policy_files: list, external_data_path: str = ""):
+        # serializing inputs can take a while for a large project, so it is done in a worker thread
+        project_keys = await asyncio.to_thread(self.publish_project_data, targets=targets)
+        opa_data_path = ""
+        try:
+            opa_data_path = await asyncio.to_thread(
+                self.prepare_opa_data,
+                targets=targets,
+                policy_files=policy_files,
+                external_data_path=external_data_path,
+            )
+            await asyncio.to_thread(self.load_backend, policy_files=policy_files, external_data_path=opa_data_path)
+            decisions, units = await asyncio.to_thread(
+                self.plan_units,
+                targets=targets,
+                policy_files=policy_files,
+                external_data_path=external_data_path,
+                opa_data_path=opa_data_path,
+            )
+            unit_results = await self.arun_units(units=units, policy_files=policy_files, external_data_path=opa_data_path)
+        finally:
+            self.release_opa_data(path=opa_data_path)
+            await asyncio.to_thread(self.unpublish_project_data, keys=project_keys)
+        for unit, result in zip(units, unit_results):
+            unit.set_decisions(decisions=decisions, result=result, cache=self.decision_cache)
+        await asyncio.to_thread(self.decision_cache.flush)
+        return decisions
+
+    def prepare_opa_data(self, targets: List[EvaluationTarget], policy_files: list, external_data_path: str = ""):
+        """
+        Returns the path of the external data for OPA, which has only the galaxy data of the modules in the targets.
+        The whole external data is used if a policy reads `data.galaxy` by itself.
+        The pruned data is written to a file named by its hash, so parallel evaluations of the same set of modules share the file.
+        The caller must pass the path to `release_opa_data()` when the evaluation is done; the file is removed when no evaluation uses it.
+        """
+        if not external_data_path or not targets:
+            return external_data_path
+        if any([self.catalog.get(policy_path).reads_galaxy for policy_path in policy_files]):
+            return external_data_path
+        galaxy = get_external_data(ftype="galaxy", fpath=external_data_path)
+        module_names = find_module_names([target.input_data for target in targets])
+        data_json = json.dumps(prune_galaxy_data(galaxy=galaxy, module_names=module_names), separators=(",", ":"))
+        data_dir = os.path.join(self.root_dir, "external_data")
+        path = os.path.join(data_dir, hashlib.sha256(data_json.encode("utf-8")).hexdigest() + ".json")
+        with self._opa_data_lock:
+            if path not in self._opa_data_refs:
+                os.makedirs(data_dir, exist_ok=True)
+                with open(path, "w") as file:
+                    file.write(data_json)
+            self._opa_data_refs[path] = self._opa_data_refs.get(path, 0) + 1
+        logger.debug(f"external data for OPA is pruned to {len(module_names)} modules: {path}")
+        return path
+
+    def release_opa_data(self, path: str):
+        # the whole external data is not made by `prepare_opa_data()`, so it is not in the refs and is kept
+        with self._opa_data_lock:
+            if path not in self._opa_data_refs:
+                return
+            self._opa_data_refs[path] -= 1
+            if self._opa_data_refs[path] <= 0:
+                self._opa_data_refs.pop(path)
+                if os.path.exists(path):
+                    os.remove(path)
+        return
 
-        return result
+    def publish_project_data(self, targets: List[EvaluationTarget]):
+        """
+        Publish the project contexts of the targets as OPA data to all backends, and return their keys.
+        Each context is written to a data file only once, so inputs of the targets embed only the key in `_agk`.
+        """
+        keys = []
+        for target in targets:
+            shared_context = target.input_data.shared_context
+            if shared_context is None or (shared_context.key and shared_context.key in keys):
+                continue
+            key, context_json = target.input_data.publish_context()
+            with self._project_data_lock:
+                if key not in self._project_data:
+                    data_dir = os.path.join(self.root_dir, "project_data")
+                    os.makedirs(data_dir, exist_ok=True)
+                    path = os.path.join(data_dir, f"{key}.json")
+                    with open(path, "w") as file:
+                        file.write(make_project_data(key=key, context_json=context_json))
+                    self._project_data[key] = path
+                self._project_data_refs[key] = self._project_data_refs.get(key, 0) + 1
+            keys.append(key)
+        if keys:
+            self.sync_project_data()
+        return keys
+
+    def unpublish_project_data(self, keys: List[str]):
+        removed = []
+        with self._project_data_lock:
+            for key in keys:
+                self._project_data_refs[key] -= 1
+                if self._project_data_refs[key] <= 0:
+                    self._project_data_refs.pop(key)
+                    removed.append(self._project_data.pop(key))
+        if removed:
+            self.sync_project_data()
+            for path in removed:
+                if os.path.exists(path):
+                    os.remove(path)
+        return
+
+    def sync_project_data(self):
+        with self._project_data_lock:
+            project_data = dict(self._project_data)
+            backends = [self.backend] + self.worker_backends
+        for backend in backends:
+            backend.set_project_data(project_data)
+        return
+
+    def plan_units(self, targets: List[EvaluationTarget], policy_files: list, external_data_path: str = "", opa_data_path: str = None):
+        """
+        Returns a tuple of (decisions for pairs without evaluation, evaluation units for the other pairs).
+        The units query OPA with `opa_data_path` (`external_data_path` if None), while decisions are cached
+        by the hash of `external_data_path`, because the pruned data gives the same decisions as the whole data.
+        """
+        if opa_data_path is None:
+            opa_data_path = external_data_path
+        decisions = {}
+        # key: project key, value: the decoded project context for the native evaluator
+        native_contexts = {}
+        # key: target index, value: serialized inputs of the target; each projection of an input is serialized only once
+        input_jsons = {}
+        pending = []
+        cache_keys = {}
+        data_hash = get_external_data_hash(external_data_path)
+        index = self.catalog.dispatch_index(policy_paths=policy_files)
+        for i, target in enumerate(targets):
+            type_matched, need_eval = self.lookup_policies(index=index, input_type=target.input_type, input_data=target.input_data)
+            for policy_path in type_matched:
+                decisions[(i, policy_path)] = (True, {})
+            if not need_eval:
+                continue
+            input_jsons[i] = {}
+            input_hashes = {}
+            native_input = None
+            for policy_path in need_eval:
+                policy = self.catalog.get(policy_path)
+                if self.native_eval:
+                    native = policy.native
+                    if native:
+                        if native_input is None:
+                            native_input = self.make_native_input(
+                                input_data=target.input_data,
+                                input_json=self.get_input_json(input_data=target.input_data, input_paths=None, input_jsons=input_jsons[i]),
+                                contexts=native_contexts,
+                            )
+                        result = self.eval_native_policy(native=native, input_data=native_input)
+                        if result is not None:
+                            decisions[(i, policy_path)] = (True, result)
+                            continue
+                if self.decision_cache.enabled:
+                    cache_key = self.make_cache_key(
+                        policy=policy,
+                        data_hash=data_hash,
+                        input_data=target.input_data,
+                        input_json=self.get_input_json(
+                            input_data=target.input_data,
+                            input_paths=policy.input_paths,
+                            input_jsons=input_jsons[i],
+                            embed_context=policy.reads_agk_context,
+                        ),
+                        input_hashes=input_hashes,
+                    )
+                    cached = self.decision_cache.get(cache_key)
+                    if cached is not None:
+                        decisions[(i, policy_path)] = (True, cached)
+                        continue
+                    cache_keys[(i, policy_path)] = cache_key
+                pending.append((i, policy_path))
+
+        if not pending:
+            return decisions, []
+
+        eval_mode = self.eval_mode
+        if eval_mode == EvalModeAuto:
+            # a single input (e.g. an event or a REST request) gets all its policies in one query,
+            # while a project scan has many inputs per policy
+            eval_mode = EvalModeMulti if len(set([i for i, _ in pending])) == 1 else EvalModeBatch
+
+        units = []
+        if eval_mode == EvalModeBatch:
+            # inputs of different types are not mixed in a single query
+            pending_groups = {}
+            for i, policy_path in pending:
+                key = (policy_path, targets[i].input_type)
+                if key not in pending_groups:
+                    pending_groups[key] = []
+                pending_groups[key].append(i)
+            for (policy_path, _), indices in pending_groups.items():
+                policy = self.catalog.get(policy_path)
+                unit = EvaluationUnit(
+                    method="eval_policy_batch",
+                    kwargs={
+                        "rego_path": policy_path,
+                        "input_data_list": [
+                            self.get_input_json(targets[i].input_data, policy.input_paths, input_jsons[i], policy.reads_agk_context) for i in indices
+                        ],
+                        "external_data_path": opa_data_path,
+                    },
+                    keys=[(i, policy_path) for i in indices],
+                )
+                units.append(unit)
+        elif eval_mode == EvalModeMulti:
+            pending_groups = {}
+            for i, policy_path in pending:
+                if i not in pending_groups:
+                    pending_groups[i] = []
+                pending_groups[i].append(policy_path)
+            for i, policy_paths in pending_groups.items():
+                # the input of a single query has all the paths which its policies read
+                policies = [self.catalog.get(policy_path) for policy_path in policy_paths]
+                input_paths = merge_input_paths([policy.input_paths for policy in policies])
+                embed_context = any([policy.reads_agk_context for policy in policies])
+                unit = EvaluationUnit(
+                    method="eval_policies",
+                    kwargs={
+                        "rego_paths": policy_paths,
+                        "input_data": self.get_input_json(targets[i].input_data, input_paths, input_jsons[i], embed_context),
+                        "external_data_path": opa_data_path,
+                    },
+                    keys=[(i, policy_path) for policy_path in policy_paths],
+                )
+                units.append(unit)
+        else:
+            for i, policy_path in pending:
+                policy = self.catalog.get(policy_path)
+                unit = EvaluationUnit(
+                    method="eval_policy",
+                    kwargs={
+                        "rego_path": policy_path,
+                        "input_data": self.get_input_json(targets[i].input_data, policy.input_paths, input_jsons[i], policy.reads_agk_context),
+                        "external_data_path": opa_data_path,
+                    },
+                    keys=[(i, policy_path)],
+                )
+                units.append(unit)
+        if cache_keys:
+            for unit in units:
+                unit.cache_keys = [cache_keys[key] for key in unit.keys]
+        return decisions, units
+
+    def get_input_json(self, input_data: PolicyInput, input_paths: list, input_jsons: dict, embed_context: bool = False):
+        """
+        Returns the input JSON which has only `input_paths`, or the whole input if `input_paths` is None.
+        `embed_context` is True for policies which read the project context from `input._agk` directly.
+        `input_jsons` keeps the serialized inputs of the target, so that the same projection is not serialized twice.
+        """
+        key = (get_input_paths_key(input_paths), embed_context)
+        if key not in input_jsons:
+            if input_paths is None:
+                input_jsons[key] = input_data.to_json(embed_context=embed_context)
+            else:
+                input_jsons[key] = input_data.to_projected_json(input_paths=input_paths, embed_context=embed_context)
+        return input_jsons[key]
+
+    def run_units(self, units: List["EvaluationUnit"], policy_files: list, external_data_path: str = ""):
+        """
+        Run evaluation units with up to `jobs` worker threads and return their results in the order of the units.
+        """
+        num_workers = min(self.jobs, len(units))
+        if num_workers <= 1:
+            return [self.run_unit(unit=unit, backend=self.backend) for unit in units]
+
+        backends = self.get_worker_backends(num=num_workers, policy_files=policy_files, external_data_path=external_data_path)
+        idle_backends = queue.SimpleQueue()
+        for backend in backends:
+            idle_backends.put(backend)
+
+        def _run(unit):
+            backend = idle_backends.get()
+            try:
+                return self.run_unit(unit=unit, backend=backend)
+            finally:
+                idle_backends.put(backend)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(_run, units))
+
+    async def arun_units(self, units: List["EvaluationUnit"], policy_files: list, external_data_path: str = ""):
+        """
+        Await evaluation units with at most `get_max_in_flight()` of them in flight and return their results in the order of the units.
+        """
+        semaphore = self.get_semaphore()
+        idle_backends = None
+        if not isinstance(self.backend, SubprocessBackend):
+            # a server backend handles one query at a time, so units wait for an idle server
+            num_workers = min(self.get_max_in_flight(), len(units))
+            backends = [self.backend]
+            if num_workers > 1:
+                backends = await asyncio.to_thread(
+                    self.get_worker_backends,
+                    num=num_workers,
+                    policy_files=policy_files,
+                    external_data_path=external_data_path,
+                )
+            idle_backends = asyncio.Queue()
+            for backend in backends:
+                idle_backends.put_nowait(backend)
+
+        async def _run(unit):
+            async with semaphore:
+                if idle_backends is None:
+                    return await self.arun_unit(unit=unit, backend=self.backend)
+                backend = await idle_backends.get()
+                try:
+                    return await self.arun_unit(unit=unit, backend=backend)
+                finally:
+                    idle_backends.put_nowait(backend)
+
+        return await asyncio.gather(*[_run(unit) for unit in units])
+
+    def run_unit(self, unit: "EvaluationUnit", backend: any):
+        try:
+            return unit.run(backend=backend)
+        except Exception as exc:
+            return unit.run(backend=self.get_fallback_backend(backend=backend, exc=exc))
+
+    async def arun_unit(self, unit: "EvaluationUnit", backend: any):
+        try:
+            return await unit.arun(backend=backend)
+        except Exception as exc:
+            return await unit.arun(backend=self.get_fallback_backend(backend=backend, exc=exc))
+
+    def get_fallback_backend(self, backend: any, exc: Exception):
+        """
+        Return a subprocess backend to retry a unit which failed on a non-subprocess backend, such as a server which
+        crashed or whose log did not have the `print()` outputs in time. Errors of a subprocess backend are raised as they are.
+        """
+        if isinstance(backend, SubprocessBackend):
+            raise exc
+        logger.warning(f"an evaluation failed on the `{self.backend_type}` backend, so retrying it with `{BackendTypeSubprocess}`; error: {exc}")
+        with self._project_data_lock:
+            project_data = dict(self._project_data)
+        fallback = new_backend(backend_type=BackendTypeSubprocess, catalog=self.catalog)
+        fallback.set_project_data(project_data)
+        return fallback
+
+    def get_semaphore(self):
+        # an asyncio semaphore can be used only in the event loop where it is created
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.get_max_in_flight()))
+        return self._semaphore[1]
+
+    def get_worker_backends(self, num: int, policy_files: list, external_data_path: str = ""):
+        # `opa eval` processes do not share any state, so a single subprocess backend is used by all workers
+        if isinstance(self.backend, SubprocessBackend):
+            return [self.backend] * num
+
+        # a server backend serializes its queries to pair them with their `print()` outputs,
+        # so each worker needs its own server
+        with self._worker_lock:
+            num_new = num - 1 - len(self.worker_backends)
+            if num_new > 0:
+                self.worker_backends.extend([new_backend(backend_type=self.backend_type, catalog=self.catalog) for _ in range(num_new)])
+            backends = self.worker_backends[: num - 1]
+
+            def _load(backend):
+                return self.load_backend(policy_files=policy_files, external_data_path=external_data_path, backend=backend)
+
+            with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+                loaded = list(executor.map(_load, backends))
+            self.worker_backends[: num - 1] = loaded
+        return [self.backend] + loaded
 
     def eval_single_policy(self, rego_path: str, input_type: str, input_data: PolicyInput, external_data_path: str) -> tuple[bool, str]:
+        is_target_type, need_eval = self.match_policy_target(rego_path=rego_path, input_type=input_type, input_data=input_data)
+        if not need_eval:
+            return is_target_type, {}
+        target = EvaluationTarget(input_type=input_type, input_data=input_data)
+        project_keys = self.publish_project_data(targets=[target])
+        opa_data_path = ""
+        try:
+            # OPA gets only the galaxy data of the modules in this target, so a galaxy database is not exported as a whole
+            opa_data_path = self.prepare_opa_data(targets=[target], policy_files=[rego_path], external_data_path=external_data_path)
+            return self._eval_single_policy(
+                rego_path=rego_path,
+                input_data=input_data,
+                external_data_path=external_data_path,
+                opa_data_path=opa_data_path,
+            )
+        finally:
+            self.release_opa_data(path=opa_data_path)
+            self.unpublish_project_data(keys=project_keys)
+
+    def _eval_single_policy(self, rego_path: str, input_data: PolicyInput, external_data_path: str, opa_data_path: str = None) -> tuple[bool, str]:
+        if opa_data_path is None:
+            opa_data_path = external_data_path
+        input_jsons = {}
+        policy = self.catalog.get(rego_path)
+        input_data_str = self.get_input_json(
+            input_data=input_data,
+            input_paths=policy.input_paths,
+            input_jsons=input_jsons,
+            embed_context=policy.reads_agk_context,
+        )
+        if self.native_eval and policy.native:
+            native_input = self.make_native_input(
+                input_data=input_data,
+                input_json=self.get_input_json(input_data=input_data, input_paths=None, input_jsons=input_jsons),
+                contexts={},
+            )
+            result = self.eval_native_policy(native=policy.native, input_data=native_input)
+            if result is not None:
+                return True, result
+        cache_key = None
+        if self.decision_cache.enabled:
+            cache_key = self.make_cache_key(
+                policy=policy,
+                data_hash=get_external_data_hash(external_data_path),
+                input_data=input_data,
+                input_json=input_data_str,
+                input_hashes={},
+            )
+            result = self.decision_cache.get(cache_key)
+            if result is not None:
+                return True, result
+        # the same fallback as the other evaluations if the backend fails to start or to evaluate
+        backend = self.load_backend(policy_files=[rego_path], external_data_path=opa_data_path)
+        unit = EvaluationUnit(
+            method="eval_policy",
+            kwargs=dict(rego_path=rego_path, input_data=input_data_str, external_data_path=opa_data_path),
+        )
+        result = self.run_unit(unit=unit, backend=backend)
+        if cache_key:
+            self.decision_cache.put(cache_key, result)
+            self.decision_cache.flush()
+        return True, result
+
+    def make_cache_key(self, policy: PolicyMetadata, data_hash: str, input_data: PolicyInput, input_json: str, input_hashes: dict):
+        # a policy which does not read `_agk` gets the same decision for the same target content wherever the target is,
+        # so that a change in another file of the project does not invalidate its cached decisions
+        scope = "full" if policy.reads_agk else "target"
+        if policy.input_paths is not None:
+            # `input_json` has only the paths which the policy reads, so a change in the other parts does not matter either
+            scope = get_input_paths_key(policy.input_paths)
+        if policy.reads_agk_context:
+            # `input_json` embeds the whole project context
+            scope = ("context", scope)
+        input_hash = input_hashes.get(scope)
+        if input_hash is None:
+            input_hash = make_input_hash(input_json if scope != "target" else input_data.to_target_json())
+            input_hashes[scope] = input_hash
+        return (policy.hash, data_hash, input_hash)
+
+    def make_native_input(self, input_data: PolicyInput, input_json: str, contexts: dict):
+        # the native evaluator reads the same JSON input as OPA, with the published project context put back to `_agk`
+        native_input = json.loads(input_json)
+        shared_context = input_data.shared_context
+        if shared_context is not None and shared_context.key:
+            if shared_context.key not in contexts:
+                contexts[shared_context.key] = json.loads(shared_context.json)
+            native_input["_agk"] = {**contexts[shared_context.key], **native_input["_agk"]}
+        return native_input
+
+    # returns the same result as the OPA backend, or None to fall back to OPA
+    def eval_native_policy(self, native: NativePolicy, input_data: dict):
+        try:
+            return native.evaluate(input_data)
+        except Exception:
+            err = traceback.format_exc()
+            logger.debug(f"Native evaluation of the policy `{native.package}` failed; falling back to OPA. details: {err}")
+            return None
+
+    # returns a tuple of (is_target_type, need_eval)
+    def match_policy_target(self, rego_path: str, input_type: str, input_data: PolicyInput) -> tuple[bool, bool]:
+        index = self.catalog.dispatch_index(policy_paths=[rego_path])
+        type_matched, need_eval = self.lookup_policies(index=index, input_type=input_type, input_data=input_data)
+        return bool(type_matched), bool(need_eval)
+
+    # returns a tuple of (policies targeting the input type, policies to be evaluated for the input)
+    def lookup_policies(self, index: PolicyDispatchIndex, input_type: str, input_data: PolicyInput) -> tuple[list, list]:
         target_type = input_type
         if input_type == "task_result":
             target_type = "task"
-        if not match_target_type(target_type=target_type, rego_path=rego_path):
-            return False, {}
+        module_fqcn = None
         if input_type == "task":
-            task = input_data.task
-            if not match_target_module(task.module_fqcn, rego_path):
-                return True, {}
-        input_data_str = input_data.to_json()
-        result = eval_opa_policy(
-            rego_path=rego_path,
-            input_data=input_data_str,
-            external_data_path=external_data_path,
-        )
-        return True, result
+            module_fqcn = input_data.task.module_fqcn or ""
+        return index.lookup(target_type=target_type, module_fqcn=module_fqcn)
+
+    def load_backend(self, policy_files: list, external_data_path: str = "", backend: any = None):
+        """
+        Load policies and external data to a backend (the main one by default) and return the backend.
+        If a non-subprocess backend fails to start, it is replaced with a subprocess backend.
+        """
+        is_main = backend is None
+        if is_main:
+            backend = self.backend
+        with self._project_data_lock:
+            project_data = dict(self._project_data)
+        try:
+            backend.set_project_data(project_data)
+            backend.load(policy_paths=policy_files, external_data_path=external_data_path)
+        except Exception as exc:
+            if isinstance(backend, SubprocessBackend):
+                raise
+            logger.warning(f"failed to start the `{self.backend_type}` backend, so falling back to `{BackendTypeSubprocess}`; error: {exc}")
+            backend.close()
+            backend = new_backend(backend_type=BackendTypeSubprocess, catalog=self.catalog)
+            backend.set_project_data(project_data)
+            if is_main:
+                self.backend = backend
+        return backend
 
     def load_variables(self, variables_path: str):
         return Variables.from_variables_file(path=variables_path)
@@ -866,12 +2226,7 @@ class ResultFormatter(object):
         print(_line)
 
     def print_json(self, result: EvaluationResult):
-        json_str = jsonpickle.encode(
-            result,
-            unpicklable=False,
-            make_refs=False,
-            separators=(",", ":"),
-        )
+        json_str = encode_result(result)
         print(json_str)
 
     def print_plain(self, result: EvaluationResult):
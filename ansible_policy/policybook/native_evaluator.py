@@ -0,0 +1,715 @@
+import re
+import json
+from dataclasses import dataclass, field
+from typing import List, Callable
+
+from ansible_policy.policybook.expressioin_transpiler import BaseExpression
+
+
+# the AST is converted to operands in the same way as the rego transpiler does, so that both targets agree
+_base_expression = BaseExpression()
+
+_ident = r"[A-Za-z_][A-Za-z0-9_]*"
+_ref_head_re = re.compile(_ident)
+_ref_segment_re = re.compile(r"\.(" + _ident + r')|\["((?:[^"\\]|\\.)*)"\]|\[(-?[0-9]+)\]')
+_msg_var_re = r"{{\s*([^}]+)\s*}}"
+
+compare_operators = {
+    ">": lambda c: c > 0,
+    ">=": lambda c: c >= 0,
+    "<": lambda c: c < 0,
+    "<=": lambda c: c <= 0,
+}
+
+
+class NativeCompileError(ValueError):
+    pass
+
+
+class _Undefined:
+    def __repr__(self):
+        return "<undefined>"
+
+
+# a value that does not exist, like an undefined reference in rego
+UNDEFINED = _Undefined()
+
+
+def is_truthy(value):
+    # a rego expression statement succeeds if its value is defined and not `false`
+    return value is not UNDEFINED and value is not False
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def type_rank(value):
+    if value is None:
+        return 0
+    elif isinstance(value, bool):
+        return 1
+    elif is_number(value):
+        return 2
+    elif isinstance(value, str):
+        return 3
+    elif isinstance(value, list):
+        return 4
+    elif isinstance(value, dict):
+        return 5
+    return 6
+
+
+def rego_equal(lhs, rhs):
+    if lhs is UNDEFINED or rhs is UNDEFINED:
+        return False
+    return rego_compare(lhs, rhs) == 0
+
+
+def rego_compare(lhs, rhs):
+    """
+    Compare two values with the total order of rego; null < boolean < number < string < array < object.
+    """
+    lhs_rank = type_rank(lhs)
+    rhs_rank = type_rank(rhs)
+    if lhs_rank != rhs_rank:
+        return -1 if lhs_rank < rhs_rank else 1
+    if lhs_rank == 0:
+        return 0
+    if isinstance(lhs, list):
+        for lhs_item, rhs_item in zip(lhs, rhs):
+            result = rego_compare(lhs_item, rhs_item)
+            if result != 0:
+                return result
+        return (len(lhs) > len(rhs)) - (len(lhs) < len(rhs))
+    if isinstance(lhs, dict):
+        lhs_keys = sorted(lhs)
+        rhs_keys = sorted(rhs)
+        for lhs_key, rhs_key in zip(lhs_keys, rhs_keys):
+            result = rego_compare(lhs_key, rhs_key)
+            if result != 0:
+                return result
+            result = rego_compare(lhs[lhs_key], rhs[rhs_key])
+            if result != 0:
+                return result
+        return (len(lhs_keys) > len(rhs_keys)) - (len(lhs_keys) < len(rhs_keys))
+    return (lhs > rhs) - (lhs < rhs)
+
+
+def rego_values(collection):
+    # `collection[_]` in rego
+    if isinstance(collection, list):
+        return collection
+    elif isinstance(collection, dict):
+        return list(collection.values())
+    return []
+
+
+def rego_member(item, collection):
+    # `item in collection` in rego
+    return any(rego_equal(item, value) for value in rego_values(collection))
+
+
+def to_list(value):
+    # `to_list()` in the transpiled policy
+    if value is UNDEFINED:
+        return UNDEFINED
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def check_item_in_list(lhs_list, rhs_list):
+    return any(rego_member(item, rhs_list) for item in rego_values(lhs_list))
+
+
+def object_get(obj, key, default):
+    # `object.get(obj, [key], default)` in rego; a non-object operand is a type error
+    if not isinstance(obj, dict):
+        return UNDEFINED
+    return obj.get(key, default)
+
+
+def check_item_key_in_list(lhs_list, rhs_list, key):
+    for item in rego_values(lhs_list):
+        value = object_get(item, key, "none")
+        if value is not UNDEFINED and rego_member(value, rhs_list):
+            return True
+    return False
+
+
+def lookup(value, path: list):
+    for segment in path:
+        if isinstance(value, dict) and isinstance(segment, str):
+            value = value.get(segment, UNDEFINED)
+        elif isinstance(value, list) and isinstance(segment, int) and 0 <= segment < len(value):
+            value = value[segment]
+        else:
+            return UNDEFINED
+    return value
+
+
+def rego_lower(value):
+    return value.lower() if isinstance(value, str) else UNDEFINED
+
+
+def rego_contains(value, substr):
+    if not isinstance(value, str) or not isinstance(substr, str):
+        return UNDEFINED
+    return substr in value
+
+
+def rego_startswith(value, prefix):
+    if not isinstance(value, str) or not isinstance(prefix, str):
+        return UNDEFINED
+    return value.startswith(prefix)
+
+
+def rego_regex_found(pattern, value):
+    # `regex.find_n(pattern, value, 1) != []` in rego
+    if not isinstance(pattern, str) or not isinstance(value, str):
+        return UNDEFINED
+    try:
+        return re.search(pattern, value) is not None
+    except re.error:
+        return UNDEFINED
+
+
+def format_value(value, top: bool = True):
+    """
+    Format a value like `%v` of `sprintf()` in rego.
+    """
+    if value is UNDEFINED:
+        return "<undefined>"
+    elif isinstance(value, str):
+        return value if top else json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    elif value is None:
+        return "null"
+    elif isinstance(value, list):
+        return "[" + ", ".join([format_value(v, top=False) for v in value]) + "]"
+    elif isinstance(value, dict):
+        items = [f"{json.dumps(k, ensure_ascii=False)}: {format_value(value[k], top=False)}" for k in sorted(value)]
+        return "{" + ", ".join(items) + "}"
+    return str(value)
+
+
+@dataclass
+class NativeRule(object):
+    name: str = ""
+    # a function of (input, values of the other rules) which returns True if this rule is true
+    func: Callable = None
+
+
+@dataclass
+class NativePolicy(object):
+    """
+    NativePolicy is a policybook policy compiled to python closures.
+    `evaluate()` returns the same value as `data.<package>` of the transpiled rego policy and the `print()` output.
+    """
+
+    package: str = ""
+    target: str = ""
+    tags: List[str] = field(default_factory=list)
+    vars: dict = field(default_factory=dict)
+    action: str = ""
+    root_rule: str = ""
+    # rules in the evaluation order; children come before their parents
+    rules: List[NativeRule] = field(default_factory=list)
+    message_func: Callable = None
+    # `__input_paths__` of the transpiled rego policy; None if it is not declared
+    input_paths: list = None
+
+    def evaluate(self, input_data: dict):
+        values = {}
+        for rule in self.rules:
+            values[rule.name] = rule.func(input_data, values)
+
+        document = {"__target__": self.target}
+        if self.tags:
+            document["__tags__"] = self.tags
+        if self.input_paths is not None:
+            document["__input_paths__"] = self.input_paths
+        document.update(self.vars)
+        for rule in self.rules:
+            if values[rule.name]:
+                document[rule.name] = True
+
+        decision = values[self.root_rule]
+        document[self.action] = decision
+        message = ""
+        if decision:
+            message = self.message_func(input_data) + "\n"
+        return {"value": document, "message": message}
+
+
+class NativeCompiler:
+    """
+    NativeCompiler compiles the policybook AST to NativePolicy.
+    Each expression is compiled to the semantics of the rego code which `ExpressionTranspiler` generates for it,
+    including how undefined values are handled. A construct which cannot be expressed raises NativeCompileError.
+    """
+
+    def compile_policyset(self, ast_data: dict) -> List[NativePolicy]:
+        if "PolicySet" not in ast_data:
+            raise NativeCompileError("no policy found")
+        ps = ast_data["PolicySet"]
+        policies = []
+        for p in ps.get("policies", []):
+            policies.append(self.compile_policy(policy=p.get("Policy", {}), vars=ps.get("vars")))
+        return policies
+
+    def compile_policy(self, policy: dict, vars: dict = None) -> NativePolicy:
+        native_policy = NativePolicy()
+        native_policy.package = clean_error_token(policy["name"])
+        native_policy.target = str(policy.get("target"))
+        native_policy.tags = policy.get("tags") or []
+        # vars are declared as rego values in JSON
+        native_policy.vars = json.loads(json.dumps(vars or {}))
+
+        rules = []
+        self.trace_ast_tree(
+            condition=policy.get("condition", {}),
+            policy_name=native_policy.package,
+            vars=native_policy.vars,
+            rules=rules,
+        )
+        native_policy.rules = rules
+        native_policy.root_rule = rules[-1].name
+
+        action = policy.get("actions", [])[0]["Action"]
+        native_policy.action = action.get("action", "")
+        action_args = action.get("action_args") or {}
+        native_policy.message_func = self.compile_message(action_args.get("msg", ""), native_policy.vars)
+        native_policy.input_paths = find_input_paths(policy)
+        return native_policy
+
+    # the rule names and their order are the same as `ExpressionTranspiler.trace_ast_tree()`
+    def trace_ast_tree(self, condition: dict, policy_name: str, vars: dict, rules: list, depth=0, counter=None) -> str:
+        if counter is None:
+            counter = {}
+        if depth not in counter:
+            counter[depth] = 0
+        counter[depth] += 1
+        func_name = f"{policy_name}_{depth}_{counter[depth]}"
+
+        if "AndExpression" in condition or "AllCondition" in condition:
+            if "AndExpression" in condition:
+                children = [condition["AndExpression"]["lhs"], condition["AndExpression"]["rhs"]]
+            else:
+                children = condition["AllCondition"]
+            names = [self.trace_ast_tree(c, policy_name, vars, rules, depth + 1, counter) for c in children]
+            func = make_all_func(names)
+        elif "OrExpression" in condition or "AnyCondition" in condition:
+            if "OrExpression" in condition:
+                children = [condition["OrExpression"]["lhs"], condition["OrExpression"]["rhs"]]
+            else:
+                children = condition["AnyCondition"]
+            names = [self.trace_ast_tree(c, policy_name, vars, rules, depth, counter) for c in children]
+            func = make_any_func(names)
+        elif "NotAllCondition" in condition:
+            names = [self.trace_ast_tree(c, policy_name, vars, rules, depth + 1, counter) for c in condition["NotAllCondition"]]
+            func = make_not_all_func(names)
+        else:
+            func = self.compile_expression(condition, vars)
+        rules.append(NativeRule(name=func_name, func=func))
+        return func_name
+
+    def compile_expression(self, condition: dict, vars: dict):
+        if not isinstance(condition, dict) or len(condition) != 1:
+            raise NativeCompileError(f"unsupported condition: {condition}")
+        exp_type, exp = list(condition.items())[0]
+        handler = getattr(self, f"compile_{exp_type}", None)
+        if handler:
+            return handler(exp, vars)
+        return self.compile_non_operator(condition, vars)
+
+    def compile_operand(self, data: any, vars: dict):
+        text = _base_expression.change_data_format(data)
+        return compile_rego_term(text, vars)
+
+    def compile_EqualsExpression(self, exp: dict, vars: dict, negate: bool = False):
+        lhs = self.compile_operand(exp["lhs"], vars)
+        rhs_data = exp["rhs"]
+        if isinstance(rhs_data, dict) and "Boolean" in rhs_data:
+            # `lhs == true` is transpiled to `lhs` and `lhs == false` is transpiled to `not lhs`
+            expected = rhs_data["Boolean"] != negate
+            if expected:
+                return lambda inp, values: is_truthy(lhs(inp))
+            return lambda inp, values: not is_truthy(lhs(inp))
+        rhs = self.compile_operand(rhs_data, vars)
+
+        def _func(inp, values):
+            lhs_val = lhs(inp)
+            rhs_val = rhs(inp)
+            if lhs_val is UNDEFINED or rhs_val is UNDEFINED:
+                return False
+            return rego_equal(lhs_val, rhs_val) != negate
+
+        return _func
+
+    def compile_NotEqualsExpression(self, exp: dict, vars: dict):
+        return self.compile_EqualsExpression(exp, vars, negate=True)
+
+    def compile_ItemInListExpression(self, exp: dict, vars: dict, swap: bool = False, negate: bool = False):
+        lhs = self.compile_operand(exp["lhs"], vars)
+        rhs = self.compile_operand(exp["rhs"], vars)
+        if swap:
+            lhs, rhs = rhs, lhs
+
+        def _func(inp, values):
+            lhs_list = to_list(lhs(inp))
+            rhs_val = rhs(inp)
+            if lhs_list is UNDEFINED or rhs_val is UNDEFINED:
+                return False
+            return check_item_in_list(lhs_list, rhs_val) != negate
+
+        return _func
+
+    def compile_ItemNotInListExpression(self, exp: dict, vars: dict):
+        return self.compile_ItemInListExpression(exp, vars, negate=True)
+
+    def compile_ListContainsItemExpression(self, exp: dict, vars: dict):
+        return self.compile_ItemInListExpression(exp, vars, swap=True)
+
+    def compile_ListNotContainsItemExpression(self, exp: dict, vars: dict):
+        return self.compile_ItemInListExpression(exp, vars, swap=True, negate=True)
+
+    def compile_KeyInDictExpression(self, exp: dict, vars: dict, negate: bool = False):
+        lhs = self.compile_operand(exp["lhs"], vars)
+        rhs = self.compile_operand(exp["rhs"], vars)
+
+        def _func(inp, values):
+            lhs_val = lhs(inp)
+            if not is_truthy(lhs_val):
+                return False
+            rhs_val = rhs(inp)
+            # `[key | lhs[key]; key == rhs]` only collects keys whose values are truthy
+            if isinstance(lhs_val, dict):
+                items = lhs_val.items()
+            elif isinstance(lhs_val, list):
+                items = enumerate(lhs_val)
+            else:
+                items = []
+            found = any(is_truthy(value) and rego_equal(key, rhs_val) for key, value in items)
+            return found != negate
+
+        return _func
+
+    def compile_KeyNotInDictExpression(self, exp: dict, vars: dict):
+        return self.compile_KeyInDictExpression(exp, vars, negate=True)
+
+    def compile_IsDefinedExpression(self, exp: dict, vars: dict, negate: bool = False):
+        val = _base_expression.change_data_format(exp)
+        if not isinstance(val, str):
+            raise NativeCompileError(f"unsupported operand for `is defined`: {exp}")
+        value = compile_rego_term(val, vars)
+        parent = None
+        if "." in val:
+            val_key = val.split(".")[-1]
+            parent = compile_rego_term(val.replace(f".{val_key}", ""), vars)
+
+        def _func(inp, values):
+            if parent and not is_truthy(parent(inp)):
+                return False
+            return is_truthy(value(inp)) != negate
+
+        return _func
+
+    def compile_IsNotDefinedExpression(self, exp: dict, vars: dict):
+        return self.compile_IsDefinedExpression(exp, vars, negate=True)
+
+    def compile_compare_expression(self, exp: dict, vars: dict, operator: str):
+        lhs = self.compile_operand(exp["lhs"], vars)
+        rhs = self.compile_operand(exp["rhs"], vars)
+        check = compare_operators[operator]
+
+        def _func(inp, values):
+            lhs_val = lhs(inp)
+            rhs_val = rhs(inp)
+            if lhs_val is UNDEFINED or rhs_val is UNDEFINED:
+                return False
+            return check(rego_compare(lhs_val, rhs_val))
+
+        return _func
+
+    def compile_GreaterThanExpression(self, exp: dict, vars: dict):
+        return self.compile_compare_expression(exp, vars, ">")
+
+    def compile_GreaterThanOrEqualToExpression(self, exp: dict, vars: dict):
+        return self.compile_compare_expression(exp, vars, ">=")
+
+    def compile_LessThanExpression(self, exp: dict, vars: dict):
+        return self.compile_compare_expression(exp, vars, "<")
+
+    def compile_LessThanOrEqualToExpression(self, exp: dict, vars: dict):
+        return self.compile_compare_expression(exp, vars, "<=")
+
+    def compile_NegateExpression(self, exp: dict, vars: dict):
+        value = self.compile_operand(exp, vars)
+        return lambda inp, values: not is_truthy(value(inp))
+
+    def compile_SearchMatchesExpression(self, exp: dict, vars: dict, negate: bool = False):
+        lhs = self.compile_operand(exp["lhs"], vars)
+        search_type = exp["rhs"]["SearchType"]
+        rhs = self.compile_operand(search_type["pattern"], vars)
+        ignorecase = False
+        for option in search_type.get("options", []):
+            if option["name"]["String"] == "ignorecase" and option["value"]["Boolean"]:
+                ignorecase = True
+        kind = search_type["kind"]["String"]
+        if kind == "search":
+            check = rego_contains
+        elif kind == "match":
+            check = rego_startswith
+        elif kind == "regex":
+            check = _regex_check
+        else:
+            raise NativeCompileError(f"unsupported search kind: {kind}")
+
+        def _func(inp, values):
+            lhs_val = lhs(inp)
+            rhs_val = rhs(inp)
+            if ignorecase:
+                lhs_val = rego_lower(lhs_val)
+                rhs_val = rego_lower(rhs_val)
+            if lhs_val is UNDEFINED or rhs_val is UNDEFINED:
+                found = UNDEFINED
+            else:
+                found = check(lhs_val, rhs_val)
+            if not negate:
+                return found is True
+            # `not contains(...)` succeeds for an undefined result, but `regex.find_n(...) == []` does not
+            if kind == "regex":
+                return found is False
+            return found is not True
+
+        return _func
+
+    def compile_SearchNotMatchesExpression(self, exp: dict, vars: dict):
+        return self.compile_SearchMatchesExpression(exp, vars, negate=True)
+
+    def compile_SelectExpression(self, exp: dict, vars: dict, negate: bool = False, key: str = None):
+        lhs = self.compile_operand(exp["lhs"], vars)
+        operator = exp["rhs"]["operator"]["String"]
+        rhs = self.compile_operand(exp["rhs"]["value"], vars)
+
+        def _get(item):
+            if key is None:
+                return item
+            return object_get(item, key, "none")
+
+        if operator == "search" or operator == "==":
+
+            def _func(inp, values):
+                lhs_val = lhs(inp)
+                rhs_list = to_list(rhs(inp))
+                if lhs_val is UNDEFINED or rhs_list is UNDEFINED:
+                    return False
+                if key is None:
+                    found = check_item_in_list(lhs_val, rhs_list)
+                else:
+                    found = check_item_key_in_list(lhs_val, rhs_list, key)
+                return found != negate
+
+            return _func
+
+        if operator in compare_operators:
+            check = compare_operators[operator]
+
+            def _func(inp, values):
+                rhs_val = rhs(inp)
+                found = False
+                if rhs_val is not UNDEFINED:
+                    # a comprehension over an undefined value is just empty
+                    for item in rego_values(lhs(inp)):
+                        value = _get(item)
+                        if value is not UNDEFINED and check(rego_compare(value, rhs_val)):
+                            found = True
+                            break
+                return found != negate
+
+            return _func
+
+        raise NativeCompileError(f"unsupported operator for select: {operator}")
+
+    def compile_SelectNotExpression(self, exp: dict, vars: dict):
+        return self.compile_SelectExpression(exp, vars, negate=True)
+
+    def compile_SelectAttrExpression(self, exp: dict, vars: dict, negate: bool = False):
+        key = exp["rhs"]["key"]["String"]
+        return self.compile_SelectExpression(exp, vars, negate=negate, key=key)
+
+    def compile_SelectAttrNotExpression(self, exp: dict, vars: dict):
+        return self.compile_SelectAttrExpression(exp, vars, negate=True)
+
+    def compile_non_operator(self, condition: dict, vars: dict):
+        for data_type in ["String", "Input", "Variable", "Integer", "Float", "NullType"]:
+            if data_type in condition:
+                value = self.compile_operand(condition, vars)
+                return lambda inp, values: is_truthy(value(inp))
+        raise NativeCompileError(f"unsupported condition: {condition}")
+
+    def compile_message(self, msg: str, vars: dict):
+        # same as `PolicyTranspiler.make_rego_print()`
+        if not isinstance(msg, str) or "\\" in msg:
+            raise NativeCompileError(f"unsupported message: {msg}")
+        vals = re.findall(_msg_var_re, msg)
+        if not vals:
+            # the message is embedded into the rego policy as it is
+            if '"' in msg:
+                raise NativeCompileError(f"unsupported message: {msg}")
+            return lambda inp: msg
+
+        fmt = re.sub(_msg_var_re, "%v", msg).replace('"', "'")
+        if fmt.count("%") != len(vals):
+            raise NativeCompileError(f"unsupported message: {msg}")
+        parts = fmt.split("%v")
+        args = [compile_rego_term(v.strip(), vars) for v in vals]
+
+        def _func(inp):
+            arg_values = [arg(inp) for arg in args]
+            # an undefined argument makes the whole `sprintf()` undefined
+            if any(v is UNDEFINED for v in arg_values):
+                return format_value(UNDEFINED)
+            text = parts[0]
+            for v, part in zip(arg_values, parts[1:]):
+                text += format_value(v) + part
+            return text
+
+        return _func
+
+
+def make_all_func(names: List[str]):
+    return lambda inp, values: all(values[name] for name in names)
+
+
+def make_any_func(names: List[str]):
+    return lambda inp, values: any(values[name] for name in names)
+
+
+def make_not_all_func(names: List[str]):
+    return lambda inp, values: any(not values[name] for name in names)
+
+
+def _regex_check(value, pattern):
+    return rego_regex_found(pattern, value)
+
+
+def compile_rego_term(text: any, vars: dict):
+    """
+    Compile a rego term produced by the transpiler; a JSON literal, `input.xxx` or a reference to a variable.
+    """
+    if isinstance(text, bool) or text is None:
+        # python booleans are not valid rego terms
+        raise NativeCompileError(f"unsupported term: {text}")
+    if isinstance(text, (int, float)):
+        return lambda inp: text
+    if not isinstance(text, str):
+        raise NativeCompileError(f"unsupported term: {text}")
+
+    try:
+        literal = json.loads(text)
+        return lambda inp: literal
+    except ValueError:
+        pass
+
+    head, path = parse_ref(text)
+    if head == "input":
+        return lambda inp: lookup(inp, path)
+    if head in vars:
+        value = lookup(vars[head], path)
+        return lambda inp: value
+    raise NativeCompileError(f"unknown reference: {text}")
+
+
+def parse_ref(text: str):
+    matched = _ref_head_re.match(text)
+    if not matched:
+        raise NativeCompileError(f"unsupported term: {text}")
+    head = matched.group(0)
+    pos = matched.end()
+    path = []
+    while pos < len(text):
+        matched = _ref_segment_re.match(text, pos)
+        if not matched:
+            raise NativeCompileError(f"unsupported term: {text}")
+        name, quoted, index = matched.groups()
+        if name is not None:
+            path.append(name)
+        elif quoted is not None:
+            path.append(json.loads(f'"{quoted}"'))
+        else:
+            path.append(int(index))
+        pos = matched.end()
+    return head, path
+
+
+def find_input_paths(policy: dict):
+    """
+    Returns the input paths which a policybook policy reads in its condition and its message,
+    e.g. `[["ansible.builtin.package", "name"]]`. A path stops before an array index so that it covers the whole array.
+    None is returned if the policy reads the whole input or a reference to the input cannot be parsed.
+    """
+    refs = []
+    _find_input_refs(policy.get("condition", {}), refs)
+    for action in policy.get("actions", []):
+        action_args = action.get("Action", {}).get("action_args") or {}
+        msg = action_args.get("msg", "")
+        if isinstance(msg, str):
+            refs.extend([v.strip() for v in re.findall(_msg_var_re, msg)])
+
+    paths = []
+    for ref in refs:
+        if not isinstance(ref, str) or not re.match(r"input\b", ref):
+            continue
+        try:
+            _, path = parse_ref(ref)
+        except NativeCompileError:
+            return None
+        int_indices = [i for i, segment in enumerate(path) if isinstance(segment, int)]
+        if int_indices:
+            path = path[: int_indices[0]]
+        if not path:
+            return None
+        if path not in paths:
+            paths.append(path)
+    # a path under another path is covered by it
+    paths = [path for path in paths if not any([len(other) < len(path) and path[: len(other)] == other for other in paths])]
+    return sorted(paths)
+
+
+def _find_input_refs(node: any, refs: list):
+    if isinstance(node, dict):
+        if isinstance(node.get("Input"), str):
+            refs.append(node["Input"])
+        for exp_type in ["KeyInDictExpression", "KeyNotInDictExpression"]:
+            exp = node.get(exp_type)
+            if isinstance(exp, dict) and exp.get("lhs") == {"Input": "input"} and isinstance(exp.get("rhs", {}).get("String"), str):
+                # checking a key of the input itself reads only the key, and a projected input is always defined
+                refs.append("input[" + json.dumps(exp["rhs"]["String"]) + "]")
+                return
+        for value in node.values():
+            _find_input_refs(value, refs)
+    elif isinstance(node, list):
+        for value in node:
+            _find_input_refs(value, refs)
+    return
+
+
+def clean_error_token(in_str):
+    # same as `PolicyTranspiler.clean_error_token()`
+    return in_str.replace(" ", "_").replace("-", "_").replace("?", "").replace("(", "_").replace(")", "_")
+
+
+def load_native_policy(fpath: str, rego_hash: str = "") -> NativePolicy:
+    """
+    Load a policy AST file which `PolicyTranspiler` writes next to a rego policy, and compile it.
+    If `rego_hash` is given, it must be the same as the hash of the rego policy recorded in the file.
+    """
+    with open(fpath, "r") as file:
+        data = json.load(file)
+    if rego_hash and data.get("rego_hash") != rego_hash:
+        raise NativeCompileError(f"`{fpath}` does not match the rego policy")
+    return NativeCompiler().compile_policy(policy=data.get("policy", {}), vars=data.get("vars"))
@@ -21,6 +21,8 @@ class RegoPolicy:
     vars_declaration: dict = field(default_factory=dict)
     tags: List[str] = field(default_factory=list)
     target: str = ""
+    # input paths which the policy reads; None if the policy may read any part of the input
+    input_paths: List[list] = None
 
     def to_rego(self):
         content = []
@@ -35,6 +37,10 @@ class RegoPolicy:
             tags_str = json.dumps(self.tags)
             content.append(f"__tags__ = {tags_str}")
             content.append("\n")
+        # input paths
+        if self.input_paths is not None:
+            input_paths_str = json.dumps(self.input_paths)
+            content.append(f"__input_paths__ = {input_paths_str}")
         # vars
         if self.vars_declaration:
             for var_name, val in self.vars_declaration.items():
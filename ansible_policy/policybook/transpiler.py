@@ -15,6 +15,8 @@
 #  limitations under the License.
 
 import traceback
+import json
+import hashlib
 import yaml
 import argparse
 import os
@@ -26,6 +28,7 @@ from ansible_policy.policybook.policy_parser import parse_policy_sets, VALID_ACT
 from ansible_policy.policybook.rego_model import RegoPolicy, RegoFunc
 from ansible_policy.utils import init_logger
 from ansible_policy.policybook.expressioin_transpiler import ExpressionTranspiler
+from ansible_policy.policybook.native_evaluator import find_input_paths
 
 logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
 
@@ -45,8 +48,10 @@ class PolicyTranspiler:
     PolicyTranspiler transforms a policybook to a Rego policy.
     """
 
-    def __init__(self, tmp_dir=None):
+    def __init__(self, tmp_dir=None, emit_ast=False):
         self.tmp_dir = tmp_dir
+        # if True, the AST of each policy is saved as `<package>.ast.json` next to the rego policy for the native evaluator
+        self.emit_ast = emit_ast
 
     def run(self, input, outdir):
         if "extensions/policy" not in outdir:
@@ -129,6 +134,8 @@ class PolicyTranspiler:
             rego_policy.vars_declaration = ps.get("vars", [])
             # target
             rego_policy.target = pol.get("target")
+            # input paths; the evaluator sends only these parts of the input
+            rego_policy.input_paths = find_input_paths(pol)
 
             # condition -> rule
             _name = self.clean_error_token(pol["name"])
@@ -142,12 +149,18 @@ class PolicyTranspiler:
             action_func = self.action_to_rule(action, root_func)
             rego_policy.action_func = action_func
 
-            policies.append(rego_policy)
+            policies.append((rego_policy, pol))
 
-        for rpol in policies:
+        for rpol, pol in policies:
             rego_output = rpol.to_rego()
             with open(os.path.join(rego_dir, f"{rpol.package}.rego"), "w") as f:
                 f.write(rego_output)
+            if self.emit_ast:
+                # the hash is used to detect a rego policy modified after the transpilation
+                rego_hash = hashlib.sha256(rego_output.encode("utf-8")).hexdigest()
+                ast_output = {"vars": ps.get("vars", {}), "policy": pol, "rego_hash": rego_hash}
+                with open(os.path.join(rego_dir, f"{rpol.package}.ast.json"), "w") as f:
+                    json.dump(ast_output, f)
         return
 
     def action_to_rule(self, input: dict, condition: RegoFunc):
@@ -171,7 +184,8 @@ class PolicyTranspiler:
         used_funcs = []
         for func in condition_funcs:
             used_funcs.extend(func.util_funcs)
-        used_funcs = list(set(used_funcs))
+        # in the order of use, so the same policybook is always transpiled into the same rego
+        used_funcs = list(dict.fromkeys(used_funcs))
         return root_func, condition_funcs, used_funcs
 
     def make_rego_print(self, input_text):
@@ -31,15 +31,27 @@ request_http_data_source(url) := ext_data if {
     ext_data := resp.body
 }
 
+# the project context of an input; ansible-policy publishes it once per evaluation as `data.agk.projects[<key>]`
+# and embeds only the key in `_agk` for policies which read the context through this function,
+# while other inputs embed the whole context in `_agk`
+agk_project(x) := project if {
+    project := data.agk.projects[x._agk.project_key]
+}
+
+agk_project(x) := project if {
+    not has_key(x._agk, "project_key")
+    project := x._agk
+}
+
 _find_playbook_by_task(task) := playbook_key if {
-    playbook := input._agk.playbooks[_]
+    playbook := agk_project(input).playbooks[_]
     current_task = playbook.tasks[_]
     current_task.key == task.key
     playbook_key := playbook.key
 }
 
 _find_taskfile_by_task(task) := taskfile_key if {
-    taskfile := input._agk.taskfiles[_]
+    taskfile := agk_project(input).taskfiles[_]
     current_task = taskfile.tasks[_]
     current_task.key == task.key
     taskfile_key := taskfile.key
@@ -60,6 +72,6 @@ resolve_var(ref, task) := var_value if {
     var_name_tmp2 := replace(var_name_tmp1, "}}", "")
     var_name := replace(var_name_tmp2, " ", "")
     entrypoint_key := _find_entrypoint_by_task(task)
-    variables := input._agk.variables[entrypoint_key]
+    variables := agk_project(input).variables[entrypoint_key]
     var_value := variables[var_name]
 }
@@ -1,7 +1,9 @@
 import os
 import sys
 import copy
+import hashlib
 import tempfile
+import threading
 import jsonpickle
 import json
 import yaml
@@ -13,10 +15,13 @@ from ansible.parsing.yaml.objects import AnsibleUnicode
 
 from ansible_policy.utils import (
     get_module_name_from_task,
-    load_external_data,
+    project_input,
+    agk_target_attrs,
     prepare_project_dir_from_runner_jobdata,
     embed_module_info_with_galaxy,
 )
+from ansible_policy.external_data import get_external_data
+from ansible_policy.json_encoder import encode_json
 
 from ansible_content_capture.scanner import AnsibleScanner
 from ansible_content_capture.models import (
@@ -44,6 +49,11 @@ InputTypeTaskResult = "task_result"
 InputTypeEvent = "event"
 InputTypeRest = "rest"
 
+# attributes of PolicyInput which are common to all targets in a project
+project_context_attrs = ["source", "project", "playbooks", "taskfiles", "roles", "vars_files", "extra_vars", "variables"]
+# attributes of PolicyInput which are used only during a run and never serialized
+runtime_attrs = ["shared_context", "tree_variables"]
+
 
 @dataclass
 class Variables(object):
@@ -541,6 +551,39 @@ class APIRequest(object):
         return req
 
 
+@dataclass
+class SharedContext(object):
+    """
+    SharedContext is shared by all per-target inputs of a project scan.
+    Once `PolicyInput.publish_context()` sets `key`, the project context is published as OPA data
+    `data.agk.projects[key]` and the inputs embed only their own target and the key in `_agk`.
+    It also holds the variable resolver of the targets, so the resolver lives only as long as the run.
+    """
+
+    # sha256 of `json`; empty until the context is published
+    key: str = ""
+    json: str = field(default="", repr=False)
+
+    resolver: "VariableResolver" = field(default=None, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def get_resolver(self, variables: dict):
+        with self._lock:
+            if self.resolver is None:
+                self.resolver = VariableResolver(variables=variables)
+            resolver = self.resolver
+        if resolver.variables is not variables:
+            # the variables of this input are replaced after it is made, so the shared caches do not apply
+            return VariableResolver(variables=variables)
+        return resolver
+
+    def release_resolver(self):
+        # drop the resolver with its caches and return it for the statistics
+        with self._lock:
+            resolver, self.resolver = self.resolver, None
+        return resolver
+
+
 @dataclass
 class PolicyInput(object):
     type: str = ""
@@ -563,6 +606,12 @@ class PolicyInput(object):
 
     variables: dict = field(default_factory=dict)
 
+    # not a part of the input; see `runtime_attrs`
+    shared_context: SharedContext = field(default=None, repr=False, compare=False)
+    # key: entrypoint key of a tree, value: variables set in the tree; not a part of the input, but an incremental run
+    # compares them to find whether the variables of the whole project can be changed by the changed files
+    tree_variables: dict = field(default=None, repr=False, compare=False)
+
     # TODO: imeplement attrs below
     # modules
     # files
@@ -584,10 +633,7 @@ class PolicyInput(object):
                     tasks.extend(taskfile.tasks)
             p_input_list = []
             for task in tasks:
-                p_input = copy.deepcopy(base_input)
-                p_input.type = InputTypeTask
-                p_input.task = task
-                p_input_list.append(p_input)
+                p_input_list.append(base_input.make_target_input(input_type=InputTypeTask, task=task))
             return p_input_list
         elif input_type == InputTypePlay:
             if not base_input:
@@ -598,10 +644,7 @@ class PolicyInput(object):
                 plays.extend(playbook.plays)
             p_input_list = []
             for play in plays:
-                p_input = copy.deepcopy(base_input)
-                p_input.type = InputTypePlay
-                p_input.play = play
-                p_input_list.append(p_input)
+                p_input_list.append(base_input.make_target_input(input_type=InputTypePlay, play=play))
             return p_input_list
         elif input_type == InputTypeRole:
             if not base_input:
@@ -609,13 +652,10 @@ class PolicyInput(object):
                 base_input = base_input_list[0]
             roles = []
             for role in base_input.roles.values():
-                roles.extend(role)
+                roles.append(role)
             p_input_list = []
             for role in roles:
-                p_input = copy.deepcopy(base_input)
-                p_input.type = InputTypeRole
-                p_input.role = role
-                p_input_list.append(p_input)
+                p_input_list.append(base_input.make_target_input(input_type=InputTypeRole, role=role))
             return p_input_list
         else:
             p_input = PolicyInput()
@@ -653,6 +693,7 @@ class PolicyInput(object):
                 if variables.extra_vars:
                     set_variables.update(variables.extra_vars)
             p_input.variables = set_variables
+            p_input.tree_variables = set_variables_for_all_trees
 
             return [p_input]
 
@@ -701,26 +742,93 @@ class PolicyInput(object):
         p_input_list.append(p_input)
         return p_input_list
 
+    def make_target_input(self, input_type: str, task: Task = None, play: Play = None, role: Role = None):
+        """
+        Returns a PolicyInput for a single task, play or role which shares the project context of this input.
+        Only the references are copied, so the per-target inputs are cheap regardless of the project size.
+        """
+        if self.shared_context is None:
+            self.shared_context = SharedContext()
+        p_input = copy.copy(self)
+        p_input.type = input_type
+        p_input.task = task
+        p_input.play = play
+        p_input.role = role
+        return p_input
+
     def to_object_json(self, **kwargs):
-        kwargs["value"] = self
+        # a decoded input has the default values of the runtime attributes
+        obj = copy.copy(self)
+        for attr in runtime_attrs:
+            obj.__dict__.pop(attr, None)
+        kwargs["value"] = obj
         kwargs["make_refs"] = False
         kwargs["separators"] = (",", ":")
         return jsonpickle.encode(**kwargs)
 
-    def to_json(self, **kwargs):
+    def get_context_data(self):
+        return {attr: getattr(self, attr) for attr in project_context_attrs}
+
+    def publish_context(self):
+        """
+        Serialize the project context once for all targets sharing it, and return a tuple of (key, context JSON).
+        After this, `to_json()` of the targets refers to the context by the key instead of embedding it.
+        """
+        if self.shared_context is None:
+            raise ValueError("this input does not have a shared project context; it must be made by `make_target_input()`")
+        if not self.shared_context.key:
+            context_json = encode_input(self.get_context_data())
+            self.shared_context.json = context_json
+            self.shared_context.key = hashlib.sha256(context_json.encode("utf-8")).hexdigest()
+        return self.shared_context.key, self.shared_context.json
+
+    def to_json(self, embed_context: bool = False):
+        return encode_input(self.get_input_data(embed_context=embed_context))
+
+    def to_projected_json(self, input_paths: List[list], embed_context: bool = False):
+        # the same as `to_json()` but only with the values at `input_paths`, for policies which declare the paths they read
+        return encode_input(project_input(data=self.get_input_data(embed_context=embed_context), input_paths=input_paths))
+
+    def get_input_data(self, embed_context: bool = False):
+        """
+        Returns the input with the project context in `_agk`. Once the context is published, only the target and
+        the key of the context are embedded, unless `embed_context` is True for a policy which reads the context
+        from `input._agk` directly instead of `agk_project()`.
+        """
+        # copy the target data because it can be a dict owned by the shared context such as `play.options`
+        data = dict(self.get_target_data())
+        data["_agk"] = {attr: val for attr, val in self.__dict__.items() if attr not in runtime_attrs}
+        if self.shared_context is not None and self.shared_context.key and not embed_context:
+            # the project context is published as OPA data, so only the target and the key are embedded
+            agk = {attr: getattr(self, attr) for attr in agk_target_attrs}
+            agk["project_key"] = self.shared_context.key
+            data["_agk"] = agk
+        return data
+
+    def to_target_json(self):
+        # the same as `to_json()` but without `_agk`, for policies which read only the target itself
+        return encode_input({key: val for key, val in self.get_target_data().items() if key != "_agk"})
+
+    def get_variable_resolver(self):
+        # the targets of a project share a resolver, so the same template is parsed and resolved only once in a run
+        if self.shared_context is None:
+            return VariableResolver(variables=self.variables)
+        return self.shared_context.get_resolver(variables=self.variables)
+
+    def get_target_data(self):
         data = {}
         try:
             if self.type == InputTypeTask:
                 task_data_block = yaml.safe_load(self.task.yaml_lines)
                 if task_data_block:
                     data = task_data_block[0]
-                    data = recursive_resolve_variable(data, self.variables)
+                    data = recursive_resolve_variable(data, self.variables, resolver=self.get_variable_resolver())
             elif self.type == InputTypePlay:
                 data = self.play.options
             elif self.type == InputTypeTaskResult:
                 module_options = task_fields2module_options(self.task_result._task_fields)
                 data.update(module_options)
-                data = recursive_resolve_variable(data, self.variables)
+                data = recursive_resolve_variable(data, self.variables, resolver=self.get_variable_resolver())
                 data["variables"] = self.variables
             elif self.type == InputTypeEvent:
                 data = self.event.__dict__
@@ -728,12 +836,7 @@ class PolicyInput(object):
                 data = self.rest.__dict__
         except Exception:
             pass
-        data["_agk"] = self
-        kwargs["value"] = data
-        kwargs["unpicklable"] = False
-        kwargs["make_refs"] = False
-        kwargs["separators"] = (",", ":")
-        return jsonpickle.encode(**kwargs)
+        return data
 
     @staticmethod
     def from_object_json(json_str: str = "", fpath: str = ""):
@@ -752,6 +855,29 @@ class PolicyInput(object):
         return obj
 
 
+# classes which jsonpickle encodes by their attributes; `encode_input()` encodes them without jsonpickle
+input_plain_types = (
+    Variables,
+    RuntimeData,
+    File,
+    Task,
+    Play,
+    Playbook,
+    TaskFile,
+    Role,
+    Project,
+    Event,
+    APIRequest,
+    BecomeInfo,
+    PolicyInput,
+)
+
+
+def encode_input(value: any):
+    # the same JSON as `jsonpickle.encode(value, unpicklable=False, make_refs=False, separators=(",", ":"))`
+    return encode_json(value, plain_types=input_plain_types)
+
+
 def task_fields2module_options(task_fields: dict):
     task_action = task_fields.get("action", None)
     if not task_action:
@@ -771,82 +897,145 @@ def task_fields2module_options(task_fields: dict):
     return {task_action: module_options}
 
 
-def recursive_resolve_single_var(txt: str, variables: dict):
-    if not isinstance(txt, str):
-        return txt
+# returned by `VariableResolver` for a value which is not in a cache
+_missing = object()
 
-    if "{{" not in txt:
-        return txt
+# the statistics of VariableResolver
+variable_resolver_stats = ["parse_hits", "parse_misses", "resolve_hits", "resolve_misses", "cycles"]
 
-    var_names = extract_var_parts(txt)
-    resolved_txt = txt
-    for var_name, var_details in var_names.items():
-        var_original_txt = var_details["original"]
-        if var_original_txt not in txt:
-            continue
 
-        if var_name not in variables:
-            continue
+@dataclass
+class VariableResolver(object):
+    """
+    VariableResolver resolves `{{ var }}` templates in the same way as `recursive_resolve_single_var()` did,
+    with the parsed parts of each template and the resolved value of each template cached for its `variables`.
+    A variable which is used in its own value is left unresolved there instead of recursing forever.
+    `variables` must not be modified while the resolver is used.
+    """
+
+    variables: dict = field(default_factory=dict, repr=False)
+    # the number of templates whose parts are parsed / found in the cache
+    parse_misses: int = 0
+    parse_hits: int = 0
+    # the number of templates which are resolved / found in the cache
+    resolve_misses: int = 0
+    resolve_hits: int = 0
+    # the number of self-references found
+    cycles: int = 0
+
+    _parts: dict = field(default_factory=dict, repr=False)
+    _resolved: dict = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def get_stats(self):
+        return {key: getattr(self, key) for key in variable_resolver_stats}
+
+    def resolve(self, data: any):
+        if isinstance(data, dict):
+            return {key: self.resolve(val) for key, val in data.items()}
+        elif isinstance(data, list):
+            return [self.resolve(val) for val in data]
+        elif isinstance(data, str):
+            return self.resolve_single(data)
+        return data
 
-        resolved_value = variables[var_name]
-        if isinstance(resolved_value, list):
-            if len(resolved_value) == 1:
-                if txt == var_original_txt:
-                    resolved_txt = resolved_value[0]
-                else:
-                    resolved_var_str = f"{resolved_value[0]}"
-                    resolved_txt = txt.replace(var_original_txt, resolved_var_str)
-            else:
-                resolved_txt = []
-                for single_val in resolved_value:
-                    _resolved = None
+    def resolve_single(self, txt: str):
+        if not isinstance(txt, str) or "{{" not in txt:
+            return txt
+        resolved, _ = self._resolve_single(txt, active=frozenset())
+        return resolved
+
+    def get_var_parts(self, txt: str):
+        var_parts = self._parts.get(txt)
+        if var_parts is not None:
+            with self._lock:
+                self.parse_hits += 1
+            return var_parts
+        var_parts = extract_var_parts(txt)
+        with self._lock:
+            self._parts[txt] = var_parts
+            self.parse_misses += 1
+        return var_parts
+
+    # returns a tuple of (the resolved value, False if it is cut short by a cycle and must not be cached)
+    def _resolve_single(self, txt: str, active: frozenset):
+        resolved = self._resolved.get(txt, _missing)
+        if resolved is not _missing:
+            with self._lock:
+                self.resolve_hits += 1
+            return resolved, True
+
+        complete = True
+        resolved_txt = txt
+        for var_name, var_details in self.get_var_parts(txt).items():
+            var_original_txt = var_details["original"]
+            if var_original_txt not in txt:
+                continue
+
+            if var_name not in self.variables:
+                continue
+
+            if var_name in active:
+                # the variable is used in its own value
+                with self._lock:
+                    self.cycles += 1
+                complete = False
+                continue
+
+            resolved_value = self.variables[var_name]
+            if isinstance(resolved_value, list):
+                if len(resolved_value) == 1:
                     if txt == var_original_txt:
-                        _resolved = single_val
+                        resolved_txt = resolved_value[0]
                     else:
-                        resolved_var_str = f"{single_val}"
-                        _resolved = txt.replace(var_original_txt, resolved_var_str)
-                    resolved_txt.append(_resolved)
-        else:
-            if txt == var_original_txt:
-                resolved_txt = resolved_value
+                        resolved_txt = txt.replace(var_original_txt, f"{resolved_value[0]}")
+                else:
+                    resolved_txt = []
+                    for single_val in resolved_value:
+                        if txt == var_original_txt:
+                            resolved_txt.append(single_val)
+                        else:
+                            resolved_txt.append(txt.replace(var_original_txt, f"{single_val}"))
             else:
-                resolved_var_str = f"{resolved_value}"
-                resolved_txt = txt.replace(var_original_txt, resolved_var_str)
+                if txt == var_original_txt:
+                    resolved_txt = resolved_value
+                else:
+                    resolved_txt = txt.replace(var_original_txt, f"{resolved_value}")
+
+            if type(txt) is type(resolved_txt) and txt == resolved_txt:
+                continue
 
-        if type(txt) == type(resolved_txt) and txt == resolved_txt:
-            continue
+            # a partially resolved string is resolved again; a list is returned as it is
+            if isinstance(resolved_txt, str) and "{{" in resolved_txt:
+                resolved_txt, _complete = self._resolve_single(resolved_txt, active=active | {var_name})
+                complete = complete and _complete
 
-        if isinstance(resolved_txt, (str, list)):
-            resolved_txt = recursive_resolve_single_var(resolved_txt, variables)
-    return resolved_txt
+        with self._lock:
+            self.resolve_misses += 1
+            if complete:
+                self._resolved[txt] = resolved_txt
+        return resolved_txt, complete
+
+
+def recursive_resolve_single_var(txt: str, variables: dict, resolver: VariableResolver = None):
+    if not isinstance(txt, str) or "{{" not in txt:
+        return txt
+    if resolver is None:
+        resolver = VariableResolver(variables=variables)
+    return resolver.resolve_single(txt)
 
 
 # TODO: support resolution for variables without bracket (e.g. `when: foo == "bar"`)
-def recursive_resolve_variable(data: any, variables: dict, datapath: str = ""):
+def recursive_resolve_variable(data: any, variables: dict, datapath: str = "", resolver: VariableResolver = None):
     if not data:
         return data
 
     if not variables:
         return data
 
-    newdata = None
-    if isinstance(data, dict):
-        newdata = {}
-        for key, val in data.items():
-            _datapath = f"{datapath}.{key}"
-            newval = recursive_resolve_variable(val, variables, _datapath)
-            newdata[key] = newval
-    elif isinstance(data, list):
-        newdata = []
-        for i, val in enumerate(data):
-            _datapath = f"{datapath}.{i}"
-            newval = recursive_resolve_variable(val, variables, _datapath)
-            newdata.append(newval)
-    elif isinstance(data, str):
-        newdata = recursive_resolve_single_var(data, variables)
-    else:
-        newdata = data
-    return newdata
+    if resolver is None:
+        resolver = VariableResolver(variables=variables)
+    return resolver.resolve(data)
 
 
 def task_result_vars2dict(task_result_vars: dict):
@@ -860,7 +1049,7 @@ def task_result_vars2dict(task_result_vars: dict):
 
 
 def process_input_data_with_external_data(input_type: str, input_data: PolicyInput, external_data_path: str):
-    galaxy = load_external_data(ftype="galaxy", fpath=external_data_path)
+    galaxy = get_external_data(ftype="galaxy", fpath=external_data_path)
 
     if input_type == InputTypeTask:
         task = input_data.task
@@ -1,14 +1,18 @@
 import os
 import re
+import math
 import base64
 import json
 import yaml
+from rapidfuzz import process as fuzz_process
 from rapidfuzz.distance import Levenshtein
 import tarfile
 import zipfile
 import tempfile
 import logging
 import subprocess
+from dataclasses import is_dataclass
+from typing import List
 
 
 default_target_type = "task"
@@ -46,6 +50,38 @@ def validate_opa_installation(executable_name: str = "opa"):
         raise ValueError("`opa` command is required to evaluate OPA policies")
 
 
+def get_available_cpu_count():
+    """
+    Returns the number of CPUs this process can use, considering CPU affinity and a cgroup CPU quota.
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max", "r") as file:
+            quota_str, period_str = file.read().split()[:2]
+        if quota_str != "max":
+            quota = int(quota_str) / int(period_str)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as file:
+                quota_us = int(file.read().strip())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as file:
+                period_us = int(file.read().strip())
+            if quota_us > 0 and period_us > 0:
+                quota = quota_us / period_us
+        except (OSError, ValueError):
+            pass
+    if quota:
+        count = min(count, math.ceil(quota))
+    return max(count, 1)
+
+
 def load_galaxy_data(fpath: str):
     data = {}
     with open(fpath, "r") as file:
@@ -56,8 +92,9 @@ def load_galaxy_data(fpath: str):
     return data.get("galaxy", {})
 
 
-def eval_opa_policy(rego_path: str, input_data: str, external_data_path: str, executable_name: str = "opa"):
-    rego_pkg_name = get_rego_main_package_name(rego_path=rego_path)
+def eval_opa_policy(rego_path: str, input_data: str, external_data_path: str, executable_name: str = "opa", rego_pkg_name: str = ""):
+    if not rego_pkg_name:
+        rego_pkg_name = get_rego_main_package_name(rego_path=rego_path)
     if not rego_pkg_name:
         raise ValueError("`package` must be defined in the rego policy file")
 
@@ -136,7 +173,10 @@ def embed_module_info_with_galaxy(task, galaxy):
     if not galaxy:
         galaxy = {}
 
-    mappings = galaxy.get("module_name_mappings", {})
+    # `galaxy` is either a `GalaxyData` or the `galaxy` dict
+    mappings = getattr(galaxy, "module_name_mappings", None)
+    if mappings is None:
+        mappings = galaxy.get("module_name_mappings", {})
 
     module_fqcn = ""
     if "." in task.module:
@@ -212,22 +252,14 @@ supported_external_data_types = [ExternalDataTypeGalaxy, ExternalDataTypeAutomat
 
 
 def load_external_data(ftype: str = "", fpath: str = ""):
-    if ftype not in supported_external_data_types:
-        raise ValueError(f"`{ftype}` is not supported as external data")
+    """
+    Returns the loaded external data, a `GalaxyData` or a `GalaxyDataDB` which is shared in the process.
+    Modules are looked up with `find_module_fqcn()` or `modules.get()`, so a galaxy database reads only
+    the modules looked up instead of the whole data.
+    """
+    from ansible_policy.external_data import get_external_data
 
-    if fpath.endswith(".tar.gz"):
-        new_fpath = fpath[:-7]
-        if not os.path.exists(new_fpath):
-            uncompress_file(fpath)
-        fpath = new_fpath
-
-    ext_data = None
-    if ftype == ExternalDataTypeGalaxy:
-        if fpath:
-            ext_data = load_galaxy_data(fpath=fpath)
-    else:
-        raise NotImplementedError
-    return ext_data
+    return get_external_data(ftype=ftype, fpath=fpath)
 
 
 def match_str_expression(pattern: str, text: str):
@@ -364,6 +396,194 @@ def get_tags_from_rego_policy_file(policy_path: str):
     return tags
 
 
+def parse_rego_policy_metadata(body: str):
+    """
+    Read the package name and the metadata variables (`__target__`, `__target_module__`, `__tags__` and `__input_paths__`)
+    of a rego policy in a single pass, with the same rules as the `detect_*` functions above.
+    """
+    metadata = {
+        "package": "",
+        "target": None,
+        "target_module": None,
+        "tags": None,
+        "input_paths": None,
+    }
+    var_names = {
+        "__target__": "target",
+        "__target_module__": "target_module",
+        "__tags__": "tags",
+        "__input_paths__": "input_paths",
+    }
+    prefix = "package "
+    for line in body.splitlines():
+        _line = line.strip()
+        if not metadata["package"] and _line.startswith(prefix):
+            metadata["package"] = _line[len(prefix) :]
+            continue
+        if "__" not in line:
+            continue
+        parts = [p.strip() for p in line.split("=")]
+        if len(parts) != 2:
+            continue
+        key = var_names.get(parts[0])
+        if not key or metadata[key] is not None:
+            continue
+        if key in ["tags", "input_paths"]:
+            metadata[key] = json.loads(parts[1])
+        else:
+            metadata[key] = parts[1].strip('"').strip("'")
+    if not metadata["target"]:
+        metadata["target"] = default_target_type
+    return metadata
+
+
+rego_util_import_re = re.compile(r"^\s*import\s+data\.ansible_policy\.([A-Za-z_][A-Za-z0-9_]*)\s*$", re.MULTILINE)
+rego_bare_input_re = re.compile(r"^\s*input\s*$", re.MULTILINE)
+# `data.galaxy`, or `data` which is not followed by a field (e.g. `data[key]`)
+rego_galaxy_ref_re = re.compile(r"(?<![.\w])data\b(?!\s*\.)|(?<![.\w])data\s*\.\s*galaxy\b")
+rego_input_ref_re = re.compile(r'\binput\b(?:\s*\.\s*([A-Za-z_][A-Za-z0-9_]*)|\[\s*"([^"\\]*)"\s*\])?')
+rego_field_ref_re = re.compile(r'\s*\.\s*([A-Za-z_][A-Za-z0-9_]*)|\s*\[\s*"([^"\\]*)"\s*\]')
+
+# fields of `_agk` which are embedded in the input even when the project context is published as data
+agk_target_attrs = ["type", "task", "play", "role"]
+
+
+def detect_agk_reference(body: str):
+    """
+    Returns False only if the rego policy never reads `input._agk` or the project context in `data.agk`,
+    either directly or through the functions in `data.ansible_policy`.
+    A reference which cannot be resolved statically (e.g. `input[key]`) is regarded as a read.
+    """
+    imported_funcs = rego_util_import_re.findall(body)
+    _body = rego_util_import_re.sub("", body)
+    # a bare `input` statement only checks that the input is defined, which holds without `_agk` too
+    _body = rego_bare_input_re.sub("", _body)
+    if "data.ansible_policy" in _body or "data.agk" in _body:
+        return True
+    for func_name in imported_funcs:
+        if re.search(rf"\b{func_name}\s*\(", _body):
+            return True
+    for matched in rego_input_ref_re.finditer(_body):
+        key = matched.group(1) or matched.group(2)
+        if not key or key == "_agk":
+            return True
+    return False
+
+
+def detect_agk_context_reference(body: str):
+    """
+    Returns False only if the rego policy never reads the project context (e.g. `input._agk.playbooks`) from the input
+    directly. A policy which reads it through the functions in `data.ansible_policy` such as `agk_project()` gets the
+    context from `data.agk`, so its input needs only the target fields of `_agk`.
+    A reference which cannot be resolved statically (e.g. `input[key]` or `f(input)`) is regarded as a read.
+    """
+    imported_funcs = rego_util_import_re.findall(body)
+    _body = rego_util_import_re.sub("", body)
+    _body = rego_bare_input_re.sub("", _body)
+    # calls of the util functions, which take the whole input to find the project context in `data.agk`
+    util_funcs = [re.escape(f) for f in imported_funcs] + [r"data\.ansible_policy\.[A-Za-z_][A-Za-z0-9_]*"]
+    _body = re.sub(rf"(?<![.\w])(?:{'|'.join(util_funcs)})\s*\([^()]*\)", "", _body)
+    for matched in rego_input_ref_re.finditer(_body):
+        key = matched.group(1) or matched.group(2)
+        if not key:
+            return True
+        if key != "_agk":
+            continue
+        field_matched = rego_field_ref_re.match(_body, matched.end())
+        if not field_matched:
+            return True
+        field = field_matched.group(1) or field_matched.group(2)
+        if field not in agk_target_attrs + ["project_key"]:
+            return True
+    return False
+
+
+def detect_galaxy_reference(body: str):
+    """
+    Returns False only if the rego policy never reads `data.galaxy` by itself.
+    Reading it through `get_module_fqcn()` in `data.ansible_policy` is not regarded as a read, because the function
+    looks up only the modules of the given task. A reference to the whole `data` (e.g. `data[key]`) is regarded as a read.
+    """
+    return bool(rego_galaxy_ref_re.search(body))
+
+
+def find_module_names(objs: list):
+    """
+    Returns a set of all `module` values in the objects, which are traversed through dicts, lists and dataclasses.
+    An object shared by several inputs (e.g. the project context) is traversed only once.
+    """
+    names = set()
+    seen = set()
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+            continue
+        if is_dataclass(obj) and not isinstance(obj, type):
+            obj = obj.__dict__
+        if not isinstance(obj, dict) or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        module = obj.get("module")
+        if module and isinstance(module, str):
+            names.add(module)
+        stack.extend([v for v in obj.values() if isinstance(v, (dict, list, tuple)) or is_dataclass(v)])
+    return names
+
+
+def project_input(data: dict, input_paths: List[list]):
+    """
+    Returns a dict which has only the values at `input_paths` in `data`.
+    Objects are traversed by their attributes in the same way as jsonpickle serializes them,
+    and a path which does not exist in `data` is left out, so that it is undefined as in the whole input.
+    """
+    paths = []
+    for path in input_paths:
+        # an array is projected as a whole
+        int_indices = [i for i, key in enumerate(path) if not isinstance(key, str)]
+        paths.append(list(path[: int_indices[0]]) if int_indices else list(path))
+    projected = {}
+    for path in paths:
+        if not path:
+            return data
+        # a path under another path is covered by it
+        if any([len(other) < len(path) and path[: len(other)] == other for other in paths]):
+            continue
+        value = data
+        found = True
+        for key in path:
+            attrs = value if isinstance(value, dict) else getattr(value, "__dict__", None)
+            if not isinstance(attrs, dict) or key not in attrs:
+                found = False
+                break
+            value = attrs[key]
+        if not found:
+            continue
+        node = projected
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return projected
+
+
+def get_input_paths_key(input_paths: List[list]):
+    # a hashable key of input paths; None for the whole input
+    if input_paths is None:
+        return None
+    return tuple(sorted(set([tuple(path) for path in input_paths]), key=json.dumps))
+
+
+def merge_input_paths(input_paths_list: List[List[list]]):
+    # the paths which are read by any of the policies; None if any of them reads the whole input
+    if any([input_paths is None for input_paths in input_paths_list]):
+        return None
+    merged = set()
+    for input_paths in input_paths_list:
+        merged.update([tuple(path) for path in input_paths])
+    return [list(path) for path in sorted(merged, key=json.dumps)]
+
+
 def match_target_module(module_fqcn: str, rego_path: str):
     module_pattern = detect_target_module_pattern(policy_path=rego_path)
     return match_str_expression(module_pattern, module_fqcn)
@@ -381,6 +601,7 @@ def find_task_line_number(
     module_options: dict = None,
     task_options: dict = None,
     previous_task_line: int = -1,
+    score_cutoff: int = None,
 ):
     if not task_name and not module_options:
         return None, None
@@ -429,62 +650,80 @@ def find_task_line_number(
     if not candidate_blocks:
         return None, None
 
-    reconstructed_yaml = ""
-    best_yaml_lines = ""
-    best_line_num_in_file = []
-    sorted_candidates = []
-    if len(candidate_blocks) == 1:
-        best_yaml_lines = candidate_blocks[0][0]
-        best_line_num_in_file = candidate_blocks[0][1]
-    else:
-        # reconstruct yaml from the task data to calculate similarity (edit distance) later
-        reconstructed_data = [{}]
-        if task_name:
-            reconstructed_data[0]["name"] = task_name
-        reconstructed_data[0][module_name] = module_options
-        if isinstance(task_options, dict):
-            for key, val in task_options.items():
-                if key not in reconstructed_data[0]:
-                    reconstructed_data[0][key] = val
-
-        try:
-            reconstructed_yaml = yaml.safe_dump(reconstructed_data)
-        except Exception:
-            pass
-
-        # find best match by edit distance
-        if reconstructed_yaml:
-
-            def remove_comment_lines(s):
-                lines = s.splitlines()
-                updated = []
-                for line in lines:
-                    if line.strip().startswith("#"):
-                        continue
-                    updated.append(line)
-                return "\n".join(updated)
-
-            def calc_dist(s1, s2):
-                us1 = remove_comment_lines(s1)
-                us2 = remove_comment_lines(s2)
-                dist = Levenshtein.distance(us1, us2)
-                return dist
-
-            r = reconstructed_yaml
-            sorted_candidates = sorted(candidate_blocks, key=lambda x: calc_dist(r, x[0]))
-            best_yaml_lines = sorted_candidates[0][0]
-            best_line_num_in_file = sorted_candidates[0][1]
-        else:
-            # give up here if yaml reconstruction failed
-            # use the first candidate
-            best_yaml_lines = candidate_blocks[0][0]
-            best_line_num_in_file = candidate_blocks[0][1]
+    best_yaml_lines, best_line_num_in_file = candidate_blocks[0]
+    if len(candidate_blocks) > 1:
+        reconstructed_data = reconstruct_task_data(
+            task_name=task_name,
+            module_name=module_name,
+            module_options=module_options,
+            task_options=task_options,
+        )
+        best_yaml_lines, best_line_num_in_file = rank_code_blocks(candidate_blocks, reconstructed_data, score_cutoff=score_cutoff)[0]
 
     yaml_lines = best_yaml_lines
     line_num_in_file = best_line_num_in_file
     return yaml_lines, line_num_in_file
 
 
+def reconstruct_task_data(task_name: str = "", module_name: str = "", module_options: dict = None, task_options: dict = None):
+    # reconstruct yaml data from the task data to calculate similarity (edit distance) later
+    reconstructed_data = [{}]
+    if task_name:
+        reconstructed_data[0]["name"] = task_name
+    reconstructed_data[0][module_name] = module_options
+    if isinstance(task_options, dict):
+        for key, val in task_options.items():
+            if key not in reconstructed_data[0]:
+                reconstructed_data[0][key] = val
+    return reconstructed_data
+
+
+def reconstruct_play_data(play_name: str = "", play_options: dict = None):
+    reconstructed_data = [{}]
+    if play_name:
+        reconstructed_data[0]["name"] = play_name
+    if isinstance(play_options, dict):
+        for key, val in play_options.items():
+            if key not in reconstructed_data[0]:
+                reconstructed_data[0][key] = val
+    return reconstructed_data
+
+
+def rank_code_blocks(candidate_blocks: list, reconstructed_data: list, score_cutoff: int = None):
+    """
+    Sort candidate blocks, tuples of (yaml_lines, line_num_in_file), by the edit distance of their YAML
+    from the YAML of `reconstructed_data`. The order is kept if the data cannot be dumped into YAML.
+    Distances larger than `score_cutoff` are not computed exactly; such blocks keep their order after the others.
+    """
+    reconstructed_yaml = ""
+    try:
+        reconstructed_yaml = yaml.safe_dump(reconstructed_data)
+    except Exception:
+        pass
+    # give up here if yaml reconstruction failed
+    if not reconstructed_yaml:
+        return candidate_blocks
+
+    r = _remove_comment_lines(reconstructed_yaml)
+    # each block is preprocessed once and all of them are scored in a single call; ties keep the order of the blocks
+    choices = [_remove_comment_lines(block[0]) for block in candidate_blocks]
+    ranked = fuzz_process.extract(r, choices, scorer=Levenshtein.distance, limit=None, score_cutoff=score_cutoff)
+    ranked_indices = [index for _, _, index in ranked]
+    ranked_index_set = set(ranked_indices)
+    ranked_indices.extend([i for i in range(len(candidate_blocks)) if i not in ranked_index_set])
+    return [candidate_blocks[i] for i in ranked_indices]
+
+
+def _remove_comment_lines(s: str):
+    lines = s.splitlines()
+    updated = []
+    for line in lines:
+        if line.strip().startswith("#"):
+            continue
+        updated.append(line)
+    return "\n".join(updated)
+
+
 def _find_task_block(yaml_lines: list, start_line_num: int):
     if not yaml_lines:
         return None, None
@@ -529,6 +768,9 @@ def _find_task_block(yaml_lines: list, start_line_num: int):
     end_line_num = -1
     for i in range(len(lines)):
         if index >= len(lines):
+            # the last block ends at the last line of the file
+            end_found = True
+            end_line_num = len(lines) - 1
             break
         _line = lines[index]
         is_top_of_block = _line.replace(" ", "").startswith("-")
@@ -539,13 +781,9 @@ def _find_task_block(yaml_lines: list, start_line_num: int):
                 end_line_num = index - 1
                 break
         index += 1
-        if index >= len(lines):
-            end_found = True
-            end_line_num = index
-            break
     if not end_found:
         return None, None
-    if begin_line_num < 0 or end_line_num > len(lines) or begin_line_num > end_line_num:
+    if begin_line_num < 0 or end_line_num >= len(lines) or begin_line_num > end_line_num:
         return None, None
 
     yaml_lines = "\n".join(lines[begin_line_num : end_line_num + 1])
@@ -562,6 +800,7 @@ def find_play_line_number(
     task_names: list = None,
     module_names: list = None,
     previous_play_line: int = -1,
+    score_cutoff: int = None,
 ):
     if not play_name and not play_options and not task_names and not module_names:
         return None, None
@@ -585,7 +824,7 @@ def find_play_line_number(
         if play_name:
             if play_name in line:
                 candidate_line_nums.append(i)
-        elif "hosts:":
+        elif "hosts:" in line:
             candidate_line_nums.append(i)
     if not candidate_line_nums:
         return None, None
@@ -600,55 +839,10 @@ def find_play_line_number(
     if not candidate_blocks:
         return None, None
 
-    reconstructed_yaml = ""
-    best_yaml_lines = ""
-    best_line_num_in_file = []
-    sorted_candidates = []
-    if len(candidate_blocks) == 1:
-        best_yaml_lines = candidate_blocks[0][0]
-        best_line_num_in_file = candidate_blocks[0][1]
-    else:
-        # reconstruct yaml from the play data to calculate similarity (edit distance) later
-        reconstructed_data = [{}]
-        if play_name:
-            reconstructed_data[0]["name"] = play_name
-        if isinstance(play_options, dict):
-            for key, val in play_options.items():
-                if key not in reconstructed_data[0]:
-                    reconstructed_data[0][key] = val
-
-        try:
-            reconstructed_yaml = yaml.safe_dump(reconstructed_data)
-        except Exception:
-            pass
-
-        # find best match by edit distance
-        if reconstructed_yaml:
-
-            def remove_comment_lines(s):
-                lines = s.splitlines()
-                updated = []
-                for line in lines:
-                    if line.strip().startswith("#"):
-                        continue
-                    updated.append(line)
-                return "\n".join(updated)
-
-            def calc_dist(s1, s2):
-                us1 = remove_comment_lines(s1)
-                us2 = remove_comment_lines(s2)
-                dist = Levenshtein.distance(us1, us2)
-                return dist
-
-            r = reconstructed_yaml
-            sorted_candidates = sorted(candidate_blocks, key=lambda x: calc_dist(r, x[0]))
-            best_yaml_lines = sorted_candidates[0][0]
-            best_line_num_in_file = sorted_candidates[0][1]
-        else:
-            # give up here if yaml reconstruction failed
-            # use the first candidate
-            best_yaml_lines = candidate_blocks[0][0]
-            best_line_num_in_file = candidate_blocks[0][1]
+    best_yaml_lines, best_line_num_in_file = candidate_blocks[0]
+    if len(candidate_blocks) > 1:
+        reconstructed_data = reconstruct_play_data(play_name=play_name, play_options=play_options)
+        best_yaml_lines, best_line_num_in_file = rank_code_blocks(candidate_blocks, reconstructed_data, score_cutoff=score_cutoff)[0]
 
     yaml_lines = best_yaml_lines
     line_num_in_file = best_line_num_in_file
@@ -700,6 +894,9 @@ def _find_play_block(yaml_lines: list, start_line_num: int):
     end_line_num = -1
     for i in range(len(lines)):
         if index >= len(lines):
+            # the last block ends at the last line of the file
+            end_found = True
+            end_line_num = len(lines) - 1
             break
         _line = lines[index]
         is_top_of_block = _line.replace(" ", "").startswith("-")
@@ -710,13 +907,9 @@ def _find_play_block(yaml_lines: list, start_line_num: int):
                 end_line_num = index - 1
                 break
         index += 1
-        if index >= len(lines):
-            end_found = True
-            end_line_num = index
-            break
     if not end_found:
         return None, None
-    if begin_line_num < 0 or end_line_num > len(lines) or begin_line_num > end_line_num:
+    if begin_line_num < 0 or end_line_num >= len(lines) or begin_line_num > end_line_num:
         return None, None
 
     yaml_lines = "\n".join(lines[begin_line_num : end_line_num + 1])
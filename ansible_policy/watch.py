@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+import traceback
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from ansible_policy.models import PolicyEvaluator, EvaluationResult
+from ansible_policy.incremental import IncrementalState
+from ansible_policy.utils import init_logger
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+# events which do not modify any file
+ignored_event_types = ["opened", "closed", "closed_no_write"]
+ignored_dir_names = [".git"]
+
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "PolicyWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ignored_event_types:
+            return
+        paths = [event.src_path]
+        dest_path = getattr(event, "dest_path", "")
+        if dest_path:
+            paths.append(dest_path)
+        self.watcher.notify(paths=[os.fsdecode(p) for p in paths])
+
+
+@dataclass
+class PolicyWatcher(object):
+    """
+    PolicyWatcher keeps a PolicyEvaluator running and evaluates the project again whenever a file in the project
+    or in the policy sources is changed. Events are debounced, so a burst of writes such as `git checkout`
+    triggers a single evaluation. A change of the policy sources reloads the policies before the evaluation.
+    The state of the previous evaluation is kept in memory, so only the playbooks, taskfiles and roles which depend
+    on the changed files are scanned and evaluated again, and the results of the others are reused; see
+    `PolicyEvaluator.load_changed_targets()`. An evaluator with `incremental_dir` keeps the state in the directory instead.
+    """
+
+    evaluator: PolicyEvaluator = None
+    project_dir: str = ""
+    external_data_path: str = ""
+    variables_path: str = ""
+    # seconds without any change before an evaluation starts
+    debounce: float = 0.3
+    # called with the EvaluationResult of each evaluation
+    callback: Callable = None
+
+    _changed_paths: set = field(default_factory=set, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _stopped: threading.Event = field(default_factory=threading.Event, repr=False)
+    _last_change: float = 0.0
+    _observer: any = None
+    # the state of the previous evaluation; None until the first evaluation succeeds
+    _state: IncrementalState = field(default=None, repr=False)
+
+    @property
+    def policy_dirs(self) -> List[str]:
+        return [os.path.abspath(source.source) for source in self.evaluator.sources if source.type == "path"]
+
+    @property
+    def ignored_dirs(self) -> List[str]:
+        dirs = [self.evaluator.incremental_dir, self.evaluator.cache_dir]
+        return [os.path.abspath(d) for d in dirs if d]
+
+    def notify(self, paths: List[str]):
+        changed = []
+        for path in paths:
+            abs_path = os.path.abspath(path)
+            if any([part in ignored_dir_names for part in abs_path.split(os.sep)]):
+                continue
+            if any([is_under(abs_path, d) for d in self.ignored_dirs]):
+                continue
+            changed.append(abs_path)
+        if not changed:
+            return
+        with self._lock:
+            self._changed_paths.update(changed)
+            self._last_change = time.monotonic()
+        self._event.set()
+        return
+
+    def start(self):
+        self._observer = Observer()
+        handler = ChangeHandler(watcher=self)
+        watched = []
+        for path in [self.project_dir] + self.policy_dirs:
+            # a single playbook is watched through its directory
+            watch_dir = os.path.abspath(path) if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+            if watch_dir in watched:
+                continue
+            self._observer.schedule(handler, watch_dir, recursive=True)
+            watched.append(watch_dir)
+        self._observer.start()
+        logger.debug(f"watching {watched}")
+        return
+
+    def stop(self):
+        self._stopped.set()
+        self._event.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        return
+
+    def wait_for_changes(self):
+        """
+        Block until some files are changed and no more change comes within `debounce` seconds,
+        then return the changed paths. An empty list is returned when the watcher is stopped.
+        """
+        self._event.wait()
+        while not self._stopped.is_set():
+            with self._lock:
+                remaining = self._last_change + self.debounce - time.monotonic()
+                if remaining <= 0:
+                    changed_paths = sorted(self._changed_paths)
+                    self._changed_paths = set()
+                    self._event.clear()
+                    return changed_paths
+            time.sleep(remaining)
+        return []
+
+    def evaluate(self, changed_paths: List[str] = None) -> EvaluationResult:
+        changed_paths = changed_paths or []
+        policy_changed = [p for p in changed_paths if any([is_under(p, d) for d in self.policy_dirs])]
+        if policy_changed:
+            logger.debug(f"policies are changed: {policy_changed}")
+            self.evaluator.reload_policies()
+        if self.evaluator.incremental_dir:
+            return self.evaluator.run(
+                eval_type="project",
+                project_dir=self.project_dir,
+                external_data_path=self.external_data_path,
+                variables_path=self.variables_path,
+            )
+
+        state = IncrementalState()
+        if self._state is not None and not policy_changed:
+            state.previous = self._state
+            state.changed_files = self.get_changed_files(changed_paths=changed_paths)
+        result = self.evaluator.run_project(
+            state=state,
+            project_dir=self.project_dir,
+            external_data_path=self.external_data_path,
+            variables_path=self.variables_path,
+        )
+        self._state = state
+        return result
+
+    def get_changed_files(self, changed_paths: List[str]):
+        """
+        Returns the changed files relative to the project directory. A directory is skipped since the changes in it
+        come as the events of its files, and a path outside the project (e.g. the external data) is kept as is,
+        so that it is not a part of any unit and the whole project is scanned again.
+        """
+        root_dir = os.path.abspath(self.project_dir)
+        if os.path.isfile(root_dir):
+            root_dir = os.path.dirname(root_dir)
+        changed_files = []
+        for path in changed_paths:
+            if os.path.isdir(path):
+                continue
+            changed_files.append(os.path.relpath(path, root_dir) if is_under(path, root_dir) else path)
+        return changed_files
+
+    def run_forever(self):
+        self.start()
+        try:
+            changed_paths = []
+            while not self._stopped.is_set():
+                try:
+                    result = self.evaluate(changed_paths=changed_paths)
+                    if self.callback:
+                        self.callback(result)
+                except Exception:
+                    # keep watching; the next change may fix the error
+                    logger.error(f"Failed to evaluate the project; details: {traceback.format_exc()}")
+                changed_paths = self.wait_for_changes()
+        finally:
+            self.stop()
+        return
+
+
+def is_under(path: str, dir_path: str):
+    return path == dir_path or path.startswith(dir_path.rstrip(os.sep) + os.sep)
@@ -0,0 +1,206 @@
+import os
+from dataclasses import dataclass, field
+from typing import List
+
+from ruamel.yaml import YAML
+from ruamel.yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+from ansible_policy.utils import init_logger, rank_code_blocks, reconstruct_task_data, reconstruct_play_data
+
+
+logger = init_logger(__name__, os.getenv("ANSIBLE_GK_LOG_LEVEL", "info"))
+
+play_keys = ["hosts", "import_playbook", "ansible.builtin.import_playbook", "ansible.legacy.import_playbook"]
+play_task_list_keys = ["pre_tasks", "tasks", "post_tasks", "handlers"]
+block_task_list_keys = ["block", "rescue", "always"]
+
+_missing = object()
+
+
+@dataclass
+class YamlBlock(object):
+    """
+    YamlBlock is a task or a play in a YAML file. `begin` is the line of its `-` and `end` is the line
+    before the next item, the same range as the line search of utils.py gives.
+    """
+
+    begin: int = 0
+    end: int = 0
+    name: str = ""
+    node: MappingNode = field(default=None, repr=False)
+    index: "YamlPositionIndex" = field(default=None, repr=False)
+
+    @property
+    def keys(self) -> List[str]:
+        return get_mapping_keys(self.node)
+
+    @property
+    def yaml_lines(self) -> str:
+        return "\n".join(self.index.lines[self.begin - 1 : self.end])
+
+    def get_value(self, key: str, default: any = None):
+        """
+        Return the value of the key in this block; values are constructed only when they are compared.
+        `default` is returned if the key is not found or its value cannot be constructed such as a `!vault` value.
+        """
+        for key_node, value_node in self.node.value:
+            if isinstance(key_node, ScalarNode) and key_node.value == key:
+                try:
+                    return self.index.yaml.constructor.construct_object(value_node, deep=True)
+                except Exception:
+                    return default
+        return default
+
+
+@dataclass
+class YamlPositionIndex(object):
+    """
+    YamlPositionIndex maps the tasks and plays in a YAML file to their line ranges. It is built from a single
+    position-aware parse of the file, so finding a block is a dict lookup instead of a search of all the lines.
+    A file which cannot be parsed gives an empty index; its blocks are searched by the line search of utils.py.
+    """
+
+    lines: List[str] = field(default_factory=list, repr=False)
+    plays: List[YamlBlock] = field(default_factory=list)
+    tasks: List[YamlBlock] = field(default_factory=list)
+
+    yaml: YAML = field(default=None, repr=False)
+    _plays_by_name: dict = field(default_factory=dict, repr=False)
+    _tasks_by_name: dict = field(default_factory=dict, repr=False)
+    _tasks_by_key: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def build(cls, body: str, lines: List[str] = None):
+        if lines is None:
+            lines = body.splitlines()
+        index = cls(lines=lines, yaml=YAML(typ="safe", pure=True))
+        try:
+            documents = list(index.yaml.compose_all(body))
+        except Exception as exc:
+            logger.debug(f"failed to parse the YAML to find code blocks; {exc}")
+            return index
+
+        for document in documents:
+            if not isinstance(document, SequenceNode):
+                continue
+            items = [item for item in document.value if isinstance(item, MappingNode)]
+            is_playbook = any(any(key in play_keys for key in get_mapping_keys(item)) for item in items)
+            for item in items:
+                if is_playbook:
+                    index._add_play(item)
+                else:
+                    index._add_task(item)
+        return index
+
+    def find_task(
+        self, task_name: str = "", module_name: str = "", module_options: dict = None, task_options: dict = None, score_cutoff: int = None
+    ) -> YamlBlock:
+        if task_name:
+            candidates = self._tasks_by_name.get(str(task_name), [])
+        elif module_name:
+            candidates = self._tasks_by_key.get(module_name, [])
+        else:
+            return None
+
+        if len(candidates) > 1 and module_name:
+            candidates = narrow_blocks(candidates, [(module_name, module_options)])
+        if len(candidates) > 1:
+            reconstructed_data = reconstruct_task_data(
+                task_name=task_name,
+                module_name=module_name,
+                module_options=module_options,
+                task_options=task_options,
+            )
+            candidates = rank_blocks(candidates, reconstructed_data, score_cutoff=score_cutoff)
+        return candidates[0] if candidates else None
+
+    def find_play(self, play_name: str = "", play_options: dict = None, play_index: int = -1, score_cutoff: int = None) -> YamlBlock:
+        if play_name:
+            candidates = self._plays_by_name.get(str(play_name), [])
+        else:
+            candidates = self.plays
+
+        if len(candidates) > 1 and isinstance(play_options, dict):
+            candidates = narrow_blocks(candidates, play_options.items())
+        if len(candidates) > 1 and 0 <= play_index < len(self.plays) and self.plays[play_index] in candidates:
+            candidates = [self.plays[play_index]]
+        if len(candidates) > 1:
+            reconstructed_data = reconstruct_play_data(play_name=play_name, play_options=play_options)
+            candidates = rank_blocks(candidates, reconstructed_data, score_cutoff=score_cutoff)
+        return candidates[0] if candidates else None
+
+    def _make_block(self, node: MappingNode):
+        return YamlBlock(begin=self._find_begin(node), end=self._find_end(node), node=node, index=self)
+
+    def _add_play(self, node: MappingNode):
+        play = self._make_block(node)
+        play.name = play.get_value("name", "") if "name" in play.keys else ""
+        self.plays.append(play)
+        if play.name:
+            self._plays_by_name.setdefault(str(play.name), []).append(play)
+        for key_node, value_node in node.value:
+            if isinstance(key_node, ScalarNode) and key_node.value in play_task_list_keys and isinstance(value_node, SequenceNode):
+                for item in value_node.value:
+                    if isinstance(item, MappingNode):
+                        self._add_task(item)
+        return
+
+    def _add_task(self, node: MappingNode):
+        task = self._make_block(node)
+        task.name = task.get_value("name", "") if "name" in task.keys else ""
+        self.tasks.append(task)
+        if task.name:
+            self._tasks_by_name.setdefault(str(task.name), []).append(task)
+        for key_node, value_node in node.value:
+            if not isinstance(key_node, ScalarNode):
+                continue
+            self._tasks_by_key.setdefault(key_node.value, []).append(task)
+            if key_node.value in block_task_list_keys and isinstance(value_node, SequenceNode):
+                for item in value_node.value:
+                    if isinstance(item, MappingNode):
+                        self._add_task(item)
+        return
+
+    def _find_begin(self, node: MappingNode):
+        # the mapping starts after `- ` on the same line, or the `-` is alone on a previous line
+        line_num = node.start_mark.line
+        if not self.lines[line_num][: node.start_mark.column].strip():
+            for prev_line_num in range(line_num - 1, -1, -1):
+                stripped = self.lines[prev_line_num].strip()
+                if stripped == "-":
+                    line_num = prev_line_num
+                    break
+                if stripped and not stripped.startswith("#"):
+                    break
+        return line_num + 1
+
+    def _find_end(self, node: MappingNode):
+        # a block mapping ends where the next token starts; the lines before it, including comments, belong to the block
+        line_num = node.end_mark.line
+        if line_num < len(self.lines) and self.lines[line_num][: node.end_mark.column].strip(" -"):
+            # a flow mapping ends in the middle of the line
+            line_num += 1
+        return max(min(line_num, len(self.lines)), node.start_mark.line + 1)
+
+
+def get_mapping_keys(node: MappingNode) -> List[str]:
+    return [key.value for key, _ in node.value if isinstance(key, ScalarNode)]
+
+
+def narrow_blocks(blocks: List[YamlBlock], items: list):
+    """
+    Keep the blocks whose values are equal to the given (key, value) pairs.
+    A pair which no block matches is ignored, so the result is empty only when `blocks` is empty.
+    """
+    for key, value in items:
+        matched = [block for block in blocks if key in block.keys and block.get_value(key, default=_missing) == value]
+        if matched:
+            blocks = matched
+        if len(blocks) == 1:
+            break
+    return blocks
+
+
+def rank_blocks(blocks: List[YamlBlock], reconstructed_data: list, score_cutoff: int = None):
+    candidate_blocks = [(block.yaml_lines, block) for block in blocks]
+    return [block for _, block in rank_code_blocks(candidate_blocks, reconstructed_data, score_cutoff=score_cutoff)]
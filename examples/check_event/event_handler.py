@@ -4,6 +4,7 @@ import json
 import argparse
 from ansible_policy.models import (
     PolicyEvaluator,
+    EvalModeMulti,
     ResultFormatter,
     FORMAT_EVENT_STREAM,
 )
@@ -19,7 +20,7 @@ def main():
     parser.add_argument("--policy-dir", help="path to a directory containing policies to be evaluated")
     args = parser.parse_args()
 
-    evaluator = PolicyEvaluator(policy_dir=args.policy_dir)
+    evaluator = PolicyEvaluator(policy_dir=args.policy_dir, eval_mode=EvalModeMulti)
     formatter = ResultFormatter(format_type=FORMAT_EVENT_STREAM, base_dir=os.getcwd())
     for event in load_event():
         result = evaluator.run(
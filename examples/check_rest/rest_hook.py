@@ -6,6 +6,7 @@ from flask import Flask, request
 from ansible_policy.models import (
     PolicyEvaluator,
     EvalTypeRest,
+    EvalModeMulti,
     ResultFormatter,
     FORMAT_REST,
 )
@@ -23,7 +24,7 @@ parser = argparse.ArgumentParser(description="TODO")
 parser.add_argument("--policy-dir", help="path to a directory containing policies to be evaluated")
 args = parser.parse_args()
 
-evaluator = PolicyEvaluator(policy_dir=args.policy_dir)
+evaluator = PolicyEvaluator(policy_dir=args.policy_dir, eval_mode=EvalModeMulti)
 formatter = ResultFormatter(format_type=FORMAT_REST, base_dir=os.getcwd())
 
 
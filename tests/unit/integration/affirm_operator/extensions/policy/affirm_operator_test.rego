@@ -10,6 +10,7 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 
 affirm_operator_test_1_1 = true if {
     input.test_val
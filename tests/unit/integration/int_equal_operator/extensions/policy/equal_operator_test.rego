@@ -10,6 +10,7 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 
 equal_operator_test_0_2 = true if {
     input.test_val == 1
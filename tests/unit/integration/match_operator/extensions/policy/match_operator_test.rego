@@ -10,6 +10,7 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 
 match_operator_test_0_2 = true if {
     startswith(lower(input.test_val), lower("val"))
@@ -10,9 +10,10 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 
 match_operator_test_0_2 = true if {
-    not startswith(input.test_val, "val")
+    not startswith(lower(input.test_val), lower("val"))
 }
 
 
@@ -10,9 +10,10 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 
 search_operator_test_0_2 = true if {
-    regex.find_n("v.l", input.test_val, 1) == []
+    regex.find_n(lower("v.l"), lower(input.test_val), 1) == []
 }
 
 
@@ -10,9 +10,10 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 
 search_operator_test_0_2 = true if {
-    not contains(input.test_val, "val")
+    not contains(lower(input.test_val), lower("val"))
 }
 
 
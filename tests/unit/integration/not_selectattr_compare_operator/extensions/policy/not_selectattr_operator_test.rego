@@ -10,6 +10,7 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 sample_list = [{"age": 10}, {"age": 20}]
 
 to_list(val) = output if {
@@ -10,6 +10,7 @@ __target__ = "task"
 __tags__ = ["security"]
 
 
+__input_paths__ = [["test_val"]]
 sample_list = [{"name": "val1"}, {"name": "val2"}]
 
 to_list(val) = output if {
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import queue
+import asyncio
+import threading
+import pytest
+from collections import deque
+from ansible_policy.backend import (
+    SubprocessBackend,
+    ServerBackend,
+    make_project_data,
+    load_project_context,
+    make_batch_query,
+    make_batch_input,
+    make_multi_policy_query,
+    make_multi_policy_results,
+    make_eval_results,
+    split_messages,
+    item_marker,
+)
+from ansible_policy.utils import get_available_cpu_count
+
+
+def test_project_data(tmp_path):
+    key = "a" * 64
+    context_json = '{"playbooks":{"site.yml":{"key":"playbook site.yml"}},"variables":{}}'
+    path = tmp_path / f"{key}.json"
+    path.write_text(make_project_data(key=key, context_json=context_json))
+
+    data = json.loads(path.read_text())
+    assert data["agk"]["projects"][key]["playbooks"]["site.yml"]["key"] == "playbook site.yml"
+    assert load_project_context(key=key, path=str(path)) == context_json
+
+    with pytest.raises(ValueError):
+        load_project_context(key="b" * 64, path=str(path))
+
+
+def test_subprocess_backend_project_data(tmp_path):
+    rego_path = tmp_path / "a.rego"
+    rego_path.write_text("package a\n")
+    backend = SubprocessBackend()
+    _, data_paths = backend.make_multi_policy_args([str(rego_path)], external_data_path="/tmp/galaxy.json")
+    assert data_paths[1:] == [str(rego_path), "/tmp/galaxy.json"]
+
+    backend.set_project_data({"key1": "/tmp/key1.json"})
+    _, data_paths = backend.make_multi_policy_args([str(rego_path)], external_data_path="/tmp/galaxy.json")
+    assert data_paths[1:] == [str(rego_path), "/tmp/galaxy.json", "/tmp/key1.json"]
+
+
+class FailingBackend(SubprocessBackend):
+    # a query fails if any of its items or policies is "bad", like a conflict error of OPA
+    def eval_query(self, query: str, input_data: str, data_paths: list):
+        if "bad" in input_data or "bad" in query:
+            raise ValueError("eval_conflict_error")
+        return {"batch": json.loads(input_data)["items"]} if query.startswith("batch") else {"d0": {}, "d1": {}}, ""
+
+    def eval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        if "bad" in input_data or "bad" in rego_path:
+            raise ValueError("eval_conflict_error")
+        return {"value": json.loads(input_data), "message": ""}
+
+
+def test_query_error_fallback(tmp_path):
+    rego_paths = []
+    for name in ["good", "bad"]:
+        rego_path = tmp_path / f"{name}.rego"
+        rego_path.write_text(f"package {name}\n")
+        rego_paths.append(str(rego_path))
+    backend = FailingBackend()
+
+    # items are evaluated one by one only if the batch query fails
+    eval_results = backend.eval_policy_batch(rego_paths[0], ['{"a":1}', '{"a":2}'])
+    assert [r["value"] for r in eval_results] == [{"a": 1}, {"a": 2}]
+    with pytest.raises(ValueError, match="for the item 1 of the batch"):
+        backend.eval_policy_batch(rego_paths[0], ['{"a":1}', '{"a":"bad"}'])
+
+    with pytest.raises(ValueError, match="bad.rego"):
+        backend.eval_policies(rego_paths, '{"a":1}')
+
+
+def test_batch_query():
+    query = make_batch_query("check_task")
+    assert query == f'batch := [d | x := input.items[i]; print("{item_marker}", i); d := data.check_task with input as x]'
+    assert json.loads(make_batch_input(['{"a":1}', '{"a":2}'])) == {"items": [{"a": 1}, {"a": 2}]}
+
+    message = f"{item_marker} 0\n{item_marker} 1\nfound 1\nfound 2\n{item_marker} 2\n"
+    eval_results = make_eval_results(values=[{"deny": False}, {"deny": True}, {"deny": False}], message=message, size=3)
+    assert [r["message"] for r in eval_results] == ["", "found 1\nfound 2\n", ""]
+    with pytest.raises(ValueError):
+        make_eval_results(values=[{"deny": False}], message=message, size=3)
+
+
+def test_split_messages():
+    message = f"before\n{item_marker} 1\nb\n{item_marker} x\nignored\n{item_marker} 5\nout of range\n{item_marker} 0\na1\na2"
+    assert split_messages(message, size=2) == ["a1\na2", "b\n"]
+    assert split_messages("", size=2) == ["", ""]
+
+
+def test_multi_policy_query():
+    query = make_multi_policy_query(["pkg_a", "pkg_b"])
+    assert query == f'print("{item_marker}", 0); d0 := data.pkg_a; print("{item_marker}", 1); d1 := data.pkg_b'
+
+    bindings = {"d0": {"deny": True}, "d1": {"allow": True}}
+    message = f"{item_marker} 0\ndenied\n{item_marker} 1\n"
+    eval_results = make_multi_policy_results(rego_paths=["a.rego", "b.rego"], bindings=bindings, message=message)
+    assert eval_results == {"a.rego": {"value": {"deny": True}, "message": "denied\n"}, "b.rego": {"value": {"allow": True}, "message": ""}}
+
+
+def test_server_log_parsing():
+    logs = [
+        {"level": "info", "msg": "Received request.", "req_path": "/health"},
+        {"level": "info", "msg": "Sent response.", "req_path": "/health"},
+        {"level": "info", "msg": "Received request.", "req_path": "/v1/query"},
+        {"level": "info", "msg": "found 1", "line": "a.rego:3"},
+        {"level": "info", "msg": "found 2", "line": "a.rego:3"},
+        {"level": "info", "msg": "Sent response.", "req_path": "/v1/query"},
+        {"level": "error", "msg": "some error"},
+    ]
+    lines = [json.dumps(log) + "\n" for log in logs] + ["not a json\n"]
+    responses = queue.Queue()
+    raw_logs = deque()
+    ServerBackend._read_logs(iter(lines), responses, raw_logs)
+    assert [responses.get_nowait() for _ in range(responses.qsize())] == [("/health", []), ("/v1/query", ["found 1", "found 2"])]
+    assert len(raw_logs) == 2
+
+    backend = ServerBackend(message_timeout=0.05)
+    backend._responses = queue.Queue()
+    backend._responses.put(("/health", []))
+    backend._responses.put(("/v1/query", ["found 1"]))
+    assert backend._wait_messages("/v1/query") == "found 1\n"
+
+    # a timeout fails only the request, and its late record is not taken by the next request
+    with pytest.raises(ValueError):
+        backend._wait_messages("/v1/query")
+    backend._responses.put(("/v1/query", ["late"]))
+    backend._responses.put(("/v1/query", ["current"]))
+    assert backend._wait_messages("/v1/query") == "current\n"
+
+
+class RunningProcess(object):
+    def poll(self):
+        return None
+
+
+class RecordingPool(object):
+    # records the requests to the data API of a server
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method: str, path: str, body: str = None):
+        self.requests.append((method, path, body))
+        return 204, ""
+
+
+def test_server_external_data(tmp_path):
+    data_a = tmp_path / "a.json"
+    data_a.write_text(json.dumps({"galaxy": {"modules": ["a"]}, "extra": 1}))
+    data_b = tmp_path / "b.json"
+    data_b.write_text(json.dumps({"galaxy": {"modules": ["b"]}}))
+
+    backend = ServerBackend(policy_paths=["a.rego"])
+    backend._proc = RunningProcess()
+    backend._pool = RecordingPool()
+    backend.start = None
+    # switching the external data pushes it through the data API without restarting the server
+    backend.load(policy_paths=["a.rego"], external_data_path=str(data_a))
+    backend.load(policy_paths=["a.rego"], external_data_path=str(data_a))
+    backend.load(policy_paths=["a.rego"], external_data_path=str(data_b))
+    backend.load(policy_paths=["a.rego"], external_data_path="")
+    assert backend._pool.requests == [
+        ("PUT", "/v1/data/galaxy", '{"modules": ["a"]}'),
+        ("PUT", "/v1/data/extra", "1"),
+        ("DELETE", "/v1/data/extra", None),
+        ("PUT", "/v1/data/galaxy", '{"modules": ["b"]}'),
+        ("DELETE", "/v1/data/galaxy", None),
+    ]
+    assert backend.external_data_path == ""
+
+
+class SleepingBackend(SubprocessBackend):
+    # returns the index in the input after a sleep which is longer for earlier items, and counts evaluations in flight
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def exit(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def eval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        self.enter()
+        index = json.loads(input_data)["i"]
+        time.sleep(0.001 * (20 - index))
+        self.exit()
+        return {"value": {"i": index}, "message": ""}
+
+    async def aeval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        self.enter()
+        index = json.loads(input_data)["i"]
+        await asyncio.sleep(0.001 * (20 - index))
+        self.exit()
+        return {"value": {"i": index}, "message": ""}
+
+
+class SleepingServer(object):
+    # a server-like backend which answers one query at a time; the servers of an evaluator share `counter`
+    def __init__(self, counter: SleepingBackend):
+        self.counter = counter
+
+    def set_project_data(self, project_data: dict):
+        pass
+
+    def load(self, policy_paths: list, external_data_path: str = ""):
+        pass
+
+    def eval_policy(self, rego_path: str, input_data: str, external_data_path: str = ""):
+        return self.counter.eval_policy(rego_path, input_data)
+
+    def close(self):
+        pass
+
+
+def new_evaluator(monkeypatch, backend: any = None, **kwargs):
+    pytest.importorskip("ansible_content_capture")
+    from ansible_policy import models
+    from ansible_policy.catalog import PolicyCatalog
+
+    monkeypatch.setattr(models, "validate_opa_installation", lambda: None)
+    units = [models.EvaluationUnit(method="eval_policy", kwargs=dict(rego_path="a.rego", input_data=json.dumps({"i": i}))) for i in range(20)]
+    evaluator = models.PolicyEvaluator(catalog=PolicyCatalog(), backend=backend or SleepingBackend(), cache_size=0, **kwargs)
+    return evaluator, units
+
+
+def test_run_units_order(monkeypatch):
+    evaluator, units = new_evaluator(monkeypatch, jobs=4)
+    results = evaluator.run_units(units, policy_files=[])
+    assert [r["value"]["i"] for r in results] == list(range(20))
+    assert 1 < evaluator.backend.max_in_flight <= 4
+
+
+def test_arun_units_concurrency(monkeypatch):
+    evaluator, units = new_evaluator(monkeypatch)
+    assert evaluator.jobs == get_available_cpu_count()
+    # `opa eval` processes run independently, so the subprocess backend is not bounded by `jobs`
+    assert evaluator.concurrency == evaluator.get_max_in_flight() == 64
+
+    evaluator, units = new_evaluator(monkeypatch, concurrency=3)
+    results = asyncio.run(evaluator.arun_units(units, policy_files=[]))
+    assert [r["value"]["i"] for r in results] == list(range(20))
+    assert evaluator.backend.max_in_flight == 3
+
+
+def test_arun_units_server_bound(monkeypatch):
+    pytest.importorskip("ansible_content_capture")
+    from ansible_policy import models
+
+    counter = SleepingBackend()
+    monkeypatch.setattr(models, "new_backend", lambda **kwargs: SleepingServer(counter))
+    # each server answers one query at a time, so no more than `jobs` evaluations can be in flight
+    evaluator, units = new_evaluator(monkeypatch, backend=SleepingServer(counter), jobs=3, concurrency=64)
+    assert evaluator.get_max_in_flight() == 3
+    evaluator, units = new_evaluator(monkeypatch, backend=SleepingServer(counter), jobs=3)
+    assert evaluator.concurrency == evaluator.get_max_in_flight() == 3
+    results = asyncio.run(evaluator.arun_units(units, policy_files=[]))
+    assert [r["value"]["i"] for r in results] == list(range(20))
+    assert counter.max_in_flight == 3
+    assert len(evaluator.worker_backends) == 2
+
+
+def test_pruned_external_data_cleanup(monkeypatch, tmp_path):
+    evaluator, _ = new_evaluator(monkeypatch)
+    from ansible_policy.models import EvaluationTarget
+
+    data_path = tmp_path / "galaxy_data.json"
+    data_path.write_text(json.dumps({"galaxy": {"module_name_mappings": {}, "modules": [{"fqcn": "ansible.builtin.copy"}]}}))
+    targets = [EvaluationTarget(input_type="task", input_data={"module": "ansible.builtin.copy"})]
+    path_1 = evaluator.prepare_opa_data(targets=targets, policy_files=[], external_data_path=str(data_path))
+    path_2 = evaluator.prepare_opa_data(targets=targets, policy_files=[], external_data_path=str(data_path))
+    # parallel evaluations of the same modules share the file, and it is removed when both are done
+    assert path_1 == path_2 != str(data_path)
+    evaluator.release_opa_data(path=path_1)
+    assert os.path.exists(path_1)
+    evaluator.release_opa_data(path=path_2)
+    assert not os.path.exists(path_1)
+    # the whole external data is never removed
+    evaluator.release_opa_data(path=str(data_path))
+    assert data_path.exists()
+
+    path = evaluator.prepare_opa_data(targets=targets, policy_files=[], external_data_path=str(data_path))
+    evaluator.close()
+    assert not os.path.exists(path)
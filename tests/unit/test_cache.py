@@ -0,0 +1,115 @@
+import os
+import json
+from ansible_policy.cache import DecisionCache, DiskDecisionCache, FileCache, make_input_hash, get_external_data_hash
+from ansible_policy.utils import detect_agk_reference, detect_agk_context_reference
+
+
+def test_decision_cache_lru():
+    cache = DecisionCache(max_size=2)
+    cache.put(("p", "", "a"), {"value": 1})
+    cache.put(("p", "", "b"), {"value": 2})
+    assert cache.get(("p", "", "a")) == {"value": 1}
+    # `b` is the least recently used one, so it is dropped first
+    cache.put(("p", "", "c"), {"value": 3})
+    assert cache.get(("p", "", "b")) is None
+    assert cache.get(("p", "", "c")) == {"value": 3}
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    disabled = DecisionCache(max_size=0)
+    disabled.put(("p", "", "a"), {"value": 1})
+    assert disabled.get(("p", "", "a")) is None
+    assert len(disabled) == 0
+
+
+def test_decision_cache_keys(tmp_path):
+    assert make_input_hash('{"a":1}') == make_input_hash('{"a":1}')
+    assert make_input_hash('{"a":1}') != make_input_hash('{"a":2}')
+
+    data_path = str(tmp_path / "data.json")
+    with open(data_path, "w") as file:
+        file.write("{}")
+    data_hash = get_external_data_hash(data_path)
+    assert data_hash == get_external_data_hash(data_path)
+    with open(data_path, "w") as file:
+        file.write('{"galaxy": {}}')
+    assert data_hash != get_external_data_hash(data_path)
+    assert get_external_data_hash("") == ""
+
+
+def test_disk_decision_cache(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    key = ("policy", "data", "input")
+    result = {"value": {"deny": True, "__target__": "task"}, "message": "denied\n"}
+    cache = DecisionCache(max_size=0, disk=DiskDecisionCache(cache_dir=cache_dir))
+    cache.put(key, result)
+    cache.close()
+
+    # another process reads the result persisted by the previous one
+    cache = DecisionCache(max_size=16, disk=DiskDecisionCache(cache_dir=cache_dir))
+    assert cache.get(key) == result
+    assert cache.get(key) == result
+    assert (cache.hits, cache.disk_hits, cache.misses) == (2, 1, 0)
+    assert cache.get(("policy", "data", "other")) is None
+    cache.close()
+
+    # results persisted by another version of ansible-policy or `rego/utils.rego` are not used
+    cache = DecisionCache(max_size=0, disk=DiskDecisionCache(cache_dir=cache_dir, namespace="other"))
+    assert cache.get(key) is None
+    cache.close()
+
+
+def test_disk_decision_cache_eviction(tmp_path):
+    value = {"value": {"deny": False}, "message": "x" * 1000}
+    size = len(json.dumps(value)) + 64
+    disk = DiskDecisionCache(cache_dir=str(tmp_path), max_bytes=size * 10)
+    for i in range(30):
+        disk.put(f"key{i:02d}", value)
+        disk.flush()
+    # older results are deleted first
+    assert disk.get("key00") is None
+    assert disk.get("key29") == value
+    assert os.path.getsize(os.path.join(str(tmp_path), "decisions.sqlite3")) > 0
+    disk.close()
+
+
+def test_file_cache(tmp_path):
+    paths = []
+    for name in ["a.yml", "b.yml"]:
+        path = os.path.join(str(tmp_path), name)
+        with open(path, "w") as file:
+            file.write("- name: x\n  shell: echo\n")
+        paths.append(path)
+
+    cache = FileCache(max_bytes=30)
+    body = cache.read(paths[0])
+    assert cache.read_lines(paths[0]) == ["- name: x", "  shell: echo"]
+    # the same string is served, so its hash is computed only once when it is used as a dict key
+    assert cache.read(paths[0]) is body
+    assert cache.stats() == {"reads": 1, "hits": 2, "bytes_read": 24, "bytes_served": 48}
+
+    # `a.yml` is dropped to keep the total size under `max_bytes`
+    cache.read(paths[1])
+    assert len(cache) == 1
+    cache.read(paths[0])
+    assert cache.reads == 3
+
+
+def test_detect_agk_reference():
+    assert not detect_agk_reference('import data.ansible_policy.resolve_var\nallow if {\n    input["ansible.builtin.shell"].cmd\n    input.become\n}')
+    assert not detect_agk_reference("allow if {\n    input\n    input.test_val\n}")
+    assert detect_agk_reference("allow if {\n    input._agk.task.module_fqcn\n}")
+    assert detect_agk_reference('allow if {\n    input["_agk"].playbooks\n}')
+    assert detect_agk_reference("allow if {\n    input[key]\n}")
+    assert detect_agk_reference("import data.ansible_policy.resolve_var\nallow if {\n    resolve_var(input.src, input)\n}")
+    assert detect_agk_reference("allow if {\n    data.agk.projects[_].playbooks\n}")
+
+
+def test_detect_agk_context_reference():
+    # the target fields of `_agk` and the util functions do not need the project context in the input
+    assert not detect_agk_context_reference("allow if {\n    input._agk.task.module_fqcn\n}")
+    assert not detect_agk_context_reference("import data.ansible_policy.resolve_var\nallow if {\n    resolve_var(input.src, input)\n}")
+    assert not detect_agk_context_reference("allow if {\n    data.ansible_policy.agk_project(input).playbooks\n}")
+    assert detect_agk_context_reference('allow if {\n    input["_agk"].playbooks\n}')
+    assert detect_agk_context_reference("allow if {\n    x := input._agk\n}")
+    assert detect_agk_context_reference("allow if {\n    f(input)\n}")
@@ -0,0 +1,75 @@
+import os
+import glob
+from ansible_policy.catalog import PolicyCatalog, PolicyMetadata, PolicyDispatchIndex
+from ansible_policy.utils import (
+    match_str_expression,
+    get_rego_main_package_name,
+    detect_target_type_pattern,
+    detect_target_module_pattern,
+    get_tags_from_rego_policy_file,
+)
+
+integration_dir = os.path.join(os.path.dirname(__file__), "integration")
+rego_files = sorted(glob.glob(os.path.join(integration_dir, "**", "*.rego"), recursive=True))
+
+rego_module_policy = """
+package check_module
+
+__target__ = "task"
+__target_module__ = "ansible.builtin.*"
+__tags__ = ["security", "compliance"]
+
+deny = true if {
+    input.task.module_fqcn == "ansible.builtin.shell"
+}
+"""
+
+
+def test_catalog_matches_file_scans():
+    assert rego_files
+    catalog = PolicyCatalog.load(policy_paths=rego_files)
+    for rego_path in rego_files:
+        policy = catalog.get(rego_path)
+        assert policy.package == get_rego_main_package_name(rego_path=rego_path)
+        assert policy.target == detect_target_type_pattern(policy_path=rego_path)
+        assert policy.target_module == detect_target_module_pattern(policy_path=rego_path)
+        assert policy.tags == get_tags_from_rego_policy_file(policy_path=rego_path)
+        assert len(policy.hash) == 64
+
+
+def test_catalog_target_matching(tmp_path):
+    rego_path = str(tmp_path / "check_module.rego")
+    with open(rego_path, "w") as file:
+        file.write(rego_module_policy)
+
+    # a policy not in the catalog is loaded on its first lookup
+    catalog = PolicyCatalog()
+    policy = catalog.get(rego_path)
+    assert catalog.list() == [policy]
+    assert policy.package == "check_module"
+    assert policy.tags == ["security", "compliance"]
+    assert policy.match_target_type("task")
+    assert not policy.match_target_type("play")
+    assert policy.match_target_module("ansible.builtin.shell")
+    assert not policy.match_target_module("community.general.ufw")
+
+
+def test_dispatch_index_matches_str_expression():
+    policies = [
+        PolicyMetadata(path="p0", target="task", target_module="ansible.builtin.shell"),
+        PolicyMetadata(path="p1", target="task", target_module="ansible.builtin.*"),
+        PolicyMetadata(path="p2", target="task", target_module=None),
+        PolicyMetadata(path="p3", target="play", target_module="*"),
+        PolicyMetadata(path="p4", target="*", target_module="community.*"),
+    ]
+    index = PolicyDispatchIndex.build(policies=policies)
+    for target_type in ["task", "play", "event"]:
+        for module_fqcn in ["ansible.builtin.shell", "ansible.builtin.command", "community.general.ufw", ""]:
+            type_matched, need_eval = index.lookup(target_type=target_type, module_fqcn=module_fqcn)
+            expected_type_matched = [p.path for p in policies if match_str_expression(p.target, target_type)]
+            expected_need_eval = [p.path for p in policies if p.path in expected_type_matched and match_str_expression(p.target_module, module_fqcn)]
+            assert type_matched == expected_type_matched
+            assert need_eval == expected_need_eval
+
+    # module patterns are not checked if module_fqcn is not given
+    assert index.lookup(target_type="task") == (["p0", "p1", "p2", "p4"], ["p0", "p1", "p2", "p4"])
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("ansible_content_capture")
+
+from ansible_policy import eval_policy as eval_policy_module  # noqa: E402
+
+
+class Evaluator(object):
+    # fails in `run()` and records whether it is closed
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.closed = False
+        Evaluator.instances.append(self)
+
+    def run(self, **kwargs):
+        raise ValueError("evaluation failed")
+
+    def close(self):
+        self.closed = True
+
+
+def test_eval_policy_close_on_error(monkeypatch):
+    monkeypatch.setattr(eval_policy_module, "PolicyEvaluator", Evaluator)
+    with pytest.raises(ValueError, match="evaluation failed"):
+        eval_policy_module.eval_policy(eval_type="project", project_dir="project", external_data_path="data.json")
+    # the OPA servers and the workers of the evaluator are stopped
+    assert Evaluator.instances[-1].closed
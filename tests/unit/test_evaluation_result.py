@@ -0,0 +1,93 @@
+import copy
+import json
+import jsonpickle
+import pytest
+from dataclasses import asdict
+
+pytest.importorskip("ansible_content_capture")
+
+from ansible_policy.models import EvaluationResult, EvaluationSummary, encode_result  # noqa: E402
+from ansible_policy.rego_data import Task  # noqa: E402
+
+
+def add_results(result: EvaluationResult, filepath: str, violated_policy: str = ""):
+    task = Task(name="x")
+    for policy_name in ["p1", "p2"]:
+        violated = policy_name == violated_policy
+        result.add_single_result(
+            eval_result={"value": {"deny": violated}, "message": "denied" if violated else ""},
+            is_target_type=True,
+            policy_name=policy_name,
+            target_type="task",
+            obj=task,
+            filepath=filepath,
+            lines={"begin": 1, "end": 2},
+        )
+
+
+def test_evaluation_result():
+    result = EvaluationResult()
+    add_results(result, "a.yml")
+    add_results(result, "b.yml", violated_policy="p2")
+    add_results(result, "a.yml")
+    # the summary is current without `finalize()`
+    current_summary = copy.deepcopy(result.summary)
+    result.finalize()
+    assert current_summary == result.summary
+
+    assert [f.path for f in result.files] == ["a.yml", "b.yml"]
+    assert [len(p.targets) for p in result.files[0].policies] == [2, 2]
+    assert [f.violation for f in result.files] == [False, True]
+    assert result.summary == EvaluationSummary.from_files(result.files)
+    assert result.summary.files == {"total": 2, "validated": 1, "not_validated": 1, "list": ["a.yml", "b.yml"]}
+    assert result.summary.policies == {"total": 2, "violation_detected": 1, "list": ["p1", "p2"]}
+
+    # the indexes are not a part of the result
+    data = result.to_dict()
+    assert list(data) == ["summary", "files"]
+    assert "_file_index" not in encode_result(result)
+    assert list(asdict(result)) == ["summary", "files"]
+    assert list(json.loads(jsonpickle.encode(result, unpicklable=False))) == ["summary", "files"]
+    assert jsonpickle.decode(jsonpickle.encode(result)).get_file_result("b.yml").violation
+
+    # results can be added to a result loaded from a dict
+    loaded = EvaluationResult.from_dict(data)
+    assert loaded == result
+    add_results(loaded, "b.yml")
+    assert len(loaded.files) == 2
+    assert len(loaded.get_file_result("b.yml").policies[0].targets) == 2
+
+
+def test_evaluation_summary_order():
+    result = EvaluationResult()
+    add_results(result, "a.yml")
+    add_results(result, "b.yml", violated_policy="p1")
+    for policy_name, filepath in [("p3", "b.yml"), ("p4", "a.yml")]:
+        result.add_single_result(
+            eval_result={"value": {"deny": False}},
+            is_target_type=True,
+            policy_name=policy_name,
+            target_type="task",
+            obj=Task(),
+            filepath=filepath,
+            lines={},
+        )
+    # the counts are current, and the lists are in the order the results are added until `finalize()` orders them by the files
+    assert result.summary.policies == {"total": 4, "violation_detected": 1, "list": ["p1", "p2", "p3", "p4"]}
+    assert result.summary.files == {"total": 2, "validated": 1, "not_validated": 1, "list": ["a.yml", "b.yml"]}
+    assert result.finalize().summary.policies["list"] == ["p1", "p2", "p4", "p3"]
+
+
+def test_evaluation_result_duplicate_paths(monkeypatch):
+    data = {"summary": None, "files": [{"path": "a.yml", "policies": []}, {"path": "a.yml", "policies": []}]}
+    result = EvaluationResult.from_dict(data)
+    builds = []
+    build_index = result.build_index
+    monkeypatch.setattr(result, "build_index", lambda: builds.append(1) or build_index())
+    for filepath in ["a.yml", "b.yml", "a.yml", "c.yml"]:
+        add_results(result, filepath)
+    # the index is built once even though a path appears twice in the loaded files
+    assert len(builds) == 1
+    assert [f.path for f in result.files] == ["a.yml", "a.yml", "b.yml", "c.yml"]
+    assert len(result.get_file_result("a.yml").policies[0].targets) == 2
+    assert len(builds) == 1
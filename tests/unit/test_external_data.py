@@ -0,0 +1,178 @@
+import os
+import copy
+import json
+import shutil
+import tarfile
+import pytest
+from dataclasses import dataclass
+from ansible_policy.backend import SubprocessBackend
+from ansible_policy.external_data import ExternalDataStore, GalaxyData, GalaxyDataDB, convert_galaxy_data, prune_galaxy_data
+from ansible_policy.utils import detect_galaxy_reference, find_module_names, load_external_data
+
+galaxy_data = {
+    "galaxy": {
+        "module_name_mappings": {"copy": ["ansible.builtin.copy"]},
+        "modules": [{"fqcn": "ansible.builtin.copy", "collection": "ansible.builtin"}],
+    }
+}
+
+
+@dataclass
+class Task(object):
+    module: str = ""
+
+
+def test_external_data_store(tmp_path):
+    path = os.path.join(str(tmp_path), "galaxy_data.json")
+    with open(path, "w") as file:
+        json.dump(galaxy_data, file)
+
+    store = ExternalDataStore()
+    ext_data = store.get(ftype="galaxy", fpath=path)
+    assert isinstance(ext_data, GalaxyData)
+    assert ext_data.modules["ansible.builtin.copy"]["collection"] == "ansible.builtin"
+    assert ext_data.find_module_fqcn("copy") == "ansible.builtin.copy"
+    assert ext_data.find_module_fqcn("unknown") == ""
+    # the same file is loaded only once
+    assert store.get(ftype="galaxy", fpath=path) is ext_data
+    assert store.loads == 1
+
+    # a modified file is loaded again
+    modified = copy.deepcopy(galaxy_data)
+    modified["galaxy"]["module_name_mappings"]["file"] = ["ansible.builtin.file"]
+    with open(path, "w") as file:
+        json.dump(modified, file)
+    os.utime(path, ns=(0, 0))
+    assert store.get(ftype="galaxy", fpath=path).find_module_fqcn("file") == "ansible.builtin.file"
+    assert store.loads == 2
+    assert store.get(ftype="galaxy", fpath="") is None
+
+
+def test_external_data_archive(tmp_path, monkeypatch):
+    data_dir = os.path.join(str(tmp_path), "data")
+    os.makedirs(data_dir)
+    path = os.path.join(data_dir, "galaxy_data.json")
+    with open(path, "w") as file:
+        json.dump(galaxy_data, file)
+    archive_path = os.path.join(str(tmp_path), "galaxy_data.json.tar.gz")
+    with tarfile.open(archive_path, "w:gz") as tar:
+        tar.add(path, arcname="galaxy_data.json")
+
+    work_dir = os.path.join(str(tmp_path), "work")
+    os.makedirs(work_dir)
+    monkeypatch.chdir(work_dir)
+    ext_data = ExternalDataStore().get(ftype="galaxy", fpath=archive_path)
+    assert ext_data.find_module_fqcn("copy") == "ansible.builtin.copy"
+    # the archive is not extracted
+    assert os.listdir(work_dir) == []
+    assert sorted(os.listdir(str(tmp_path))) == ["data", "galaxy_data.json.tar.gz", "work"]
+
+
+def test_galaxy_database(tmp_path):
+    path = os.path.join(str(tmp_path), "galaxy_data.json")
+    with open(path, "w") as file:
+        json.dump(galaxy_data, file)
+    db_path = os.path.join(str(tmp_path), "galaxy_data.sqlite3")
+    convert_galaxy_data(src=path, dst=db_path)
+
+    store = ExternalDataStore()
+    db = store.get(ftype="galaxy", fpath=db_path)
+    assert isinstance(db, GalaxyDataDB)
+    assert db.find_module_fqcn("copy") == "ansible.builtin.copy"
+    assert db.find_module_fqcn("unknown") == ""
+    assert "ansible.builtin.copy" in db.modules
+    assert db.module_name_mappings.get("unknown", []) == []
+    # `modules` has the same shape as the original data
+    assert db.to_dict() == galaxy_data["galaxy"]
+
+    # OPA gets the same data as a JSON file
+    json_path = store.get_opa_data_path(db_path)
+    with open(json_path, "r") as file:
+        assert json.load(file) == {"galaxy": db.to_dict()}
+    assert store.get_opa_data_path(db_path) == json_path
+    assert store.get_opa_data_path(path) == path
+
+
+def test_galaxy_database_export(tmp_path):
+    # the exported JSON is the same as `to_dict()` for both shapes of `modules` and with extra keys
+    for modules in [galaxy_data["galaxy"]["modules"], {m["fqcn"]: m for m in galaxy_data["galaxy"]["modules"]}]:
+        path = os.path.join(str(tmp_path), "galaxy_data.json")
+        with open(path, "w") as file:
+            json.dump({"galaxy": {**galaxy_data["galaxy"], "modules": modules, "version": "1.0"}}, file)
+        db_path = os.path.join(str(tmp_path), "galaxy_data.sqlite3")
+        convert_galaxy_data(src=path, dst=db_path)
+        store = ExternalDataStore()
+        json_path = store.get_opa_data_path(db_path)
+        with open(json_path, "r") as file:
+            assert json.load(file) == {"galaxy": {**galaxy_data["galaxy"], "modules": modules, "version": "1.0"}}
+
+
+def test_load_external_data(tmp_path):
+    path = os.path.join(str(tmp_path), "galaxy_data.json")
+    with open(path, "w") as file:
+        json.dump(galaxy_data, file)
+    db_path = os.path.join(str(tmp_path), "galaxy_data.sqlite3")
+    convert_galaxy_data(src=path, dst=db_path)
+
+    # the database is returned as it is, and only the modules looked up are read
+    db = load_external_data(ftype="galaxy", fpath=db_path)
+    assert isinstance(db, GalaxyDataDB)
+    assert db.find_module_fqcn("copy") == "ansible.builtin.copy"
+    assert list(db.module_name_mappings._memo) == list(db.modules._memo) == ["copy"]
+    assert load_external_data(ftype="galaxy", fpath="") is None
+
+
+def test_prune_galaxy_data():
+    galaxy = GalaxyData.from_dict(galaxy_data["galaxy"])
+    tasks = [Task(module="copy"), Task(module="ansible.builtin.copy")]
+    shared = {"playbooks": {"site.yml": {"tasks": [{"module": "file"}, tasks[0]]}}}
+    module_names = find_module_names([{"task": tasks[0], "_agk": shared}, {"task": tasks[1], "_agk": shared}])
+    assert module_names == {"copy", "ansible.builtin.copy", "file"}
+    assert prune_galaxy_data(galaxy=galaxy, module_names=module_names) == {
+        "galaxy": {
+            "module_name_mappings": {"copy": ["ansible.builtin.copy"]},
+            "modules": [galaxy.modules["ansible.builtin.copy"]],
+        }
+    }
+
+    # `modules` keeps its shape in the pruned data
+    galaxy = GalaxyData.from_dict({**galaxy_data["galaxy"], "modules": {m["fqcn"]: m for m in galaxy_data["galaxy"]["modules"]}})
+    assert prune_galaxy_data(galaxy=galaxy, module_names=module_names)["galaxy"]["modules"] == {
+        "ansible.builtin.copy": galaxy.modules["ansible.builtin.copy"],
+    }
+
+
+fqcn_policy = """package check_fqcn
+
+import data.ansible_policy.get_module_fqcn
+
+fqcn := get_module_fqcn(input.task)
+"""
+
+
+@pytest.mark.skipif(shutil.which("opa") is None, reason="`opa` command is required")
+def test_pruned_data_decisions(tmp_path):
+    rego_path = os.path.join(str(tmp_path), "check_fqcn.rego")
+    with open(rego_path, "w") as file:
+        file.write(fqcn_policy)
+    backend = SubprocessBackend()
+    for modules in [galaxy_data["galaxy"]["modules"], {m["fqcn"]: m for m in galaxy_data["galaxy"]["modules"]}]:
+        data = {"galaxy": {**galaxy_data["galaxy"], "modules": modules}}
+        full_path = os.path.join(str(tmp_path), "full.json")
+        with open(full_path, "w") as file:
+            json.dump(data, file)
+        pruned_path = os.path.join(str(tmp_path), "pruned.json")
+        with open(pruned_path, "w") as file:
+            json.dump(prune_galaxy_data(GalaxyData.from_dict(data["galaxy"]), module_names={"copy", "ansible.builtin.copy"}), file)
+        for module in ["copy", "ansible.builtin.copy"]:
+            input_data = json.dumps({"task": {"module": module}})
+            full = backend.eval_policy(rego_path=rego_path, input_data=input_data, external_data_path=full_path)
+            pruned = backend.eval_policy(rego_path=rego_path, input_data=input_data, external_data_path=pruned_path)
+            assert full["value"] == pruned["value"]
+
+
+def test_detect_galaxy_reference():
+    assert not detect_galaxy_reference("package p\nimport data.ansible_policy.get_module_fqcn\nx := get_module_fqcn(input.task)\n")
+    assert not detect_galaxy_reference("package p\nx := input.data.galaxy\n")
+    assert detect_galaxy_reference("package p\nx := data.galaxy.modules\n")
+    assert detect_galaxy_reference('package p\nx := data["galaxy"]\n')
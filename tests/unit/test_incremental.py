@@ -0,0 +1,140 @@
+import os
+import time
+import asyncio
+import pytest
+from ansible_policy import cache
+from ansible_policy.incremental import IncrementalState, make_file_manifest, diff_manifests, make_fingerprint
+
+
+def write_file(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(body)
+
+
+def test_file_manifest(tmp_path):
+    project_dir = str(tmp_path / "project")
+    write_file(os.path.join(project_dir, "playbook.yml"), "- hosts: all\n")
+    write_file(os.path.join(project_dir, "roles/sample/tasks/main.yml"), "- debug: msg=a\n")
+    write_file(os.path.join(project_dir, ".git/HEAD"), "ref: refs/heads/main\n")
+    write_file(os.path.join(project_dir, ".state/state.json"), "{}")
+
+    manifest = make_file_manifest(project_dir=project_dir, exclude_dirs=[os.path.join(project_dir, ".state")])
+    assert sorted(manifest) == ["playbook.yml", "roles/sample/tasks/main.yml"]
+    assert diff_manifests(old=manifest, new=make_file_manifest(project_dir=project_dir, previous=manifest)) == [
+        ".state/state.json",
+    ]
+
+    write_file(os.path.join(project_dir, "roles/sample/tasks/main.yml"), "- debug: msg=b\n")
+    write_file(os.path.join(project_dir, "site.yml"), "- import_playbook: playbook.yml\n")
+    os.remove(os.path.join(project_dir, "playbook.yml"))
+    new_manifest = make_file_manifest(project_dir=project_dir, previous=manifest, exclude_dirs=[os.path.join(project_dir, ".state")])
+    assert diff_manifests(old=manifest, new=new_manifest) == ["playbook.yml", "roles/sample/tasks/main.yml", "site.yml"]
+
+
+def test_incremental_state(tmp_path, monkeypatch):
+    state_dir = str(tmp_path / "state")
+    assert IncrementalState.load(state_dir=state_dir) is None
+
+    fingerprint = make_fingerprint(policies=["a", "b"], external_data="")
+    assert fingerprint == make_fingerprint(external_data="", policies=["a", "b"])
+    assert fingerprint != make_fingerprint(policies=["b", "a"], external_data="")
+    # a new version of ansible-policy or `rego/utils.rego` invalidates the state
+    monkeypatch.setattr(cache, "_engine_hash", "other")
+    assert fingerprint != make_fingerprint(policies=["a", "b"], external_data="")
+
+    state = IncrementalState(fingerprint=fingerprint, manifest={"playbook.yml": [1, 2, "x"]}, result={"summary": None, "files": []})
+    state.save(state_dir=state_dir)
+    loaded = IncrementalState.load(state_dir=state_dir)
+    assert loaded == state
+    assert os.listdir(state_dir) == ["state.json"]
+
+
+def scan_playbooks(project_dir: str, scanned: list):
+    # a scanner which reads each playbook as a list of `- name: <name>` tasks, and records the scanned playbooks
+    from ansible_policy.rego_data import PolicyInput, Playbook, Task
+
+    base_input = PolicyInput(type="project", variables={"v": 1}, tree_variables={})
+    for filename in sorted(os.listdir(project_dir)):
+        if not filename.endswith(".yml"):
+            continue
+        with open(os.path.join(project_dir, filename), "r") as file:
+            names = [line.split(":", 1)[1].strip() for line in file if line.startswith("- name:")]
+        tasks = []
+        for i, name in enumerate(names):
+            task = Task(key=f"task {filename} {i}", name=name, filepath=filename, yaml_lines=f"- name: {name}\n  debug:\n")
+            task.line_num_in_file = [2 * i + 1, 2 * i + 2]
+            tasks.append(task)
+        key = f"playbook {filename}"
+        base_input.playbooks[filename] = Playbook(key=key, filepath=filename, tasks=tasks)
+        base_input.tree_variables[key] = {"v": 1}
+        scanned.append(filename)
+    tasks = [task for playbook in base_input.playbooks.values() for task in playbook.tasks]
+    return {"task": [base_input.make_target_input(input_type="task", task=task) for task in tasks]}
+
+
+def test_incremental_changed_playbook(tmp_path, monkeypatch):
+    pytest.importorskip("ansible_content_capture")
+    from ansible_policy import models
+    from ansible_policy.catalog import PolicyCatalog, PolicyMetadata
+
+    project_dir = str(tmp_path / "project")
+    for name in ["a", "b", "c"]:
+        write_file(os.path.join(project_dir, f"{name}.yml"), f"- name: {name}-ok\n  debug:\n- name: {name}-ok\n  debug:\n")
+    scanned = []
+    evaluated = []
+
+    def eval_targets(targets, policy_files, external_data_path=""):
+        evaluated.extend([target.filepath for target in targets])
+        return {(i, "p.rego"): (True, {"value": {"deny": "bad" in t.input_data.task.name}}) for i, t in enumerate(targets)}
+
+    monkeypatch.setattr(models, "validate_opa_installation", lambda: None)
+    monkeypatch.setattr(models, "load_input_from_project_dir", lambda project_dir, variables: scan_playbooks(project_dir, scanned))
+    catalog = PolicyCatalog(policies={"p.rego": PolicyMetadata(path="p.rego", package="p", target="task", hash="h", reads_agk=False)})
+    evaluator = models.PolicyEvaluator(catalog=catalog, cache_size=0, incremental_dir=str(tmp_path / "state"))
+    monkeypatch.setattr(evaluator, "list_enabled_policies", lambda: ["p.rego"])
+    monkeypatch.setattr(evaluator, "eval_targets", eval_targets)
+
+    async def aeval_targets(**kwargs):
+        return eval_targets(**kwargs)
+
+    monkeypatch.setattr(evaluator, "aeval_targets", aeval_targets)
+
+    result = evaluator.run(eval_type="project", project_dir=project_dir)
+    assert scanned == ["a.yml", "b.yml", "c.yml"]
+    assert result.summary.files["not_validated"] == 0
+
+    # only the edited playbook is scanned and evaluated, and the results of the others are carried forward
+    time.sleep(0.01)
+    write_file(os.path.join(project_dir, "b.yml"), "- name: b-ok\n  debug:\n- name: b-bad\n  debug:\n- name: b-ok\n  debug:\n")
+    scanned.clear()
+    evaluated.clear()
+    result = evaluator.run(eval_type="project", project_dir=project_dir)
+    assert scanned == ["b.yml"]
+    assert evaluated == [os.path.join(project_dir, "b.yml")] * 3
+    assert [f.path for f in result.files] == [os.path.join(project_dir, f"{name}.yml") for name in ["a", "b", "c"]]
+    assert [f.violation for f in result.files] == [False, True, False]
+    assert [len(f.policies[0].targets) for f in result.files] == [2, 3, 2]
+    assert result.summary.files["not_validated"] == 1
+
+    # the merged result is the same as the result of a full evaluation
+    incremental_dir, evaluator.incremental_dir = evaluator.incremental_dir, ""
+    assert evaluator.run(eval_type="project", project_dir=project_dir).to_dict() == result.to_dict()
+    evaluator.incremental_dir = incremental_dir
+
+    # a policy which reads the project context needs the whole project to be scanned
+    catalog.policies["p.rego"].reads_agk = True
+    write_file(os.path.join(project_dir, "c.yml"), "- name: c-bad\n  debug:\n")
+    scanned.clear()
+    result = evaluator.run(eval_type="project", project_dir=project_dir)
+    assert scanned == ["a.yml", "b.yml", "c.yml"]
+    assert result.summary.files["not_validated"] == 2
+
+    # the same for `arun()`
+    catalog.policies["p.rego"].reads_agk = False
+    time.sleep(0.01)
+    write_file(os.path.join(project_dir, "a.yml"), "- name: a-bad\n  debug:\n")
+    scanned.clear()
+    result = asyncio.run(evaluator.arun(eval_type="project", project_dir=project_dir))
+    assert scanned == ["a.yml"]
+    assert [f.violation for f in result.files] == [True, True, True]
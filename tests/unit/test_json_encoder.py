@@ -0,0 +1,74 @@
+import json
+import jsonpickle
+import pytest
+from dataclasses import dataclass, field
+from ansible_policy import json_encoder
+from ansible_policy.json_encoder import encode_json
+
+
+@dataclass
+class Inner(object):
+    name: str = ""
+    options: dict = field(default_factory=dict)
+
+
+@dataclass
+class Outer(object):
+    inner: Inner = None
+    items: list = field(default_factory=list)
+    other: any = None
+
+
+class Text(str):
+    pass
+
+
+def make_value():
+    text = Text("text")
+    text.line = 3
+    inner = Inner(name="é", options={"a": [1, 2.5, None, True], "b": (1, "x"), "c": {"d": {}}})
+    outer = Outer(inner=inner, items=[inner, inner, {"n": float("nan")}, {1: "int key"}], other=text)
+    outer.extra = {3}
+    return {"_agk": outer, "x": [Inner(), "s"]}
+
+
+def test_encode_json(monkeypatch):
+    monkeypatch.setattr(json_encoder, "orjson", None)
+    value = make_value()
+    expected = jsonpickle.encode(value, unpicklable=False, make_refs=False, separators=(",", ":"))
+    # NaN is written as null like orjson does
+    assert encode_json(value, plain_types=(Inner, Outer)) == expected.replace("NaN", "null")
+
+
+def test_encode_json_non_finite(monkeypatch):
+    # `Inner` is not a plain type here, so it is encoded by jsonpickle
+    value = {"a": [float("nan"), float("inf"), -float("inf"), 1.5], "b": Inner(name="x", options={"n": float("nan")})}
+    expected = {"a": [None, None, None, 1.5], "b": {"name": "x", "options": {"n": None}}}
+    assert json.loads(encode_json(value)) == expected
+    monkeypatch.setattr(json_encoder, "orjson", None)
+    assert encode_json(value) == json.dumps(expected, separators=(",", ":"))
+
+    # the same in the fallback of a reference cycle
+    cycle = {"n": float("nan"), "a": Outer()}
+    cycle["a"].items.append(cycle)
+    assert "NaN" not in encode_json(cycle, plain_types=(Inner, Outer))
+
+
+def test_encode_json_orjson():
+    if json_encoder.orjson is None:
+        pytest.skip("orjson is not installed")
+    value = make_value()
+    expected = json.loads(encode_json(value, plain_types=(Inner, Outer)))
+    assert expected["_agk"]["items"][2] == {"n": None}
+    # the same value as the JSON without orjson
+    value["_agk"].items[2] = {"n": None}
+    assert expected == json.loads(jsonpickle.encode(value, unpicklable=False, make_refs=False, separators=(",", ":")))
+    # a non-string key is encoded without orjson
+    assert "int key" in encode_json({1: "int key"})
+
+
+def test_encode_json_cycle():
+    value = {"a": Outer()}
+    value["a"].items.append(value)
+    expected = jsonpickle.encode(value, unpicklable=False, make_refs=False)
+    assert encode_json(value, plain_types=(Inner, Outer)) == json.dumps(json.loads(expected), separators=(",", ":"))
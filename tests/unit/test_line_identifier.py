@@ -0,0 +1,43 @@
+import os
+import pytest
+
+pytest.importorskip("ansible_content_capture")
+
+from ansible_policy.models import LineIdentifier  # noqa: E402
+from ansible_policy.rego_data import Task, Play  # noqa: E402
+
+playbook = """- hosts: all
+  tasks:
+    - name: first
+      ansible.builtin.shell: echo 1
+
+    - name: second
+      ansible.builtin.shell: echo 2
+"""
+
+
+def test_line_identifier(tmp_path):
+    path = os.path.join(str(tmp_path), "playbook.yml")
+    with open(path, "w") as file:
+        file.write(playbook)
+
+    identifier = LineIdentifier()
+    # the line range of the scanner is used as it is
+    task = Task(name="second", module="ansible.builtin.shell", line_num_in_file=[6, 7], yaml_lines="- name: second\n  ansible.builtin.shell: echo 2")
+    block = identifier.find_block_in_file(filepath=path, obj=task)
+    assert block.to_dict() == {"begin": 6, "end": 7}
+
+    # a range which does not match the file is searched again
+    task.line_num_in_file = [3, 4]
+    block = identifier.find_block_in_file(filepath=path, obj=task)
+    assert block.to_dict() == {"begin": 6, "end": 7}
+
+    task = Task(name="first", module="ansible.builtin.shell")
+    block = identifier.find_block_in_file(filepath=path, obj=task)
+    assert block.to_dict() == {"begin": 3, "end": 5}
+
+    block = identifier.find_block_in_file(filepath=path, obj=Play(options={"hosts": "all"}))
+    assert block.to_dict() == {"begin": 1, "end": 7}
+
+    assert (identifier.scanned, identifier.searches, identifier.fallbacks) == (1, 3, 0)
+    assert identifier.file_cache.reads == 1
@@ -0,0 +1,122 @@
+import os
+import json
+import glob
+import yaml
+import pytest
+from ansible_policy.catalog import PolicyMetadata
+from ansible_policy.policybook.json_generator import generate_dict_policysets
+from ansible_policy.policybook.policy_parser import parse_policy_sets
+from ansible_policy.policybook.transpiler import PolicyTranspiler
+from ansible_policy.policybook.native_evaluator import NativeCompiler, NativeCompileError, find_input_paths
+from ansible_policy.utils import project_input
+
+integration_dir = os.path.join(os.path.dirname(__file__), "integration")
+test_dirs = sorted([os.path.dirname(path) for path in glob.glob(os.path.join(integration_dir, "*", "policybook.yml"))])
+
+message_policybook = """
+- name: message test
+  hosts: localhost
+  vars:
+    allowed:
+      - a
+      - b
+  policies:
+    - name: message test
+      target: task
+      condition: input.name == "x"
+      actions:
+        - deny:
+            msg: "{{ input.name }} is not in {{ allowed }}; {{ input.options }}"
+"""
+
+
+def compile_policybook(policybook_path: str):
+    with open(policybook_path, "r") as file:
+        data = yaml.safe_load(file)
+    policysets = generate_dict_policysets(parse_policy_sets(data))
+    return NativeCompiler().compile_policyset(policysets[0])
+
+
+@pytest.mark.parametrize("test_dir", test_dirs, ids=[os.path.basename(d) for d in test_dirs])
+def test_native_evaluator(test_dir):
+    policies = compile_policybook(os.path.join(test_dir, "policybook.yml"))
+    assert len(policies) == 1
+    policy = policies[0]
+    for input_file, expected in [("input_pass.json", True), ("input_fail.json", False)]:
+        with open(os.path.join(test_dir, input_file), "r") as file:
+            input_data = json.load(file)
+        result = policy.evaluate(input_data)
+        assert result["value"][policy.action] == expected
+        assert result["value"]["__target__"] == policy.target
+        assert bool(result["message"]) == expected
+
+
+def test_native_evaluator_message():
+    data = yaml.safe_load(message_policybook)
+    policy = NativeCompiler().compile_policyset(generate_dict_policysets(parse_policy_sets(data))[0])[0]
+    result = policy.evaluate({"name": "x", "options": {"b": True, "a": [1, "s"]}})
+    assert result["value"]["deny"] is True
+    assert result["value"]["allowed"] == ["a", "b"]
+    assert result["message"] == 'x is not in ["a", "b"]; {"a": [1, "s"], "b": true}\n'
+
+    # an undefined value in the message makes the whole message undefined as `sprintf()` of rego
+    result = policy.evaluate({"name": "x"})
+    assert result["message"] == "<undefined>\n"
+
+    result = policy.evaluate({"name": "y"})
+    assert result["value"]["deny"] is False
+    assert result["message"] == ""
+
+
+def test_native_policy_in_catalog(tmp_path):
+    test_dir = os.path.join(integration_dir, "in_operator")
+    PolicyTranspiler(emit_ast=True).run(os.path.join(test_dir, "policybook.yml"), str(tmp_path))
+    rego_paths = glob.glob(os.path.join(str(tmp_path), "**", "*.rego"), recursive=True)
+    assert len(rego_paths) == 1
+    policy = PolicyMetadata.load(path=rego_paths[0])
+    assert policy.native is not None
+    assert policy.native.package == policy.package
+
+    # an AST file is not used once the rego policy is modified
+    with open(rego_paths[0], "a") as file:
+        file.write("\n")
+    assert PolicyMetadata.load(path=rego_paths[0]).native is None
+
+
+def test_native_compile_error():
+    with pytest.raises(NativeCompileError):
+        NativeCompiler().compile_policyset({})
+
+
+@pytest.mark.parametrize("test_dir", test_dirs, ids=[os.path.basename(d) for d in test_dirs])
+def test_projected_input(test_dir):
+    with open(os.path.join(test_dir, "policybook.yml"), "r") as file:
+        data = yaml.safe_load(file)
+    policy_ast = generate_dict_policysets(parse_policy_sets(data))[0]["PolicySet"]["policies"][0]["Policy"]
+    input_paths = find_input_paths(policy_ast)
+    assert input_paths
+    policy = NativeCompiler().compile_policy(policy=policy_ast, vars=data[0].get("vars"))
+    for input_file in ["input_pass.json", "input_fail.json"]:
+        with open(os.path.join(test_dir, input_file), "r") as file:
+            input_data = json.load(file)
+        # a policy gets the same decision from the input which has only the paths it reads
+        assert policy.evaluate(project_input(data=input_data, input_paths=input_paths)) == policy.evaluate(input_data)
+
+
+def test_find_input_paths():
+    data = yaml.safe_load(message_policybook)
+    policy_ast = generate_dict_policysets(parse_policy_sets(data))[0]["PolicySet"]["policies"][0]["Policy"]
+    assert find_input_paths(policy_ast) == [["name"], ["options"]]
+
+    policy_ast["condition"] = {"KeyNotInDictExpression": {"lhs": {"Input": "input"}, "rhs": {"String": "become_user"}}}
+    assert find_input_paths(policy_ast) == [["become_user"], ["name"], ["options"]]
+
+    policy_ast["condition"] = {"EqualsExpression": {"lhs": {"Input": "input"}, "rhs": {"Boolean": True}}}
+    assert find_input_paths(policy_ast) is None
+
+
+def test_project_input():
+    data = {"a": {"b": 1, "c": [1, 2]}, "d": None, "_agk": PolicyMetadata(path="x.rego", target="task")}
+    assert project_input(data=data, input_paths=[["a", "b"], ["d"], ["e"]]) == {"a": {"b": 1}, "d": None}
+    assert project_input(data=data, input_paths=[["a", "c", 0], ["a"]]) == {"a": data["a"]}
+    assert project_input(data=data, input_paths=[["_agk", "target"]]) == {"_agk": {"target": "task"}}
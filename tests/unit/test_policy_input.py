@@ -0,0 +1,98 @@
+import os
+import glob
+import json
+import shutil
+import pytest
+
+pytest.importorskip("ansible_content_capture")
+
+from ansible_policy import models  # noqa: E402
+from ansible_policy.catalog import PolicyCatalog  # noqa: E402
+from ansible_policy.policybook.transpiler import PolicyTranspiler  # noqa: E402
+from ansible_policy.rego_data import PolicyInput, Task  # noqa: E402
+
+input_attrs = [
+    "type",
+    "source",
+    "project",
+    "playbooks",
+    "taskfiles",
+    "roles",
+    "task",
+    "play",
+    "role",
+    "task_result",
+    "event",
+    "rest",
+    "vars_files",
+    "extra_vars",
+    "variables",
+]
+
+
+def test_policy_input_json():
+    base_input = PolicyInput(type="project", variables={"user": "admin"})
+    task = Task(name="x", module="ansible.builtin.shell", yaml_lines="- name: x\n  ansible.builtin.shell: echo {{ user }}")
+    p_input = base_input.make_target_input(input_type="task", task=task)
+
+    # the shared context is not a part of the input
+    data = json.loads(p_input.to_json())
+    assert data["ansible.builtin.shell"] == "echo admin"
+    assert list(data["_agk"]) == input_attrs
+    object_data = json.loads(p_input.to_object_json())
+    assert [key for key in object_data if key != "py/object"] == input_attrs
+    assert PolicyInput.from_object_json(p_input.to_object_json()) == p_input
+
+    # the published context is not embedded again
+    key, _ = p_input.publish_context()
+    assert json.loads(p_input.to_json())["_agk"] == {"type": "task", "task": data["_agk"]["task"], "play": None, "role": None, "project_key": key}
+    assert key not in p_input.to_object_json()
+    assert "shared_context" not in repr(p_input)
+
+
+context_policybook = """
+- name: check extra vars
+  hosts: localhost
+  policies:
+    - name: check_extra_vars
+      target: task
+      condition: input._agk.extra_vars.env == "prod"
+      actions:
+        - deny:
+            msg: "{{ input.name }} runs in prod"
+"""
+
+
+def test_agk_context_parity(tmp_path, monkeypatch):
+    policybook_path = os.path.join(str(tmp_path), "policybook.yml")
+    with open(policybook_path, "w") as file:
+        file.write(context_policybook)
+    PolicyTranspiler(emit_ast=True).run(policybook_path, str(tmp_path / "policies"))
+    rego_path = glob.glob(os.path.join(str(tmp_path), "policies", "**", "*.rego"), recursive=True)[0]
+    if not shutil.which("opa"):
+        monkeypatch.setattr(models, "validate_opa_installation", lambda: None)
+    evaluator = models.PolicyEvaluator(catalog=PolicyCatalog.load([rego_path]), backend_type="subprocess", eval_mode="batch", cache_size=0)
+    policy = evaluator.catalog.get(rego_path)
+    # the transpiled policy reads the project context from `input._agk` without `agk_project()`
+    assert policy.reads_agk_context
+
+    base_input = PolicyInput(type="project", extra_vars={"env": "prod"})
+    task = Task(name="x", module="ansible.builtin.shell", yaml_lines="- name: x\n  ansible.builtin.shell: echo")
+    targets = [models.EvaluationTarget(input_type="task", input_data=base_input.make_target_input(input_type="task", task=task))]
+    project_keys = evaluator.publish_project_data(targets=targets)
+    try:
+        _, units = evaluator.plan_units(targets=targets, policy_files=[rego_path])
+    finally:
+        evaluator.unpublish_project_data(keys=project_keys)
+
+    # OPA gets the context in `_agk` even though it is published as data, so it decides the same as the native evaluator
+    input_json = units[0].kwargs["input_data_list"][0]
+    assert json.loads(input_json)["_agk"]["extra_vars"] == {"env": "prod"}
+    native_input = evaluator.make_native_input(input_data=targets[0].input_data, input_json=targets[0].input_data.to_json(), contexts={})
+    expected = policy.native.evaluate(native_input)
+    assert expected["value"]["deny"] is True
+    assert policy.native.evaluate(json.loads(input_json)) == expected
+    if shutil.which("opa"):
+        decisions = evaluator.eval_targets(targets=targets, policy_files=[rego_path])
+        assert decisions[(0, rego_path)][1]["value"]["deny"] is True
+    evaluator.close()
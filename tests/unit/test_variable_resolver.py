@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("ansible_content_capture")
+
+from ansible_policy.rego_data import PolicyInput, Task, VariableResolver, recursive_resolve_variable  # noqa: E402
+
+variables = {
+    "user": "admin",
+    "home": "/home/{{ user }}",
+    "path": "{{ home }}/bin",
+    "pkgs": ["a", "b"],
+    "one": ["x"],
+    "loop_a": "{{ loop_b }}",
+    "loop_b": "prefix-{{ loop_a }}",
+}
+
+
+def test_variable_resolver():
+    resolver = VariableResolver(variables=variables)
+    assert resolver.resolve_single("{{ path }}") == "/home/admin/bin"
+    assert resolver.resolve_single("{{ user }}:{{ home }}") == "admin:/home/admin"
+    assert resolver.resolve_single("{{ pkgs }}") == ["a", "b"]
+    assert resolver.resolve_single("pkg-{{ pkgs }}") == ["pkg-a", "pkg-b"]
+    assert resolver.resolve_single("{{ one }}") == "x"
+    assert resolver.resolve_single("{{ undefined }}") == "{{ undefined }}"
+    assert resolver.resolve({"a": ["{{ user }}", 1], "b": None}) == {"a": ["admin", 1], "b": None}
+
+    # the same template is parsed and resolved only once
+    misses = resolver.resolve_misses
+    assert resolver.resolve_single("{{ path }}") == "/home/admin/bin"
+    assert resolver.resolve_misses == misses
+    assert resolver.resolve_hits > 0
+
+
+def test_variable_resolver_cycle():
+    resolver = VariableResolver(variables=variables)
+    # a self-referencing variable stops instead of recursing forever
+    assert resolver.resolve_single("{{ loop_a }}") == "prefix-{{ loop_a }}"
+    assert resolver.cycles > 0
+    assert recursive_resolve_variable({"x": "{{ loop_b }}"}, variables) == {"x": "prefix-{{ loop_b }}"}
+
+
+def test_shared_variable_resolver():
+    base_input = PolicyInput(type="project", variables=variables)
+    task = Task(name="x", module="ansible.builtin.shell", yaml_lines="- name: x\n  ansible.builtin.shell: echo {{ path }}")
+    inputs = [base_input.make_target_input(input_type="task", task=task) for _ in range(2)]
+
+    # the targets of a project share the resolver of their shared context
+    assert [p_input.get_target_data()["ansible.builtin.shell"] for p_input in inputs] == ["echo /home/admin/bin"] * 2
+    resolver = base_input.shared_context.resolver
+    assert inputs[1].get_variable_resolver() is resolver
+    assert resolver.resolve_hits > 0
+    # the resolver is not a part of the input
+    assert "resolve_hits" not in inputs[0].to_object_json()
+    assert "resolve_hits" not in inputs[0].to_json()
+
+    # it is dropped when the run releases it, and the next run gets a new one
+    assert base_input.shared_context.release_resolver() is resolver
+    assert base_input.shared_context.resolver is None
+    assert inputs[0].get_variable_resolver() is not resolver
+
+    # an input without a shared context resolves with its own resolver
+    assert PolicyInput(variables=variables).get_variable_resolver() is not PolicyInput(variables=variables).get_variable_resolver()
@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+import pytest
+
+pytest.importorskip("ansible_content_capture")
+
+from watchdog.events import FileModifiedEvent, FileMovedEvent, FileOpenedEvent  # noqa: E402
+from ansible_policy.models import Source  # noqa: E402
+from ansible_policy.watch import PolicyWatcher, ChangeHandler  # noqa: E402
+
+
+class Evaluator(object):
+    # records the calls from the watcher instead of evaluating the project
+    def __init__(self, policy_dir: str, cache_dir: str):
+        self.sources = [Source(name="policy", source=policy_dir, type="path")]
+        self.incremental_dir = ""
+        self.cache_dir = cache_dir
+        self.reloaded = 0
+        self.runs = 0
+
+    def reload_policies(self):
+        self.reloaded += 1
+
+    def run(self, **kwargs):
+        self.runs += 1
+        return kwargs
+
+    def run_project(self, state, **kwargs):
+        # records the changes given to the run, and makes a state as the evaluator does
+        self.runs += 1
+        self.changes = (state.previous is not None, state.changed_files)
+        state.units = {"playbook site.yml": {}}
+        state.previous = None
+        return kwargs
+
+
+def test_watcher_events(tmp_path):
+    project_dir = str(tmp_path / "project")
+    policy_dir = str(tmp_path / "policies")
+    evaluator = Evaluator(policy_dir=policy_dir, cache_dir=os.path.join(project_dir, ".cache"))
+    watcher = PolicyWatcher(evaluator=evaluator, project_dir=project_dir, debounce=0.3)
+    handler = ChangeHandler(watcher=watcher)
+
+    # events which do not modify files, and files in `.git` and the cache directory are ignored
+    handler.dispatch(FileOpenedEvent(os.path.join(project_dir, "site.yml")))
+    handler.dispatch(FileModifiedEvent(os.path.join(project_dir, ".git", "index")))
+    handler.dispatch(FileModifiedEvent(os.path.join(project_dir, ".cache", "decisions.sqlite3")))
+    assert not watcher._event.is_set()
+
+    # a burst of events is debounced into a single evaluation
+    def write_files():
+        for i in range(3):
+            handler.dispatch(FileModifiedEvent(os.path.join(project_dir, f"play{i}.yml")))
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=write_files)
+    start = time.monotonic()
+    thread.start()
+    changed_paths = watcher.wait_for_changes()
+    thread.join()
+    assert time.monotonic() - start >= 0.4
+    assert changed_paths == [os.path.join(project_dir, f"play{i}.yml") for i in range(3)]
+
+    watcher.evaluate(changed_paths=changed_paths)
+    assert (evaluator.runs, evaluator.reloaded) == (1, 0)
+    assert evaluator.changes == (False, [])
+
+    # the next evaluation gets the previous state and the changed files in the project
+    os.makedirs(os.path.join(project_dir, "roles"))
+    watcher.evaluate(changed_paths=[os.path.join(project_dir, "roles"), os.path.join(project_dir, "play0.yml")])
+    assert evaluator.changes == (True, ["play0.yml"])
+    assert evaluator.runs == 2
+
+    # a change in the policy directory reloads the policies before the evaluation
+    handler.dispatch(FileMovedEvent(os.path.join(policy_dir, "a.rego.tmp"), os.path.join(policy_dir, "a.rego")))
+    changed_paths = watcher.wait_for_changes()
+    assert changed_paths == [os.path.join(policy_dir, "a.rego"), os.path.join(policy_dir, "a.rego.tmp")]
+    watcher.evaluate(changed_paths=changed_paths)
+    assert (evaluator.runs, evaluator.reloaded) == (3, 1)
+    # the whole project is evaluated again with the new policies
+    assert evaluator.changes == (False, [])
+
+    watcher.stop()
+    assert watcher.wait_for_changes() == []
@@ -0,0 +1,99 @@
+from ansible_policy.yaml_index import YamlPositionIndex
+from ansible_policy.utils import find_task_line_number, find_play_line_number, rank_code_blocks
+
+playbook = """---
+- hosts: all
+  tasks:
+    - name: install
+      ansible.builtin.package:
+        name: nginx
+      # a comment
+
+    - ansible.builtin.debug:
+        msg: x
+    - ansible.builtin.debug:
+        msg: y
+-
+  name: second play
+  hosts: web
+  tasks:
+  - block:
+    - name: list
+      command: ls
+    - {name: print, command: pwd}
+  - name: install
+    ansible.builtin.package:
+      name: httpd
+"""
+
+taskfile = """- name: first
+  ansible.builtin.shell: echo 1
+- name: second
+  ansible.builtin.shell: echo 2
+"""
+
+
+def test_yaml_index_tasks():
+    index = YamlPositionIndex.build(playbook)
+    assert [(t.begin, t.end) for t in index.tasks] == [(4, 8), (9, 10), (11, 12), (17, 20), (18, 19), (20, 20), (21, 23)]
+
+    # the same range as the line search
+    _, lines = find_task_line_number(yaml_body=playbook, task_name="list", module_name="command", module_options="ls")
+    assert index.find_task(task_name="list", module_name="command", module_options="ls").begin == lines[0]
+    assert index.find_task(task_name="list").end == lines[1]
+
+    # tasks with the same name are told apart by the module options
+    block = index.find_task(task_name="install", module_name="ansible.builtin.package", module_options={"name": "httpd"})
+    assert (block.begin, block.end) == (21, 23)
+    block = index.find_task(module_name="ansible.builtin.debug", module_options={"msg": "y"})
+    assert (block.begin, block.end) == (11, 12)
+
+    assert index.find_task(task_name="unknown") is None
+
+    # the last block ends at the last line of the file in both
+    _, lines = find_task_line_number(yaml_body=playbook, task_name="install", module_name="ansible.builtin.package", module_options={"name": "httpd"})
+    assert lines == [21, 23]
+    body = taskfile + "- {name: last, ansible.builtin.shell: echo 3}\n"
+    block = YamlPositionIndex.build(body).find_task(task_name="last")
+    _, lines = find_task_line_number(yaml_body=body, task_name="last")
+    assert lines == [block.begin, block.end] == [5, 5]
+
+    index = YamlPositionIndex.build(taskfile)
+    assert index.plays == []
+    assert index.find_task(task_name="second").begin == 3
+
+
+def test_yaml_index_plays():
+    index = YamlPositionIndex.build(playbook)
+    assert [(p.begin, p.end) for p in index.plays] == [(2, 12), (13, 23)]
+    assert index.find_play(play_name="second play").begin == 13
+    assert index.find_play(play_options={"hosts": "web"}).begin == 13
+    assert index.find_play(play_index=0).begin == 2
+
+    # only the lines with `hosts:` are the candidates of a play without a name
+    _, lines = find_play_line_number(yaml_body=playbook, play_options={"hosts": "all"})
+    assert lines == [2, 12]
+    _, lines = find_play_line_number(yaml_body=playbook, play_name="second play")
+    assert lines == [13, 23]
+
+
+def test_yaml_index_invalid_yaml():
+    index = YamlPositionIndex.build("- name: x\n  shell: [echo\n")
+    assert index.tasks == []
+    assert index.find_task(task_name="x") is None
+
+
+def test_rank_code_blocks():
+    blocks = [("- name: x\n  shell: echo 3", 0), ("- name: x\n  # comment\n  shell: echo 1", 1), ("- name: x\n  shell: echo 2", 2)]
+    data = [{"name": "x", "shell": "echo 1"}]
+    assert [b[1] for b in rank_code_blocks(blocks, data)] == [1, 0, 2]
+    # blocks farther than the cutoff keep their order after the others
+    assert [b[1] for b in rank_code_blocks(blocks, data, score_cutoff=0)] == [1, 0, 2]
+    assert [b[1] for b in rank_code_blocks(blocks[::-1], data, score_cutoff=0)] == [1, 2, 0]
+
+    options = {"task_name": "install", "module_name": "ansible.builtin.package", "module_options": {"name": "httpd"}}
+    _, lines = find_task_line_number(yaml_body=playbook, **options)
+    assert lines[0] == 21
+    # both blocks are farther than the cutoff, so the first one is chosen
+    _, lines = find_task_line_number(yaml_body=playbook, score_cutoff=5, **options)
+    assert lines[0] == 4